@@ -1,14 +1,90 @@
+import asyncio
 import base64
+import hmac
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
 from src.adapters.logger import logger
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import  JSONResponse
+from src.adapters.azure_openai import async_openai_client
+from src.adapters.azure_document_intelligence import async_document_intelligence_client
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from src.utils_helper import _hash, _load_users, _save_users
-from src.utils import process_zip_main
-from src.models import SignupRequest, LoginRequest
+from src.utils_helper import _hash
+from src.user_store import user_store
+from src.utils import process_zip_main, iter_process_documents
+from src.ingest import UploadSource, open_upload
+from src.cache import result_cache
+from src.singleflight import single_flight
+from src.scheduler import scheduler
+from src.signature_detector import tick_detector
+from src.text_index import text_lookup_stats
+from src.mapping_batch import mapping_batcher
+from src.di_collector import analyze_collector
+from src.vendor_templates import template_store
+from src.jobs import job_manager
+from src.cpu_pool import cpu_pool
+from src.previews import preview_store
+from src.responses import FastJSONResponse, dumps
+from src.metrics import HTTP_REQUEST_SECONDS, IN_FLIGHT, loop_lag_monitor, observe_stage, registry
+from src.tracing import trace_recorder
+from config.config import Config
+from src.models import SignupRequest, LoginRequest, ProcessingOptions
 
 
-app = FastAPI(title="Invoice Parser")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Own the outbound clients and the CPU pool: pooled connections opened (and warmed)
+    and worker processes started at startup, all closed at shutdown.
+    """
+    clients = (async_openai_client, async_document_intelligence_client)
+    for client in clients:
+        await client.start()
+    warm_ups = [cpu_pool.warm_up()]
+    if Config.HTTP_WARMUP_ENABLED:
+        warm_ups.extend(client.warm_up() for client in clients)
+    await asyncio.gather(*warm_ups, return_exceptions=True)
+    loop_lag_monitor.start()
+    try:
+        yield
+    finally:
+        await loop_lag_monitor.stop()
+        await analyze_collector.close()
+        await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+        cpu_pool.close()
+
+
+app = FastAPI(title="Invoice Parser", lifespan=lifespan, default_response_class=FastJSONResponse)
+
+
+class RequestMetricsMiddleware:
+    """Record every HTTP request's latency (until the response starts) by route template and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                route = getattr(scope.get("route"), "path", "unmatched")
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"], route=route,
+                                             status=status["code"])
+            await send(message)
+
+        with IN_FLIGHT.track(kind="http_requests"):
+            await self.app(scope, receive, send_wrapper)
+
+
+app.add_middleware(RequestMetricsMiddleware)
+IN_FLIGHT.set_function(lambda: cpu_pool.stats()["in_flight"], kind="cpu_tasks")
+IN_FLIGHT.set_function(job_manager.active_count, kind="jobs")
 
 # CORS middleware (development)
 app.add_middleware(
@@ -17,41 +93,159 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
 @app.post("/signup")
 def signup(payload: SignupRequest):
     try:
-        users = _load_users()
-        if payload.name in users:
-            raise HTTPException(status_code=400, detail="User already exists")
-
-        users[payload.email] = {
-            "full_name": payload.name,
-            "password": _hash(payload.password),
-            "email": payload.email
-        }
-        _save_users(users)
-        return {"message": True}
+        created = user_store.create(email=payload.email, full_name=payload.name, password_hash=_hash(payload.password))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not created:
+        raise HTTPException(status_code=400, detail="User already exists")
+    return {"message": True}
 
 @app.post("/login_user")
 def login(payload: LoginRequest):
     try:
-        users = _load_users()
-        user = users.get(payload.email)
-
-        if user and user["password"] == _hash(payload.password):
-            return {"message": True, "User": payload.email}
-        else:
-            return {"message": False}
+        user = user_store.get(payload.email)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
+    if user and hmac.compare_digest(user["password"], _hash(payload.password)):
+        return {"message": True, "User": payload.email}
+    return {"message": False}
 
-@app.post("/upload") 
-async def upload_endpoint(model: str = Form(None), file: UploadFile = File(...)):  
+@app.get("/users/stats")
+def users_stats():
+    """Account lookups, how many were served from the in-process cache, signups and rejected duplicates."""
+    return user_store.stats()
+
+@app.get("/cache/stats")
+def cache_stats():
+    return result_cache.stats()
+
+@app.get("/singleflight/stats")
+def singleflight_stats():
+    """Deduplicated in-flight work: calls started, callers that joined an identical call, abandoned calls."""
+    return single_flight.stats()
+
+@app.get("/scheduler/stats")
+def scheduler_stats():
+    return scheduler.stats()
+
+@app.get("/cpu/stats")
+def cpu_stats():
+    """CPU process pool: tasks run, busy seconds, worker crashes (e.g. memory cap), tasks in flight."""
+    return cpu_pool.stats()
+
+@app.get("/openai/stats")
+def openai_stats():
+    """Per-target routing stats: latency, 429 rate, circuit breaker state, hedges."""
+    return async_openai_client.stats()
+
+@app.get("/di/stats")
+def di_stats():
+    """Shared DI polling loop: outstanding analyses, polls per analysis, learned durations by page count."""
+    return analyze_collector.stats()
+
+@app.get("/mapping/stats")
+def mapping_stats():
+    """How GPT text values were matched back to extracted items (exact / normalized / fuzzy / miss)."""
+    return text_lookup_stats.stats()
+
+@app.get("/mapping/batch/stats")
+def mapping_batch_stats():
+    """Batched mapping counters: requests sent, documents per request, fallbacks to single requests."""
+    return mapping_batcher.stats()
+
+@app.get("/templates/stats")
+def templates_stats():
+    """Vendor layout templates: documents mapped without GPT, templates learned / confirmed."""
+    return template_store.stats()
+
+@app.delete("/templates")
+def templates_invalidate(vendor: Optional[str] = None):
+    """Forget learned layouts: all of them, or one vendor fingerprint (e.g. "gstin:27ABCDE1234F1Z5")."""
+    return {"removed": template_store.invalidate(vendor=vendor)}
+
+@app.get("/preview/stats")
+def preview_stats():
+    """Stored preview PDFs and thumbnails: files, bytes on disk, thumbnails rendered vs served from disk."""
+    return preview_store.stats()
+
+@app.get("/signature/stats")
+def signature_stats():
+    """Local tick detector counters, including how often the vision LLM still had to decide."""
+    return tick_detector.stats()
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms, in-flight gauges, retries and throttling."""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/traces")
+def traces():
+    """Recently kept traces (slow ones, and every request that asked for one), newest first."""
+    return trace_recorder.recent()
+
+@app.get("/traces/{trace_id}")
+def get_trace(trace_id: str):
+    trace = trace_recorder.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found or not kept")
+    return trace
+
+@app.delete("/cache")
+def cache_invalidate(namespace: Optional[str] = None, key: Optional[str] = None, expired_only: bool = False):
+    """Drop cached results: everything, one namespace ("di", "mapping", "signature"), or a single key."""
+    if expired_only:
+        return {"removed": result_cache.purge_expired()}
+    return {"removed": result_cache.invalidate(namespace=namespace, key=key)}
+
+def _preview_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": f"private, max-age={Config.PREVIEW_CACHE_MAX_AGE}, immutable"}
+
+def _not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    return bool(if_none_match) and (if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(",")))
+
+@app.get("/preview/{preview_id}")
+def get_preview(preview_id: str, request: Request):
+    """The document's preview PDF; supports If-None-Match (304) and byte ranges (206) for incremental loading."""
+    path = preview_store.pdf_path(preview_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Preview not found or expired")
+    etag = f'"{preview_id}"'
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=_preview_headers(etag))
+    return FileResponse(path, media_type="application/pdf", headers=_preview_headers(etag))
+
+@app.get("/preview/{preview_id}/thumb")
+async def get_preview_thumbnail(
+    preview_id: str,
+    request: Request,
+    width: int = Query(800, ge=16, le=Config.PREVIEW_THUMB_MAX_SIDE),
+    height: int = Query(1100, ge=16, le=Config.PREVIEW_THUMB_MAX_SIDE),
+    page: int = Query(1, ge=1),
+):
+    """A JPEG of one page rendered to fit a width x height canvas (rendered once, then served from disk)."""
+    if not preview_store.valid_id(preview_id):
+        raise HTTPException(status_code=404, detail="Preview not found or expired")
+    width, height = preview_store.thumbnail_size(width, height)
+    etag = f'"{preview_id}-{page}-{width}x{height}"'
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=_preview_headers(etag))
+    try:
+        path = await preview_store.thumbnail(preview_id, page, width, height)
+    except Exception as exc:
+        logger.exception("thumbnail rendering failed: %s", exc)
+        raise HTTPException(status_code=500, detail=f"Internal error: {exc}")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Preview or page not found")
+    return FileResponse(path, media_type="image/jpeg", headers=_preview_headers(etag))
+
+def _validate_upload(file: UploadFile) -> None:
     if not file or not file.filename:
         raise HTTPException(status_code=400, detail="No file uploaded")
 
@@ -61,41 +255,203 @@ async def upload_endpoint(model: str = Form(None), file: UploadFile = File(...))
     if not any(filename.endswith(ext) for ext in allowed_exts):
         raise HTTPException(status_code=400, detail="Unsupported file type")
 
+def _processing_options(ocr_mode: Optional[str], pages: Optional[str]) -> ProcessingOptions:
     try:
-        result = await process_zip_main(upload=file, model=model)
-        
-        # Transform the response to match what frontend expects
-        transformed_result = {
-            "model": result.get("model", model),
-            "files": []  # Transform results to files array
-        }
-        
-        for item in result.get("results", []):
-            if "error" in item:
-                # Skip files with errors or include them with error info
-                continue
-                            
-            file_info = {
-                "name": item.get("file_name", ""),
-                "type": "pdf" if item.get("file_name", "").lower().endswith('.pdf') else "image",
-                "mapped_data": item.get("mapping", {}).get("mapped", {}) if item.get("mapping") else {},
-                "signature": item.get("signature_verification", None),
-                "preview": {
-                    "pdf_bytes": base64.b64encode(item.get("image_info", {}).get("bytes", b"")).decode("utf-8") 
-                     if item.get("image_info") and item.get("image_info").get("bytes") else None,
-                    "width": item.get("image_info", {}).get("width", 2000) if item.get("image_info") else 2000,
-                    "height": item.get("image_info", {}).get("height", 2000) if item.get("image_info") else 2000
+        return ProcessingOptions(
+            ocr_mode=(ocr_mode or Config.DEFAULT_OCR_MODE).lower(),
+            pages=(pages or Config.DEFAULT_PAGE_SELECTION or "").replace(" ", "").lower() or None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid processing options: {e}")
+
+def _to_file_info(item: dict) -> dict:
+    """Transform one pipeline result record into the shape the frontend expects."""
+    return {
+        "name": item.get("file_name", ""),
+        "type": "pdf" if item.get("file_name", "").lower().endswith('.pdf') else "image",
+        "mapped_data": item.get("mapping", {}).get("mapped", {}) if item.get("mapping") else {},
+        "signature": item.get("signature_verification", None),
+        "preview": _preview_ref(item.get("image_info") or {}),
+    }
+
+def _preview_ref(image_info: dict) -> dict:
+    """Where the frontend fetches the document preview (the PDF itself is not embedded any more)."""
+    preview_id = image_info.get("preview_id")
+    ref = {
+        "id": preview_id,
+        "url": f"/preview/{preview_id}" if preview_id else None,
+        "thumb_url": f"/preview/{preview_id}/thumb" if preview_id else None,
+        "width": image_info.get("width", 2000),
+        "height": image_info.get("height", 2000),
+        "pages": image_info.get("pages", []),
+    }
+    if image_info.get("bytes"):
+        ref["pdf_bytes"] = base64.b64encode(image_info["bytes"]).decode("ascii")
+    return ref
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+def _stream_format(request: Request, stream: Optional[str]) -> Optional[str]:
+    """Pick the streaming format from ?stream=ndjson|sse or the Accept header; None means a buffered JSON response."""
+    if stream:
+        fmt = stream.lower()
+        if fmt not in STREAM_MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"Unsupported stream format: {stream}")
+        return fmt
+    accept = request.headers.get("accept", "")
+    for fmt, media_type in STREAM_MEDIA_TYPES.items():
+        if media_type in accept:
+            return fmt
+    return None
+
+def _trace_requested(request: Request, trace: Optional[bool]) -> bool:
+    """A single request opts into tracing with ?trace=1 or an X-Trace: 1 header."""
+    return bool(trace) or request.headers.get("x-trace", "").lower() in ("1", "true", "yes")
+
+def _encode_stream_record(record: dict, fmt: str) -> str:
+    payload = dumps(record)
+    if fmt == "sse":
+        return f"event: {record['event']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+async def _stream_upload_results(source: UploadSource, model: str, options: ProcessingOptions, fmt: str, trace=None):
+    """Emit one record per file as soon as both its pipelines finish, then a summary record."""
+    started = time.perf_counter()
+    succeeded, failed = 0, 0
+    try:
+        with trace_recorder.activate(trace):
+            async for index, item in iter_process_documents(source.iter_documents(), model, options):
+                with observe_stage("response_build"):
+                    if "error" in item:
+                        failed += 1
+                        record = {"event": "error", "index": index, "name": item.get("file_name", ""), "error": item["error"]}
+                    else:
+                        succeeded += 1
+                        record = {"event": "file", "index": index, **_to_file_info(item)}
+                    chunk = _encode_stream_record(record, fmt)
+                yield chunk
+        yield _encode_stream_record({
+            "event": "summary",
+            "model": model,
+            "total": len(source.names),
+            "succeeded": succeeded,
+            "failed": failed,
+            "elapsed_seconds": round(time.perf_counter() - started, 3),
+        }, fmt)
+    except Exception as exc:
+        # headers are already sent, so report batch-level failures (e.g. limits) in-band
+        logger.exception("streaming upload failed: %s", exc)
+        yield _encode_stream_record({"event": "error", "error": str(getattr(exc, "detail", exc))}, fmt)
+    finally:
+        source.close()
+
+@app.post("/upload") 
+async def upload_endpoint(request: Request, model: str = Form(None), file: UploadFile = File(...),
+                          ocr_mode: Optional[str] = Form(None), pages: Optional[str] = Form(None), stream: Optional[str] = Query(None),
+                          trace: Optional[bool] = Query(None)):  
+    _validate_upload(file)
+    options = _processing_options(ocr_mode, pages)
+    fmt = _stream_format(request, stream)
+    request_trace = trace_recorder.start("upload", force=_trace_requested(request, trace), file=file.filename, model=model)
+    trace_headers = {"X-Trace-Id": request_trace.id} if request_trace else {}
+
+    if fmt:
+        # the upload must be spooled before returning: the request body is closed once streaming starts
+        try:
+            source = await open_upload(file)
+        except HTTPException:
+            raise
+        except Exception as exc:
+            logger.exception("upload failed: %s", exc)
+            raise HTTPException(status_code=500, detail=f"Internal error: {exc}")
+        return StreamingResponse(
+            _stream_upload_results(source, model, options, fmt, request_trace),
+            media_type=STREAM_MEDIA_TYPES[fmt],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **trace_headers},
+        )
+
+    try:
+        with trace_recorder.activate(request_trace):
+            result = await process_zip_main(upload=file, model=model, options=options)
+
+            with observe_stage("response_build"):
+                # Transform the response to match what frontend expects
+                transformed_result = {
+                    "model": result.get("model", model),
+                    "files": []  # Transform results to files array
                 }
-            }
-            transformed_result["files"].append(file_info)
-        
-        return JSONResponse(status_code=200, content=transformed_result)
+
+                for item in result.get("results", []):
+                    if "error" in item:
+                        # Skip files with errors or include them with error info
+                        continue
+                    transformed_result["files"].append(_to_file_info(item))
+
+        return FastJSONResponse(status_code=200, content=transformed_result, headers=trace_headers)
     except HTTPException:
         raise
     except Exception as exc:
         logger.exception("upload failed: %s", exc)
         raise HTTPException(status_code=500, detail=f"Internal error: {exc}")
 
+@app.post("/jobs", status_code=202)
+async def create_job(request: Request, model: str = Form(None), file: UploadFile = File(...), ocr_mode: Optional[str] = Form(None),
+                     pages: Optional[str] = Form(None), trace: Optional[bool] = Query(None)):
+    """Accept a zip (or single document) and process it in the background; poll /jobs/{id} for progress."""
+    _validate_upload(file)
+    options = _processing_options(ocr_mode, pages)
+    try:
+        job = await job_manager.submit(upload=file, model=model, options=options,
+                                       trace=_trace_requested(request, trace))
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.exception("job submit failed: %s", exc)
+        raise HTTPException(status_code=500, detail=f"Internal error: {exc}")
+    response = {"job_id": job.id, "status": job.status, "files": job.total}
+    if job.trace:
+        response["trace_id"] = job.trace.id
+    return response
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job.progress()
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(Config.JOB_RESULTS_PAGE_SIZE, ge=1, le=Config.JOB_RESULTS_MAX_PAGE_SIZE),
+):
+    """Finished files in completion order; failed files carry an "error" instead of mapped data."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+
+    page = job.results[offset:offset + limit]
+    files = []
+    for item in page:
+        if "error" in item:
+            files.append({"index": item["index"], "name": item.get("file_name", ""), "error": item["error"]})
+        else:
+            files.append({"index": item["index"], **_to_file_info(item)})
+
+    next_offset = offset + len(page)
+    return FastJSONResponse(status_code=200, content={
+        "job_id": job.id,
+        "status": job.status,
+        "model": job.model,
+        "offset": offset,
+        "limit": limit,
+        "available": len(job.results),
+        "total": job.total,
+        "next_offset": next_offset if next_offset < job.total else None,
+        "files": files,
+    })
+
 if __name__ == "__main__":
     import uvicorn, webbrowser
     url = "http://127.0.0.1:8000/"
@@ -0,0 +1,97 @@
+"""
+Micro-benchmark for prepare_compact_for_gpt.
+
+Compares the original per-item scorer + full sort (on item dicts) with the batched
+NumPy scorer + heap top-k, and the hierarchical line/word mode (on ExtractedItems),
+using synthetic DI-shaped items.
+
+Run from the Backend directory:
+    python -m benchmarks.bench_compact [--pages 40] [--repeat 20]
+"""
+import argparse
+import random
+import string
+import timeit
+from typing import Any, Dict, List
+
+from src.extracted_items import ExtractedItems
+from src.utils_helper import _score_text_candidate, prepare_compact_for_gpt
+
+
+def legacy_prepare_compact_for_gpt(extracted_items: List[Dict[str, Any]],
+                                   truncate_chars: int = 60,
+                                   compact_max_items: int = 60) -> List[Dict[str, Any]]:
+    """The implementation before batched scoring (per-item scoring, full sort)."""
+    best_map = {}
+    for idx, it in enumerate(extracted_items):
+        txt = (it.get("text") or "").strip()
+        if not txt:
+            continue
+        score = _score_text_candidate(txt)
+        existing = best_map.get(txt)
+        if existing is None or score > existing[0]:
+            best_map[txt] = (score, idx, txt)
+
+    candidates = list(best_map.values())
+    candidates.sort(key=lambda x: (-x[0], x[1]))
+    selected = sorted(candidates[:compact_max_items], key=lambda x: x[1])
+    return [
+        {"id": idx, "text": txt if len(txt) <= truncate_chars else (txt[:truncate_chars] + "...")}
+        for _, idx, txt in selected
+    ]
+
+
+def _random_line(rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.3:
+        label = rng.choice(["Invoice No", "Date", "PO Number", "GSTIN", "Total", "Due Date", "Amount"])
+        value = "".join(rng.choice(string.digits + "-/") for _ in range(rng.randint(4, 14)))
+        return f"{label}: {value}"
+    if kind < 0.5:
+        return f"{rng.randint(1, 99)} x Item {rng.randint(100, 999)} {rng.randint(1, 9999)}.{rng.randint(0, 99):02d}"
+    words = rng.randint(3, 14)
+    return " ".join("".join(rng.choice(string.ascii_letters) for _ in range(rng.randint(2, 10))) for _ in range(words))
+
+
+def synthetic_items(pages: int, lines_per_page: int = 60, seed: int = 7) -> List[Dict[str, Any]]:
+    """Lines then words for every page, like extract_text_and_polygons emits them."""
+    rng = random.Random(seed)
+    items: List[Dict[str, Any]] = []
+    for page in range(1, pages + 1):
+        lines = [_random_line(rng) for _ in range(lines_per_page)]
+        items.extend({"page": page, "type": "line", "text": t, "polygon": []} for t in lines)
+        items.extend({"page": page, "type": "word", "text": w, "polygon": []} for t in lines for w in t.split())
+    return items
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--max-items", type=int, default=60)
+    args = parser.parse_args()
+
+    items = synthetic_items(args.pages)
+    columnar = ExtractedItems.from_dicts(items)
+    legacy = legacy_prepare_compact_for_gpt(items, 60, args.max_items)
+    flat = prepare_compact_for_gpt(columnar, 60, args.max_items)
+    hierarchical = prepare_compact_for_gpt(columnar, 60, args.max_items, hierarchical=True)
+    assert flat == legacy, "batched scoring selected different items than the legacy implementation"
+
+    print(f"{len(items)} items ({args.pages} pages), top {args.max_items}, best of {args.repeat} runs")
+    runs = {
+        "legacy": lambda: legacy_prepare_compact_for_gpt(items, 60, args.max_items),
+        "batched": lambda: prepare_compact_for_gpt(columnar, 60, args.max_items),
+        "hierarchical": lambda: prepare_compact_for_gpt(columnar, 60, args.max_items, hierarchical=True),
+    }
+    baseline = None
+    for name, fn in runs.items():
+        best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print(f"  {name:<13} {best * 1000:8.2f} ms  ({baseline / best:4.1f}x)")
+    words_sent = sum(1 for c in hierarchical if columnar[c["id"]].type == "word")
+    print(f"  hierarchical output: {len(hierarchical)} items, {words_sent} words")
+
+
+if __name__ == "__main__":
+    main()
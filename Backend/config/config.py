@@ -5,9 +5,166 @@ class Config:
     AZURE_OPENAI_ENDPOINT = ""
     AZURE_OPENAI_KEY = ""
     AZURE_OPENAI_VERSION = ""
+    # Several deployments/regions to balance over; empty = only the endpoint above. Each entry:
+    #   {"name": "eastus", "endpoint": "...", "key": "...", "api_version": "...", "weight": 2,
+    #    "deployments": {"gpt-4.1-nano": "nano-eastus"},  # optional model -> deployment; other models are not sent here
+    #    "max_concurrency": 20, "requests_per_minute": 300, "tokens_per_minute": 150000}
+    AZURE_OPENAI_TARGETS = []
+    OPENAI_BREAKER_FAILURES = 5  # consecutive retryable failures that open a target's circuit
+    OPENAI_BREAKER_COOLDOWN_SECONDS = 30  # then a single probe request may close it again
+    OPENAI_HEDGING_ENABLED = False  # duplicate unusually slow requests on a second target
+    OPENAI_HEDGE_LATENCY_FACTOR = 3.0  # "slow" = this multiple of the target's typical latency
+    OPENAI_HEDGE_MIN_SECONDS = 2.0
 
     # ---------- Azure Document Intelligence ----------
     AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT = ""
     AZURE_DOCUMENT_INTELLIGENCE_KEY = ""
 
+    # ---------- User accounts (SQLite; users_db.json is imported once) ----------
+    USER_DB_PATH = "data/users.sqlite3"
+    USER_CACHE_SIZE = 10000  # accounts kept in memory per worker
+    USER_CACHE_TTL_SECONDS = 60  # how long another worker's password change may go unnoticed
+
+    # ---------- Result cache (memory LRU + SQLite) ----------
+    CACHE_ENABLED = True
+    CACHE_DB_PATH = "cache/results.sqlite3"
+    CACHE_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+    CACHE_TTL_SECONDS = 7 * 24 * 3600
+    SINGLE_FLIGHT_ENABLED = True  # identical work already in flight is awaited instead of repeated
+
+    # ---------- Outbound rate limits ----------
+    DI_MAX_CONCURRENCY = 15
+    DI_TRANSACTIONS_PER_SECOND = 15
+    OPENAI_MAX_CONCURRENCY = 20
+    OPENAI_REQUESTS_PER_MINUTE = 300
+    OPENAI_TOKENS_PER_MINUTE = 150000
+    OPENAI_IMAGE_TOKEN_ESTIMATE = 1000
+
+    # ---------- DI result polling ----------
+    DI_SHARED_POLLING = True  # one adaptive polling loop for all outstanding analyses
+    DI_POLLS_PER_SECOND = 40  # status requests across all outstanding analyses
+    DI_POLL_MIN_INTERVAL = 0.25
+    DI_POLL_MAX_INTERVAL = 5.0
+    DI_POLL_INITIAL_INTERVAL = 1.0  # until analyze durations have been observed
+
+    # ---------- Outbound HTTP connection pools ----------
+    HTTP_POOL_SIZE = None  # None = each service's max concurrency + HTTP_POOL_HEADROOM
+    HTTP_POOL_HEADROOM = 4  # extra connections for retries and DI result polling
+    HTTP_KEEPALIVE_SECONDS = 60
+    HTTP_CONNECT_TIMEOUT = 10
+    HTTP_READ_TIMEOUT = 120
+    HTTP2_ENABLED = True  # OpenAI only, and only when the `h2` package is installed
+    HTTP_WARMUP_ENABLED = True  # open connections at startup instead of on the first requests
+    HTTP_WARMUP_CONNECTIONS = None  # None = the service's max concurrency (1 over HTTP/2)
+    HTTP_WARMUP_TIMEOUT = 10
+
+    # ---------- Metrics (/metrics) and request traces (/traces) ----------
+    LOOP_LAG_INTERVAL_SECONDS = 0.5  # event-loop lag sampling period; 0 disables the monitor
+    LOOP_LAG_WARN_SECONDS = 0.25
+    TRACE_ENABLED = False  # trace every upload/job; otherwise only requests with ?trace=1 or "X-Trace: 1"
+    TRACE_SLOW_SECONDS = 30.0  # untraced-by-request traces are only kept when slower than this
+    TRACE_BUFFER_SIZE = 50
+
+    # ---------- Async batch jobs ----------
+    JOB_RETENTION_SECONDS = 6 * 3600
+    JOB_RESULTS_PAGE_SIZE = 50
+    JOB_RESULTS_MAX_PAGE_SIZE = 500
+
+    # ---------- Document previews (served out of band from /preview/{id}) ----------
+    PREVIEW_DIR = "cache/previews"
+    PREVIEW_TTL_SECONDS = 24 * 3600
+    PREVIEW_MAX_BYTES = 2 * 1024 * 1024 * 1024  # oldest previews/thumbnails are dropped beyond this
+    PREVIEW_PRUNE_EVERY = 100  # stored previews between clean-ups
+    PREVIEW_CACHE_MAX_AGE = 3600  # browser cache lifetime (the id is a content hash, so it never goes stale)
+    PREVIEW_THUMB_MAX_SIDE = 4096
+    PREVIEW_THUMB_STEP = 256  # requested canvases are rounded up to this grid (bounds the thumbnails per page)
+    PREVIEW_THUMB_QUALITY = 80
+    PREVIEW_INLINE_PDF = False  # also embed the base64 PDF in upload responses (older frontends)
+
+    # ---------- CPU process pool (decoding, conversion, rendering, encoding) ----------
+    CPU_POOL_ENABLED = True  # False = run the same work in threads (GIL-bound)
+    CPU_POOL_WORKERS = None  # None = one per CPU core
+    CPU_POOL_MAX_TASKS_PER_CHILD = 200  # recycle workers to release fragmented memory
+    CPU_POOL_MEMORY_LIMIT_MB = 4096  # address-space cap per worker (POSIX only); None = uncapped
+    CPU_POOL_OPEN_DOCUMENTS = 4  # decoded documents each worker keeps for follow-up operations
+    CPU_POOL_SPOOL_DIR = None  # where documents are written for the workers to open; None = system temp dir
+
+    # ---------- Upload ingest ----------
+    UPLOAD_CHUNK_SIZE = 1024 * 1024
+    UPLOAD_SPOOL_MAX_MEMORY = 32 * 1024 * 1024  # larger uploads spill to a temp file
+    UPLOAD_MAX_BYTES = 1024 * 1024 * 1024
+    ZIP_MAX_MEMBERS = 5000
+    ZIP_MAX_MEMBER_BYTES = 100 * 1024 * 1024
+    ZIP_MAX_TOTAL_BYTES = 4 * 1024 * 1024 * 1024
+    INGEST_MAX_INFLIGHT_DOCUMENTS = 32
+
+    # ---------- Signature image (vision call) ----------
+    SIGNATURE_IMAGE_DPI = 200  # effective resolution (was 100 DPI upscaled 2x)
+    SIGNATURE_IMAGE_FORMAT = "jpeg"  # png | jpeg | webp
+    SIGNATURE_IMAGE_QUALITY = 85
+    # the vision model fits images into 2048x2048 and then scales the short side to 768,
+    # so larger renders only cost upload bytes
+    SIGNATURE_IMAGE_MAX_LONG_SIDE = 2048
+    SIGNATURE_IMAGE_MAX_SHORT_SIDE = 768
+
+    # ---------- Signature region of interest ----------
+    SIGNATURE_ROI_ENABLED = True
+    SIGNATURE_ROI_PADDING_INCHES = (1.5, 1.0)  # (horizontal, vertical) around each keyword line
+    SIGNATURE_ROI_MAX_REGIONS = 2
+    SIGNATURE_ROI_MAX_AREA_FRACTION = 0.5  # above this the full page is sent instead
+    SIGNATURE_ROI_LAYOUT_WAIT_SECONDS = 30  # how long to wait for the DI layout of scanned files
+    SIGNATURE_ROI_DEFAULT_REGION = None  # e.g. (0.5, 0.6, 1.0, 1.0) as page fractions x0, y0, x1, y1
+    SIGNATURE_ROI_FULL_PAGE_RECHECK = True  # a "not signed" verdict on keyword crops is re-checked on the full page
+
+    # ---------- Local tick pre-detector (skips the vision call when confident) ----------
+    SIGNATURE_LOCAL_DETECTOR_ENABLED = True
+    SIGNATURE_TEMPLATE_MATCHING_ENABLED = False
+    SIGNATURE_TICK_TEMPLATE_PATHS = []  # grayscale tick images; synthetic ticks are used when empty
+    SIGNATURE_TEMPLATE_MATCH_DPI = 72
+    SIGNATURE_TEMPLATE_MATCH_POSITIVE = 0.8
+    SIGNATURE_TEMPLATE_MATCH_NEGATIVE = None  # e.g. 0.3 to also accept confident "not signed" verdicts
+
+    # ---------- Born-digital fast path (text layer instead of DI) ----------
+    DEFAULT_OCR_MODE = "auto"  # auto | di | local
+    TEXT_LAYER_MIN_CHARS_PER_PAGE = 40
+    TEXT_LAYER_MAX_BAD_CHAR_RATIO = 0.05
+
+    # ---------- Multi-page documents ----------
+    DEFAULT_PAGE_SELECTION = None  # None = all pages; "1-3,5" (DI syntax) or "header"
+    MAX_ANALYZE_PAGES = None  # hard cap on pages sent to DI / the mapping prompt per document
+    DI_PAGE_CHUNK_SIZE = 8  # longer selections are split and analyzed concurrently
+    HEADER_PAGE_KEYWORDS = ("invoice", "bill to", "tax invoice", "invoice no", "invoice number")
+    HEADER_PAGE_MAX_PAGES = 2  # "header" keeps at most this many matching pages
+    HEADER_PAGE_FALLBACK_PAGES = 1  # pages used when no header is found (e.g. scans)
+
+    # ---------- Mapping GPT values back to items ----------
+    FUZZY_MATCH_ENABLED = True
+    FUZZY_MATCH_MIN_SCORE = 0.75  # trigram Dice similarity needed to accept an approximate match
+    FUZZY_MATCH_MIN_CHARS = 4  # shorter normalized values must match exactly
+
+    # ---------- Mapping prompt encoding ----------
+    MAPPING_PROMPT_FORMAT = "tsv"  # tsv: token-budgeted "id<TAB>position<TAB>text" rows | json: top-60 JSON list
+    MAPPING_ITEM_TOKEN_BUDGET = 900  # estimated tokens for the item rows of one document
+    MAPPING_POSITION_HINTS = True
+    MAPPING_POSITION_GRID = (10, 4)  # (rows, columns) of the coarse position hints
+
+    # ---------- Batched mapping (several small documents per chat completion) ----------
+    MAPPING_BATCH_ENABLED = False  # needs MAPPING_PROMPT_FORMAT = "tsv"
+    MAPPING_BATCH_TOKEN_BUDGET = 6000  # item tokens per batched request; larger documents go alone
+    MAPPING_BATCH_MAX_DOCUMENTS = 10
+    MAPPING_BATCH_LINGER_SECONDS = 0.25  # how long the first document waits for company
+
+    # ---------- Vendor layout templates (repeat suppliers mapped without GPT) ----------
+    VENDOR_TEMPLATES_ENABLED = True
+    VENDOR_TEMPLATE_DB_PATH = "cache/vendor_templates.sqlite3"
+    VENDOR_TEMPLATES_PER_VENDOR = 3  # layouts kept per vendor fingerprint (oldest dropped)
+    VENDOR_TEMPLATE_MIN_OBSERVATIONS = 2  # consistent GPT mappings before a template is trusted
+    VENDOR_TEMPLATE_MIN_FIELDS = 3  # fields with a single-item polygon needed to learn a template
+    VENDOR_TEMPLATE_LAYOUT_SIMILARITY = 0.6  # Jaccard similarity of the first-page labels
+    VENDOR_TEMPLATE_POSITION_TOLERANCE = 0.03  # page fraction a field's left/right edge may move
+    VENDOR_TEMPLATE_ANCHOR_MAX_DISTANCE = 0.25  # page fraction between a field and its label anchor
+    VENDOR_TEMPLATE_MIN_FIELD_SCORE = 0.5  # every field must land at least this well
+    VENDOR_TEMPLATE_MIN_CONFIDENCE = 0.85  # mean geometric score needed to skip GPT
+    VENDOR_TEMPLATE_SHARED_GSTIN_NAMES = 3  # vendor names a GSTIN may appear under before it counts as the buyer's
+
 config = Config()
\ No newline at end of file
@@ -1,8 +1,10 @@
+from typing import Any, Dict, Optional
 from urllib.parse import urlparse
 from azure.core.credentials import AzureKeyCredential
 from azure.ai.documentintelligence.aio import DocumentIntelligenceClient
 from config.config import Config
 from src.adapters.logger import logger
+from src.adapters.http_pool import close_di_transport, di_transport, warm_up
 from azure.core.exceptions import ResourceNotFoundError, AzureError
 
 
@@ -11,11 +13,37 @@ class DocumentIntelligence:
     Async wrapper around azure.ai.documentintelligence.aio.DocumentIntelligenceClient.
     Provides an async `extract_content_async` method which returns the AnalyzeResult
     (same shape as the sync SDK's result).
+    The SDK client runs on an aiohttp connection pool sized to Config.DI_MAX_CONCURRENCY;
+    it is created by `start()` (app lifespan) or lazily on first use, and released by `close()`.
     """
 
     def __init__(self):
-        self.client = DocumentIntelligenceClient(endpoint=Config.AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT, 
-                                                 credential=AzureKeyCredential(Config.AZURE_DOCUMENT_INTELLIGENCE_KEY))
+        self._client = None
+        self._transport = None
+
+    @property
+    def client(self) -> DocumentIntelligenceClient:
+        if self._client is None:
+            self._transport = di_transport(Config.DI_MAX_CONCURRENCY)
+            self._client = DocumentIntelligenceClient(endpoint=Config.AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT,
+                                                      credential=AzureKeyCredential(Config.AZURE_DOCUMENT_INTELLIGENCE_KEY),
+                                                      transport=self._transport)
+        return self._client
+
+    async def start(self) -> None:
+        """Create the client and its connection pool up front."""
+        self.client
+
+    async def warm_up(self, connections: Optional[int] = None) -> Dict[str, Any]:
+        """Open pooled connections (TCP + TLS) to the DI endpoint before the first analyze."""
+        self.client  # creates the pool if start() was not called
+        session = self._transport.session
+
+        async def ping():
+            async with session.get(Config.AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT) as resp:
+                await resp.read()
+
+        return await warm_up("DI", ping, connections or Config.HTTP_WARMUP_CONNECTIONS or Config.DI_MAX_CONCURRENCY)
 
     async def extract_content_async(self, pdf_bytes: bytes, model_id: str = None):
         """
@@ -57,18 +85,20 @@ class DocumentIntelligence:
                 logger.error(f"[DI] unexpected error analyzing with model='{m}': {e}", exc_info=True)
                 raise
 
-    async def begin_analyze_async(self, pdf_bytes: bytes, model_id: str = "prebuilt-layout"):
+    async def begin_analyze_async(self, pdf_bytes: bytes, model_id: str = "prebuilt-layout", pages: str = None):
         """
         Start an analyze_document call and return the poller immediately.
         Caller is responsible for awaiting poller.result() later.
         This lets callers start many analyzes quickly and await them concurrently.
+        `pages` limits the analysis to a DI page selection such as "1-3,5".
         """
         if not isinstance(pdf_bytes, (bytes, bytearray)):
             raise TypeError("begin_analyze_async expects raw bytes of the document")
 
         try:
-            logger.info(f"[DI] begin analyze (async) with model='{model_id}'")
-            poller = await self.client.begin_analyze_document(model_id=model_id, body=pdf_bytes)
+            logger.info(f"[DI] begin analyze (async) with model='{model_id}' pages={pages or 'all'}")
+            kwargs = {"pages": pages} if pages else {}
+            poller = await self.client.begin_analyze_document(model_id=model_id, body=pdf_bytes, **kwargs)
             return poller
         except ResourceNotFoundError as e:
             logger.warning(f"[DI] model '{model_id}' not found on resource: {str(e)}")
@@ -82,11 +112,15 @@ class DocumentIntelligence:
 
         
     async def close(self):
-        """Close the underlying client (recommended on shutdown)."""
+        """Close the underlying client and its connection pool (recommended on shutdown)."""
+        client, transport = self._client, self._transport
+        self._client, self._transport = None, None
         try:
-            await self.client.close()
+            if client is not None:
+                await client.close()
         except Exception:
             pass
+        await close_di_transport(transport)
   
 
     
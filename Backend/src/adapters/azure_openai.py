@@ -1,20 +1,284 @@
 from config.config import Config
 from openai import AsyncAzureOpenAI
 import time
-from typing import Any
+from typing import Any, Dict, List, Optional, Set, Tuple
 import random
 import asyncio
 from src.adapters.logger import logger 
+from src.adapters.http_pool import http2_enabled, openai_http_client, warm_up
+from src.metrics import IN_FLIGHT, OPENAI_ATTEMPTS, OPENAI_REQUEST_SECONDS, OPENAI_TOKENS, RETRIES
 from src.models import AzureResponseModel
+from src.scheduler import ServiceLimiter, scheduler, estimate_chat_tokens, classify_error, retry_after_seconds
+from src.tracing import span
+
+class OpenAITarget:
+    """
+    One Azure OpenAI endpoint (resource/region) with its own client, connection pool,
+    limiter, live latency / 429 statistics and circuit breaker.
+
+    The breaker opens after Config.OPENAI_BREAKER_FAILURES consecutive retryable
+    failures; after Config.OPENAI_BREAKER_COOLDOWN_SECONDS a single probe request
+    is let through ("half_open") and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, endpoint: str, key: str, api_version: str, limiter: ServiceLimiter,
+                 weight: float = 1.0, deployments: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.endpoint = endpoint
+        self.key = key
+        self.api_version = api_version
+        self.limiter = limiter
+        self.weight = max(float(weight), 1e-3)
+        self.deployments = deployments  # model -> deployment name; None serves every model as-is
+        self._client = None
+        self._http_client = None
+        self.active = 0  # requests routed here and not finished (including those waiting on the limiter)
+        self.latency_ewma: Optional[float] = None
+        self.throttle_rate = 0.0  # smoothed share of attempts answered with 429
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.counters: Dict[str, int] = {
+            "requests": 0, "successes": 0, "throttled": 0, "retryable_errors": 0, "fatal_errors": 0,
+            "breaker_opened": 0, "hedges": 0, "hedge_wins": 0,
+        }
+
+    @property
+    def client(self) -> AsyncAzureOpenAI:
+        if self._client is None:
+            self._http_client = openai_http_client(self.limiter.max_concurrency)
+            self._client = AsyncAzureOpenAI(
+                azure_endpoint=self.endpoint,
+                api_key=self.key,
+                api_version=self.api_version,
+                http_client=self._http_client,
+            )
+            logger.info(f"Initialized Azure OpenAI target {self.name} with endpoint {self.endpoint} "
+                        f"(http2={http2_enabled()})")
+        return self._client
+
+    async def warm_up(self, connections: Optional[int] = None) -> Dict[str, Any]:
+        self.client  # creates the pool if start() was not called
+        http = self._http_client
+        if connections is None:
+            # HTTP/2 multiplexes every request over one connection
+            connections = Config.HTTP_WARMUP_CONNECTIONS or (1 if http2_enabled() else self.limiter.max_concurrency)
+        return await warm_up(f"openai:{self.name}", lambda: http.get(self.endpoint), connections)
+
+    async def close(self) -> None:
+        client, self._client, self._http_client = self._client, None, None
+        if client is not None:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"closing the Azure OpenAI client {self.name} failed: {e}")
+
+    def serves(self, model: str) -> bool:
+        return self.deployments is None or model in self.deployments
+
+    def deployment(self, model: str) -> str:
+        return (self.deployments or {}).get(model, model)
+
+    def available(self, now: float) -> bool:
+        if self.state == "open" and now >= self.open_until:
+            self.state = "half_open"
+            self.probing = False
+        if self.state == "half_open":
+            return not self.probing
+        return self.state == "closed"
+
+    def score(self) -> float:
+        """Lower is better: expected latency x queue depth, penalized by recent throttling, per unit weight."""
+        latency = self.latency_ewma if self.latency_ewma is not None else 1.0
+        return latency * (self.active + 1) * (1.0 + 4.0 * self.throttle_rate) / self.weight
+
+    def record(self, outcome: str, latency: Optional[float] = None) -> None:
+        """Update live stats and the breaker after one attempt ("success" or an error class)."""
+        self.throttle_rate = 0.9 * self.throttle_rate + (0.1 if outcome == "throttled" else 0.0)
+        if outcome == "success":
+            self.counters["successes"] += 1
+            if latency is not None:
+                self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+            self.consecutive_failures = 0
+            if self.state != "closed":
+                logger.info(f"[openai:{self.name}] circuit closed")
+            self.state, self.probing = "closed", False
+        elif outcome == "throttled":
+            # quota pressure is handled by the limiter pause and the routing penalty, not the breaker
+            self.counters["throttled"] += 1
+            self.probing = False
+        elif outcome == "retryable":
+            self.counters["retryable_errors"] += 1
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= Config.OPENAI_BREAKER_FAILURES:
+                self.state, self.probing = "open", False
+                self.open_until = time.monotonic() + Config.OPENAI_BREAKER_COOLDOWN_SECONDS
+                self.counters["breaker_opened"] += 1
+                logger.warning(f"[openai:{self.name}] circuit open for {Config.OPENAI_BREAKER_COOLDOWN_SECONDS}s "
+                               f"after {self.consecutive_failures} consecutive failures")
+        else:
+            self.counters["fatal_errors"] += 1
+            self.probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "endpoint": self.endpoint,
+            "weight": self.weight,
+            "state": self.state,
+            "active": self.active,
+            "latency_ewma": self.latency_ewma,
+            "throttle_rate": round(self.throttle_rate, 4),
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+def _configured_targets() -> List[OpenAITarget]:
+    """Config.AZURE_OPENAI_TARGETS, or the single endpoint from Config when no list is given."""
+    if not Config.AZURE_OPENAI_TARGETS:
+        return [OpenAITarget("default", Config.AZURE_OPENAI_ENDPOINT, Config.AZURE_OPENAI_KEY,
+                             Config.AZURE_OPENAI_VERSION, scheduler.openai)]
+    targets = []
+    for i, t in enumerate(Config.AZURE_OPENAI_TARGETS):
+        name = t.get("name") or f"target{i}"
+        limiter = scheduler.openai_deployment(
+            name,
+            max_concurrency=t.get("max_concurrency", Config.OPENAI_MAX_CONCURRENCY),
+            requests_per_minute=t.get("requests_per_minute", Config.OPENAI_REQUESTS_PER_MINUTE),
+            tokens_per_minute=t.get("tokens_per_minute", Config.OPENAI_TOKENS_PER_MINUTE),
+        )
+        targets.append(OpenAITarget(
+            name, t["endpoint"], t.get("key", Config.AZURE_OPENAI_KEY), t.get("api_version", Config.AZURE_OPENAI_VERSION),
+            limiter, weight=t.get("weight", 1.0), deployments=t.get("deployments"),
+        ))
+    return targets
+
 
 class AsyncAzureOpenAIHelper:
+    """
+    Azure OpenAI chat client spread over one or more targets (Config.AZURE_OPENAI_TARGETS).
+
+    Each request goes to the healthy target serving the model with the lowest
+    load score (live latency, requests in flight, recent 429s, weight). Retryable
+    errors fail over to another target; non-retryable ones (400, 401, ...) are
+    raised at once. Slow requests can be hedged on a second target.
+    Clients are created by `start()` (app lifespan) or lazily, and released by `close()`.
+    """
+
     def __init__(self):
-        self.client = AsyncAzureOpenAI(
-            azure_endpoint=Config.AZURE_OPENAI_ENDPOINT,
-            api_key=Config.AZURE_OPENAI_KEY,
-            api_version=Config.AZURE_OPENAI_VERSION,
-        )
-        logger.info(f"Initialized AsyncAzureOpenAIHelper with endpoint {Config.AZURE_OPENAI_ENDPOINT}")
+        self.targets = _configured_targets()
+
+    @property
+    def client(self) -> AsyncAzureOpenAI:
+        return self.targets[0].client
+
+    async def start(self) -> None:
+        """Create the clients and their connection pools up front."""
+        for target in self.targets:
+            target.client
+
+    async def warm_up(self, connections: Optional[int] = None) -> Dict[str, Any]:
+        """Open pooled connections to every endpoint before the first real request."""
+        results = await asyncio.gather(*(t.warm_up(connections) for t in self.targets))
+        return {t.name: r for t, r in zip(self.targets, results)}
+
+    async def close(self) -> None:
+        await asyncio.gather(*(t.close() for t in self.targets))
+
+    def _candidates(self, model: str, exclude: Set[str], strict: bool) -> List[OpenAITarget]:
+        now = time.monotonic()
+        serving = [t for t in self.targets if t.serves(model)]
+        healthy = [t for t in serving if t.available(now)]
+        preferred = [t for t in healthy if t.name not in exclude]
+        if strict:
+            return preferred
+        # every circuit open: try the one that reopens first rather than failing outright
+        return preferred or healthy or sorted(serving, key=lambda t: t.open_until)[:1]
+
+    def _has_candidate(self, model: str, exclude: Set[str]) -> bool:
+        """Whether a healthy target outside `exclude` serves `model`; unlike `_pick` it claims no probe."""
+        return bool(self._candidates(model, exclude, strict=True))
+
+    def _pick(self, model: str, exclude: Set[str] = frozenset(), strict: bool = False) -> Optional[OpenAITarget]:
+        """
+        Least-loaded available target for `model`, avoiding `exclude` when possible.
+        With `strict`, excluded or unavailable targets are never returned (used for hedging).
+        The caller must send a request to the returned target: a half-open one is marked as probing.
+        """
+        candidates = self._candidates(model, exclude, strict)
+        if not candidates:
+            return None
+        target = min(candidates, key=lambda t: t.score())
+        if target.state == "half_open":
+            target.probing = True
+        return target
+
+    async def _attempt(self, target: OpenAITarget, model: str, messages: List[Dict[str, Any]],
+                       json_mode: bool, cost: Dict[str, float]) -> Tuple[Any, float, OpenAITarget]:
+        target.active += 1
+        target.counters["requests"] += 1
+        try:
+            with span("openai_request", target=target.name, model=model):
+                async with target.limiter.slot(cost):
+                    with IN_FLIGHT.track(kind="openai_requests"):
+                        start = time.time()
+                        response = await target.client.chat.completions.create(
+                            model=target.deployment(model),
+                            temperature=0,
+                            messages=messages,
+                            top_p=0.8,
+                            response_format={"type": "json_object"} if json_mode else None,
+                        )
+                        latency = time.time() - start
+        except asyncio.CancelledError:
+            target.probing = False
+            raise
+        except Exception as ex:
+            kind = classify_error(ex)
+            if kind == "throttled":
+                target.limiter.on_throttled(retry_after_seconds(ex))
+            target.record(kind)
+            OPENAI_ATTEMPTS.inc(target=target.name, outcome=kind)
+            raise
+        finally:
+            target.active -= 1
+        target.limiter.on_success()
+        target.record("success", latency)
+        OPENAI_ATTEMPTS.inc(target=target.name, outcome="success")
+        OPENAI_REQUEST_SECONDS.observe(latency, target=target.name, model=model)
+        return response, latency, target
+
+    async def _send(self, target: OpenAITarget, model: str, messages: List[Dict[str, Any]],
+                    json_mode: bool, cost: Dict[str, float]) -> Tuple[Any, float, OpenAITarget]:
+        """One attempt on `target`, hedged on a second target if it is unusually slow."""
+        if not Config.OPENAI_HEDGING_ENABLED or len(self.targets) < 2:
+            return await self._attempt(target, model, messages, json_mode, cost)
+
+        primary = asyncio.create_task(self._attempt(target, model, messages, json_mode, cost))
+        pending = {primary}
+        try:
+            delay = max(Config.OPENAI_HEDGE_MIN_SECONDS, (target.latency_ewma or 0.0) * Config.OPENAI_HEDGE_LATENCY_FACTOR)
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            backup_target = None if done else self._pick(model, exclude={target.name}, strict=True)
+            if backup_target is not None:
+                logger.info(f"Hedging request on {backup_target.name} after {delay:.2f}s on {target.name}")
+                target.counters["hedges"] += 1
+                pending.add(asyncio.create_task(self._attempt(backup_target, model, messages, json_mode, cost)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            backup_target.counters["hedge_wins"] += 1
+                        return task.result()
+                    if task is primary or error is None:
+                        error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
 
     async def get_response(
         self,
@@ -28,8 +292,12 @@ class AsyncAzureOpenAIHelper:
         Sends a chat completion request to Azure OpenAI asynchronously and returns the response.
 
         This method attempts to send a request up to `retries` times in case of failure,
-        applying exponential backoff between attempts. It logs request attempts, response times,
-        token usage, and any errors encountered.
+        applying exponential backoff between attempts. Every attempt goes through the limiter of
+        the target it is routed to (concurrency, requests/min, tokens/min); on HTTP 429 the limiter
+        pauses for the Retry-After interval and lowers its rate instead of sleeping blindly.
+        Retryable failures move to another target when one is available, without a backoff;
+        non-retryable errors (e.g. HTTP 400) are raised immediately.
+        It logs request attempts, response times, token usage, and any errors encountered.
 
         Parameters:
             system_prompt (str): The system-level instructions or context for the model.
@@ -47,28 +315,27 @@ class AsyncAzureOpenAIHelper:
         """
 
         input_tokens, output_tokens = 0, 0
+        cost = {"requests": 1, "tokens": estimate_chat_tokens(system_prompt, user_prompt)}
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        tried: Set[str] = set()
 
         for attempt in range(1, retries + 1):
+            target = self._pick(model, exclude=tried)
+            if target is None:
+                raise RuntimeError(f"No Azure OpenAI target serves model '{model}'")
             try:
-                logger.info(f"Attempt {attempt}: Sending request to Azure OpenAI")
-                start = time.time()
-                response = await self.client.chat.completions.create(
-                    model=model,
-                    temperature=0,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                    top_p=0.8,
-                    response_format={"type": "json_object"} if json_mode else None,
-                )
-                end = time.time()
-                latency = end - start
+                logger.info(f"Attempt {attempt}: Sending request to Azure OpenAI ({target.name})")
+                response, latency, target = await self._send(target, model, messages, json_mode, cost)
                 input_tokens = response.usage.prompt_tokens
                 output_tokens = response.usage.completion_tokens
+                OPENAI_TOKENS.inc(input_tokens, model=model, kind="input")
+                OPENAI_TOKENS.inc(output_tokens, model=model, kind="output")
 
                 logger.info(
-                    f"Received response in {latency:.2f}s | "
+                    f"Received response in {latency:.2f}s from {target.name} | "
                     f"input_tokens={input_tokens}, output_tokens={output_tokens}"
                 )
 
@@ -80,7 +347,19 @@ class AsyncAzureOpenAIHelper:
                 )
 
             except Exception as ex:
-                logger.error(f"Attempt {attempt} failed: {ex}", exc_info=True)
+                kind = classify_error(ex)
+                logger.error(f"Attempt {attempt} on {target.name} failed ({kind}): {ex}", exc_info=True)
+                if kind == "fatal":
+                    raise RuntimeError(f"Azure OpenAI rejected the request: {ex}") from ex
+                tried.add(target.name)
+                if attempt == retries:
+                    break
+                RETRIES.inc(service="openai", reason=kind)
+                if kind == "throttled":
+                    # the limiter pause makes the next slot() wait for Retry-After
+                    continue
+                if self._has_candidate(model, exclude=tried):
+                    continue  # fail over right away
                 backoff = (2**attempt) + random.random()
                 logger.info(f"Retrying after {backoff:.2f}s...")
                 await asyncio.sleep(backoff)
@@ -88,4 +367,7 @@ class AsyncAzureOpenAIHelper:
         logger.critical("Azure OpenAI not responding after all retries")
         raise RuntimeError("Azure OpenAI not responding after all retries")
 
+    def stats(self) -> Dict[str, Any]:
+        return {t.name: t.stats() for t in self.targets}
+
 async_openai_client = AsyncAzureOpenAIHelper()
@@ -0,0 +1,82 @@
+import asyncio
+import importlib.util
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+import aiohttp
+import httpx
+from openai import DefaultAsyncHttpxClient
+from azure.core.pipeline.transport import AioHttpTransport
+from config.config import Config
+from src.adapters.logger import logger
+
+
+def pool_size(max_concurrency: int) -> int:
+    """Connections kept per service: enough for every concurrent call plus retries/pollers."""
+    if Config.HTTP_POOL_SIZE:
+        return int(Config.HTTP_POOL_SIZE)
+    return max(1, int(max_concurrency)) + Config.HTTP_POOL_HEADROOM
+
+
+def http2_enabled() -> bool:
+    """HTTP/2 needs the optional `h2` package; without it httpx stays on HTTP/1.1."""
+    return bool(Config.HTTP2_ENABLED) and importlib.util.find_spec("h2") is not None
+
+
+def openai_http_client(max_concurrency: int) -> httpx.AsyncClient:
+    """Pooled, keep-alive httpx client for the OpenAI SDK (HTTP/2 when available)."""
+    size = pool_size(max_concurrency)
+    return DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=size,
+            max_keepalive_connections=size,
+            keepalive_expiry=Config.HTTP_KEEPALIVE_SECONDS,
+        ),
+        timeout=httpx.Timeout(Config.HTTP_READ_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT),
+        http2=http2_enabled(),
+    )
+
+
+def di_transport(max_concurrency: int) -> AioHttpTransport:
+    """
+    aiohttp transport for the Document Intelligence SDK with a sized connection pool.
+    The session is owned by the caller (closed in `close_di_transport`), not by the SDK client.
+    """
+    size = pool_size(max_concurrency)
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=size,
+            limit_per_host=size,
+            keepalive_timeout=Config.HTTP_KEEPALIVE_SECONDS,
+            ttl_dns_cache=300,
+        ),
+    )
+    return AioHttpTransport(
+        session=session,
+        session_owner=False,
+        connection_timeout=Config.HTTP_CONNECT_TIMEOUT,
+        read_timeout=Config.HTTP_READ_TIMEOUT,
+    )
+
+
+async def close_di_transport(transport: Optional[AioHttpTransport]) -> None:
+    if transport is not None and transport.session is not None and not transport.session.closed:
+        await transport.session.close()
+
+
+async def warm_up(name: str, request: Callable[[], Awaitable[Any]], connections: int) -> Dict[str, Any]:
+    """
+    Open `connections` pooled connections by sending that many concurrent requests.
+    Only the TCP/TLS setup matters, so any HTTP status counts as success.
+    """
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(asyncio.wait_for(request(), Config.HTTP_WARMUP_TIMEOUT) for _ in range(max(1, connections))),
+        return_exceptions=True,
+    )
+    failed = [r for r in results if isinstance(r, BaseException)]
+    elapsed = time.perf_counter() - start
+    if failed:
+        logger.warning(f"[{name}] warm-up: {len(failed)}/{len(results)} connections failed ({failed[0]!r})")
+    else:
+        logger.info(f"[{name}] warm-up: {len(results)} connections ready in {elapsed:.2f}s")
+    return {"connections": len(results) - len(failed), "failed": len(failed), "seconds": round(elapsed, 3)}
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from config.config import Config
+from src.adapters.logger import logger
+
+
+def sha256_bytes(data: bytes) -> str:
+    """Return the hex SHA-256 digest of raw bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the hex SHA-256 digest of a file's contents, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def prompt_fingerprint(*texts: str) -> str:
+    """Short hash of one or more rendered prompt templates (used in cache keys)."""
+    h = hashlib.sha256()
+    for t in texts:
+        h.update((t or "").encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()[:16]
+
+
+def make_key(*parts: Any) -> str:
+    """Join key components into a single cache key string."""
+    return "|".join("" if p is None else str(p) for p in parts)
+
+
+class ResultCache:
+    """
+    Two-tier cache for per-document pipeline results.
+
+    Tier 1 is an in-memory LRU bounded by the total size of the JSON-encoded values.
+    Tier 2 is a SQLite table on disk, so results survive restarts and are shared
+    by every worker pointing at the same file. `get` and `set` are coroutines: memory
+    hits are answered inline, disk reads and writes run in a thread.
+
+    Entries live in a namespace ("di", "mapping", "signature", ...) so that e.g. a
+    prompt change only invalidates the GPT results while the OCR output is reused.
+    Values must be JSON serializable.
+    """
+
+    def __init__(self, db_path: Optional[str], max_memory_bytes: int, ttl_seconds: Optional[float]):
+        self.db_path = db_path
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()  # memory tier and counters; never held across disk I/O
+        self._disk_lock = threading.Lock()  # the shared SQLite connection
+        # (namespace, key) -> (value, size, stored_at)
+        self._mem: "OrderedDict[Tuple[str, str], Tuple[Any, int, float]]" = OrderedDict()
+        self._mem_bytes = 0
+        self._stats: Dict[str, int] = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+        self._conn: Optional[sqlite3.Connection] = None
+        if db_path:
+            try:
+                os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+                self._conn = sqlite3.connect(db_path, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    " namespace TEXT NOT NULL,"
+                    " key TEXT NOT NULL,"
+                    " value TEXT NOT NULL,"
+                    " stored_at REAL NOT NULL,"
+                    " PRIMARY KEY (namespace, key))"
+                )
+                self._conn.commit()
+            except Exception as e:
+                logger.warning(f"[cache] disk tier disabled, could not open {db_path}: {e}")
+                self._conn = None
+
+    def _expired(self, stored_at: float) -> bool:
+        return bool(self.ttl_seconds) and (time.time() - stored_at) > self.ttl_seconds
+
+    def _mem_put(self, mkey: Tuple[str, str], value: Any, size: int, stored_at: float) -> None:
+        old = self._mem.pop(mkey, None)
+        if old is not None:
+            self._mem_bytes -= old[1]
+        if size > self.max_memory_bytes:
+            return
+        self._mem[mkey] = (value, size, stored_at)
+        self._mem_bytes += size
+        while self._mem_bytes > self.max_memory_bytes and self._mem:
+            _, (_, evicted_size, _) = self._mem.popitem(last=False)
+            self._mem_bytes -= evicted_size
+            self._stats["evictions"] += 1
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Return the cached value or None on a miss (expired entries count as misses)."""
+        mkey = (namespace, key)
+        with self._lock:
+            entry = self._mem.get(mkey)
+            if entry is not None:
+                value, size, stored_at = entry
+                if not self._expired(stored_at):
+                    self._mem.move_to_end(mkey)
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    return value
+                self._mem.pop(mkey, None)
+                self._mem_bytes -= size
+
+        # the disk tier (query + JSON decode) runs off the event loop
+        row = await asyncio.to_thread(self._disk_get, namespace, key) if self._conn is not None else None
+        with self._lock:
+            if row is not None:
+                value, size, stored_at = row
+                self._mem_put(mkey, value, size, stored_at)
+                self._stats["hits"] += 1
+                self._stats["disk_hits"] += 1
+                return value
+            self._stats["misses"] += 1
+            return None
+
+    def _disk_get(self, namespace: str, key: str) -> Optional[Tuple[Any, int, float]]:
+        with self._disk_lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT value, stored_at FROM results WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                ).fetchone()
+            except Exception as e:
+                logger.warning(f"[cache] disk read failed for {namespace}:{key[:16]}: {e}")
+                return None
+            if row is None:
+                return None
+            raw, stored_at = row
+            if self._expired(stored_at):
+                self._delete_disk(namespace, key)
+                return None
+        return json.loads(raw), len(raw), stored_at
+
+    async def set(self, namespace: str, key: str, value: Any) -> None:
+        """Store a JSON-serializable value in both tiers."""
+        stored_at = time.time()
+        # encoding and the disk write (commit) run off the event loop
+        encoded = await asyncio.to_thread(self._disk_set, namespace, key, value, stored_at)
+        if encoded is None:
+            return
+        with self._lock:
+            # keep the in-memory copy in its JSON round-tripped form so both tiers return the same shape
+            self._mem_put((namespace, key), encoded[0], encoded[1], stored_at)
+            self._stats["sets"] += 1
+
+    def _disk_set(self, namespace: str, key: str, value: Any, stored_at: float) -> Optional[Tuple[Any, int]]:
+        try:
+            raw = json.dumps(value, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"[cache] value for {namespace}:{key[:16]} is not serializable: {e}")
+            return None
+        if self._conn is not None:
+            with self._disk_lock:
+                try:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO results (namespace, key, value, stored_at) VALUES (?, ?, ?, ?)",
+                        (namespace, key, raw, stored_at),
+                    )
+                    self._conn.commit()
+                except Exception as e:
+                    logger.warning(f"[cache] disk write failed for {namespace}:{key[:16]}: {e}")
+        return json.loads(raw), len(raw)
+
+    def _delete_disk(self, namespace: Optional[str], key: Optional[str]) -> int:
+        """Caller holds `_disk_lock`."""
+        if self._conn is None:
+            return 0
+        try:
+            if namespace is None:
+                cur = self._conn.execute("DELETE FROM results")
+            elif key is None:
+                cur = self._conn.execute("DELETE FROM results WHERE namespace = ?", (namespace,))
+            else:
+                cur = self._conn.execute("DELETE FROM results WHERE namespace = ? AND key = ?", (namespace, key))
+            self._conn.commit()
+            return cur.rowcount or 0
+        except Exception as e:
+            logger.warning(f"[cache] disk delete failed: {e}")
+            return 0
+
+    def invalidate(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        """
+        Drop cached entries.
+
+        - no arguments: everything
+        - namespace only: every entry of that namespace
+        - namespace + key: a single entry
+
+        Returns the number of disk rows removed.
+        """
+        with self._lock:
+            for mkey in list(self._mem.keys()):
+                if namespace is not None and mkey[0] != namespace:
+                    continue
+                if key is not None and mkey[1] != key:
+                    continue
+                _, size, _ = self._mem.pop(mkey)
+                self._mem_bytes -= size
+        with self._disk_lock:
+            return self._delete_disk(namespace, key)
+
+    def purge_expired(self) -> int:
+        """Remove entries older than the TTL from both tiers. Returns disk rows removed."""
+        if not self.ttl_seconds:
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            for mkey in [k for k, (_, _, ts) in self._mem.items() if ts < cutoff]:
+                _, size, _ = self._mem.pop(mkey)
+                self._mem_bytes -= size
+        if self._conn is None:
+            return 0
+        with self._disk_lock:
+            try:
+                cur = self._conn.execute("DELETE FROM results WHERE stored_at < ?", (cutoff,))
+                self._conn.commit()
+                return cur.rowcount or 0
+            except Exception as e:
+                logger.warning(f"[cache] purge failed: {e}")
+                return 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters plus current memory usage."""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_ratio": (self._stats["hits"] / lookups) if lookups else 0.0,
+                "memory_entries": len(self._mem),
+                "memory_bytes": self._mem_bytes,
+                "memory_max_bytes": self.max_memory_bytes,
+                "disk_enabled": self._conn is not None,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+result_cache = ResultCache(
+    db_path=Config.CACHE_DB_PATH if Config.CACHE_ENABLED else None,
+    max_memory_bytes=Config.CACHE_MEMORY_MAX_BYTES,
+    ttl_seconds=Config.CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,135 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, TypeVar
+from config.config import Config
+from src.adapters.logger import logger
+from src.tracing import span
+
+T = TypeVar("T")
+
+
+def _init_worker(memory_limit_bytes: Optional[int]) -> None:
+    """Runs once in every worker process: apply the address-space cap (POSIX only)."""
+    if not memory_limit_bytes:
+        return
+    try:
+        import resource
+    except ImportError:  # Windows: no rlimits, workers run uncapped
+        return
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+
+
+def _warm() -> int:
+    """Import the document stack (fitz, numpy, PIL) so the first real task does not pay for it."""
+    import src.document_worker  # noqa: F401
+    return os.getpid()
+
+
+class CpuPool:
+    """
+    Process pool for the CPU-bound document work: decoding, image -> PDF conversion,
+    page rendering and image encoding (see `src.document_worker`).
+
+    fitz and PIL hold the GIL, so in threads they stall the event loop and each
+    other; in worker processes they scale across cores. Only the document bytes and
+    small results (encoded images, page sizes, extracted items) cross the process
+    boundary. Workers are recycled after Config.CPU_POOL_MAX_TASKS_PER_CHILD tasks and
+    may be capped in memory; a worker that dies (e.g. on the cap) fails only the task
+    it was running and the pool is rebuilt for the next one.
+
+    With Config.CPU_POOL_ENABLED off (or 0 workers) the same functions run in threads.
+    """
+
+    def __init__(self, workers: Optional[int], max_tasks_per_child: Optional[int], memory_limit_mb: Optional[int]):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.memory_limit_mb = memory_limit_mb
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._in_flight = 0
+        self.counters: Dict[str, float] = {"tasks": 0, "failed": 0, "worker_crashes": 0, "busy_seconds": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(Config.CPU_POOL_ENABLED) and self.workers > 0
+
+    def start(self) -> None:
+        if not self.enabled or self._executor is not None:
+            return
+        # spawn: forking a process that already runs threads (and fitz) is not safe
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=((self.memory_limit_mb or 0) * 1024 * 1024,),
+            max_tasks_per_child=self.max_tasks_per_child or None,
+        )
+        logger.info(f"[cpu] process pool started: {self.workers} workers, "
+                    f"max {self.max_tasks_per_child or 'unlimited'} tasks per worker, "
+                    f"memory cap {self.memory_limit_mb or 'none'} MB")
+
+    async def warm_up(self) -> None:
+        """Start every worker now (interpreter + imports) instead of on the first documents."""
+        if not self.enabled:
+            return
+        self.start()
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        pids = await asyncio.gather(*(loop.run_in_executor(self._executor, _warm) for _ in range(self.workers)))
+        logger.info(f"[cpu] warmed up {len(set(pids))} worker processes in {time.perf_counter() - started:.2f}s")
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run a module-level function with picklable arguments in a worker process."""
+        if not self.enabled:
+            return await asyncio.to_thread(fn, *args)
+        self.start()
+        executor = self._executor
+        started = time.perf_counter()
+        self._in_flight += 1
+        try:
+            with span(f"cpu.{fn.__name__}"):
+                return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        except BrokenProcessPool as e:
+            self.counters["worker_crashes"] += 1
+            self._restart(executor)
+            raise RuntimeError(f"CPU worker died while running {fn.__name__} (memory cap?)") from e
+        except Exception:
+            self.counters["failed"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self.counters["tasks"] += 1
+            self.counters["busy_seconds"] += time.perf_counter() - started
+
+    def _restart(self, broken: Optional[ProcessPoolExecutor]) -> None:
+        if self._executor is not broken:
+            return  # another caller already replaced it
+        logger.warning("[cpu] a worker process died; restarting the pool")
+        self._executor = None
+        if broken is not None:
+            broken.shutdown(wait=False, cancel_futures=True)
+        self.start()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "busy_seconds": round(self.counters["busy_seconds"], 3),
+            "mode": "processes" if self.enabled else "threads",
+            "workers": self.workers if self.enabled else 0,
+            "in_flight": self._in_flight,
+        }
+
+
+cpu_pool = CpuPool(
+    workers=Config.CPU_POOL_WORKERS,
+    max_tasks_per_child=Config.CPU_POOL_MAX_TASKS_PER_CHILD,
+    memory_limit_mb=Config.CPU_POOL_MEMORY_LIMIT_MB,
+)
@@ -0,0 +1,182 @@
+import asyncio
+import math
+import time
+from typing import Any, Dict, List, Optional
+from config.config import Config
+from src.adapters.logger import logger
+from src.scheduler import TokenBucket, is_throttled, retry_after_seconds, scheduler
+
+
+class _Operation:
+    __slots__ = ("basename", "poller", "method", "pages", "future", "submitted", "due", "polls")
+
+    def __init__(self, basename: str, poller: Any, pages: int, future: asyncio.Future):
+        self.basename = basename
+        self.poller = poller
+        self.method = poller.polling_method()
+        self.pages = pages
+        self.future = future
+        self.submitted = time.monotonic()
+        self.due = math.inf
+        self.polls = 0
+
+
+class AnalyzeCollector:
+    """
+    Collects submitted Document Intelligence analyses from one shared polling loop.
+
+    Callers submit with `begin_analyze_async` and hand the poller to `collect()`, which
+    resolves as soon as that operation completes. Instead of every poller sleeping on
+    the SDK's fixed interval, one background task polls whatever operation is due,
+    spreading the status GETs over Config.DI_POLLS_PER_SECOND.
+
+    Poll times adapt to the analyze durations observed per page-count bucket
+    (1, 2-3, 4-7, ... pages): the first status check is planned shortly before
+    the expected completion, then checks get closer together until the result is in;
+    operations that run longer than expected back off in proportion to their age.
+    """
+
+    def __init__(self, polls_per_second: float, min_interval: float, max_interval: float,
+                 initial_interval: float):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+        self._polls = TokenBucket(rate=polls_per_second, capacity=polls_per_second)
+        self._ops: List[_Operation] = []
+        self._durations: Dict[int, float] = {}  # page bucket -> smoothed analyze seconds
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._poll_tasks: set = set()
+        self.counters: Dict[str, float] = {"submitted": 0, "completed": 0, "failed": 0, "polls": 0, "throttled_polls": 0}
+
+    @staticmethod
+    def _bucket(pages: int) -> int:
+        return max(1, int(pages)).bit_length() - 1
+
+    def expected_seconds(self, pages: int) -> Optional[float]:
+        """Smoothed analyze duration for documents of this size; scaled from the nearest bucket when unseen."""
+        bucket = self._bucket(pages)
+        if bucket in self._durations:
+            return self._durations[bucket]
+        if not self._durations:
+            return None
+        nearest = min(self._durations, key=lambda b: abs(b - bucket))
+        return self._durations[nearest] * (2.0 ** (bucket - nearest))
+
+    def _record(self, pages: int, seconds: float) -> None:
+        bucket = self._bucket(pages)
+        previous = self._durations.get(bucket)
+        self._durations[bucket] = seconds if previous is None else 0.7 * previous + 0.3 * seconds
+
+    def _next_delay(self, op: _Operation, now: float) -> float:
+        elapsed = now - op.submitted
+        expected = self.expected_seconds(op.pages)
+        if expected is None:
+            delay = self.initial_interval if op.polls == 0 else elapsed * 0.2
+        elif elapsed < expected:
+            # close in on the expected completion: wake at 80% of the remaining time
+            delay = (expected - elapsed) * 0.8
+        else:
+            delay = (elapsed - expected) * 0.25 + expected * 0.05
+        return min(self.max_interval, max(self.min_interval, delay))
+
+    def _schedule(self, op: _Operation, delay: float) -> None:
+        op.due = time.monotonic() + delay
+        self._wakeup.set()
+
+    async def collect(self, basename: str, poller: Any, pages: int) -> Any:
+        """Wait for a submitted analysis and return its AnalyzeResult (raises if the operation failed)."""
+        if not Config.DI_SHARED_POLLING or not hasattr(poller, "polling_method"):
+            return await poller.result()
+        loop = asyncio.get_running_loop()
+        op = _Operation(basename, poller, pages, loop.create_future())
+        if self._loop_task is None or self._loop_task.done():
+            self._wakeup = asyncio.Event()
+            self._loop_task = asyncio.create_task(self._run())
+        self.counters["submitted"] += 1
+        self._ops.append(op)
+        self._schedule(op, self._next_delay(op, time.monotonic()))
+        return await op.future
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            self._ops = [op for op in self._ops if not op.future.done()]
+            now = time.monotonic()
+            for op in self._ops:
+                if op.due <= now:
+                    op.due = math.inf  # until this poll reschedules it
+                    task = asyncio.create_task(self._poll(op))
+                    self._poll_tasks.add(task)
+                    task.add_done_callback(self._poll_tasks.discard)
+            next_due = min((op.due for op in self._ops), default=math.inf)
+            timeout = None if next_due == math.inf else max(0.0, next_due - now)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, op: _Operation) -> None:
+        try:
+            await self._polls.acquire(1)
+            if op.future.done():
+                return
+            await op.method.update_status()
+            op.polls += 1
+            self.counters["polls"] += 1
+            if not op.method.finished():
+                self._schedule(op, self._next_delay(op, time.monotonic()))
+                return
+            # terminal status is already in: result() only deserializes it (or raises on failure)
+            result = await op.poller.result()
+            elapsed = time.monotonic() - op.submitted
+            self._record(op.pages, elapsed)
+            self.counters["completed"] += 1
+            logger.info("[%s] DI analyze done in %.2fs after %d polls", op.basename, elapsed, op.polls)
+            if not op.future.done():
+                op.future.set_result(result)
+        except asyncio.CancelledError:
+            if not op.future.done():
+                op.future.cancel()
+            raise
+        except Exception as e:
+            if is_throttled(e):
+                retry_after = retry_after_seconds(e)
+                scheduler.di.on_throttled(retry_after)
+                self.counters["throttled_polls"] += 1
+                self._schedule(op, retry_after or self.max_interval)
+                return
+            self.counters["failed"] += 1
+            if not op.future.done():
+                op.future.set_exception(e)
+
+    async def close(self) -> None:
+        """Stop the polling loop; operations still waiting fail with CancelledError."""
+        tasks = [t for t in (self._loop_task, *self._poll_tasks) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for op in self._ops:
+            if not op.future.done():
+                op.future.cancel()
+        self._ops = []
+        self._loop_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        completed = self.counters["completed"]
+        return {
+            **self.counters,
+            "outstanding": sum(1 for op in self._ops if not op.future.done()),
+            "polls_per_operation": (self.counters["polls"] / completed) if completed else 0.0,
+            "expected_seconds_by_pages": {
+                (f"{2 ** b}-{2 ** (b + 1) - 1}" if b else "1"): round(s, 2) for b, s in sorted(self._durations.items())
+            },
+        }
+
+
+analyze_collector = AnalyzeCollector(
+    polls_per_second=Config.DI_POLLS_PER_SECOND,
+    min_interval=Config.DI_POLL_MIN_INTERVAL,
+    max_interval=Config.DI_POLL_MAX_INTERVAL,
+    initial_interval=Config.DI_POLL_INITIAL_INTERVAL,
+)
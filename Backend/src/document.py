@@ -0,0 +1,162 @@
+import asyncio
+import os
+import tempfile
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+import fitz
+import numpy as np
+from config.config import Config
+from src import document_worker
+from src.cache import sha256_bytes
+from src.cpu_pool import cpu_pool
+from src.adapters.logger import logger
+from src.extracted_items import ExtractedItems
+
+T = TypeVar("T")
+
+
+def _remove_spool(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError as e:  # e.g. still open in a worker on Windows
+        logger.debug(f"could not remove the spool file {path}: {e}")
+
+
+class DocumentArtifact:
+    """
+    One uploaded document, shared by the mapping and signature pipelines.
+
+    The raw bytes are kept as-is; every derived form (PDF bytes + page sizes, encoded
+    image payload of the first page, text-layer items, ...) is computed in the CPU
+    process pool (`src.document_worker`) on first use and memoized, so the event
+    loop never decodes or renders. Concurrent requests for the same form share one
+    computation.
+
+    The bytes are written once to a spool file and workers open that path, so a
+    worker call only pickles the path and the small result, not the document.
+    """
+
+    def __init__(self, name: str, data: bytes, content_hash: Optional[str] = None):
+        self.name = name
+        self.basename = os.path.basename(name)
+        self.ext = os.path.splitext(name)[1].lower()
+        self.data = data
+        self._content_hash = content_hash
+        self._memo: Dict[str, asyncio.Future] = {}
+        self._spool: Optional[asyncio.Future] = None
+        self._spool_cleanup: Optional[weakref.finalize] = None
+        self._layout_items: Optional[asyncio.Future] = None
+
+    @property
+    def is_pdf(self) -> bool:
+        return self.ext == ".pdf"
+
+    @property
+    def content_hash(self) -> str:
+        if self._content_hash is None:
+            self._content_hash = sha256_bytes(self.data)
+        return self._content_hash
+
+    def _write_spool(self) -> str:
+        fd, path = tempfile.mkstemp(prefix="doc-", suffix=self.ext, dir=Config.CPU_POOL_SPOOL_DIR)
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(self.data)
+        # removed by release(), or when the artifact is garbage collected without one
+        self._spool_cleanup = weakref.finalize(self, _remove_spool, path)
+        return path
+
+    async def _source(self) -> Any:
+        """What the worker functions open: the spool file path in process mode, the bytes themselves in threads."""
+        if not cpu_pool.enabled:
+            return self.data
+        if self._spool is None or (self._spool.done() and self._spool.exception() is not None):
+            self._spool = asyncio.ensure_future(asyncio.to_thread(self._write_spool))
+        return await asyncio.shield(self._spool)
+
+    async def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        return await cpu_pool.run(fn, await self._source(), self.ext, self.content_hash, *args)
+
+    async def _memoized(self, name: str, fn: Callable[..., T], *args: Any) -> T:
+        future = self._memo.get(name)
+        if future is None or (future.done() and (future.cancelled() or future.exception() is not None)):
+            future = asyncio.ensure_future(self._run(fn, *args))
+            self._memo[name] = future
+        return await asyncio.shield(future)
+
+    async def pdf_info(self) -> Dict[str, Any]:
+        """
+        PDF bytes for Document Intelligence / the preview, with the first page size and
+        every page's size in PDF points: {"bytes", "width", "height", "pages": [{"page", "width", "height"}]}.
+        """
+        info = await self._memoized("pdf_info", document_worker.pdf_info)
+        # PDFs are their own preview: the worker only sends back bytes it produced (images converted to PDF)
+        return info if info["bytes"] is not None else {**info, "bytes": self.data}
+
+    async def image_content(self) -> Dict[str, Any]:
+        """
+        Chat-completions image payload of the first page, ready to send to the vision model.
+        Rendered once at the configured effective DPI / size limits and encoded once.
+        """
+        return await self._memoized("image_content", document_worker.image_content)
+
+    async def region_image_contents(self, regions: Sequence[fitz.Rect]) -> List[Dict[str, Any]]:
+        """Image payloads for crops of the first page (PDF point rectangles), same render settings as `image_content`."""
+        return await self._run(document_worker.region_image_contents, list(regions))
+
+    async def search_first_page(self, phrases: Sequence[str]) -> Tuple[fitz.Rect, List[fitz.Rect]]:
+        """First page rectangle and the boxes of every text-layer hit for `phrases` (case-insensitive)."""
+        return await self._run(document_worker.search_first_page, list(phrases))
+
+    async def select_pages(self, spec: Optional[str]) -> List[int]:
+        """
+        1-based pages to analyze for a page selection: None = all pages, "header" = pages
+        whose text layer mentions the invoice header (first pages as fallback), otherwise
+        DI page syntax ("1-3,5"). Capped at Config.MAX_ANALYZE_PAGES.
+        """
+        pages = await self._run(document_worker.select_pages, spec)
+        if Config.MAX_ANALYZE_PAGES:
+            pages = pages[:Config.MAX_ANALYZE_PAGES]
+        return pages
+
+    async def text_layer_items(self, pages: Optional[Sequence[int]] = None) -> Optional[ExtractedItems]:
+        """
+        Lines/words with polygons from the PDF's own text layer (optionally only `pages`), in the
+        same shape as `extract_text_and_polygons`; None for images and PDFs without a usable
+        text layer (scans).
+        """
+        if not self.is_pdf:
+            return None
+        return await self._run(document_worker.text_layer_items, list(pages) if pages is not None else None)
+
+    async def text_layer_signals(self, glyphs: Sequence[str]) -> Dict[str, bool]:
+        """
+        Cheap signature evidence from the file itself: a tick glyph in the first page's
+        text layer, and (PDFs only) whether the document carries a signed signature field.
+        """
+        return await self._run(document_worker.text_layer_signals, list(glyphs))
+
+    async def grayscale_arrays(self, regions: Sequence[Optional[fitz.Rect]], dpi: int = 72) -> List[np.ndarray]:
+        """First page (or crops of it, None = the whole page) rendered as 2-D uint8 grayscale arrays."""
+        return await self._run(document_worker.grayscale_arrays, list(regions), dpi)
+
+    def layout_items(self) -> asyncio.Future:
+        """
+        Future resolved by pipeline_mapping with the DI items of this document
+        (or None when they are not available), so the signature stage can use the layout.
+        """
+        if self._layout_items is None:
+            self._layout_items = asyncio.get_running_loop().create_future()
+        return self._layout_items
+
+    def set_layout_items(self, items: Optional[ExtractedItems]) -> None:
+        future = self.layout_items()
+        if not future.done():
+            future.set_result(items)
+
+    def release(self) -> None:
+        """Drop the intermediate renders and the spool file; the PDF info stays available."""
+        self._memo.pop("image_content", None)
+        if self._spool is not None and self._spool.done():
+            self._spool = None
+            if self._spool_cleanup is not None:
+                self._spool_cleanup()
@@ -0,0 +1,164 @@
+"""
+CPU-bound document operations, run in the `cpu_pool` worker processes.
+
+Every function takes the document source (the path of its spool file, or the
+raw bytes when running in threads), its extension and content hash, and returns
+plain data (dicts, lists, bytes, numpy arrays, fitz.Rect), so calls and results
+pickle cheaply. Each worker keeps the last few opened documents, keyed by
+content hash, because one document usually needs several operations in a row.
+When the pool is disabled these functions run in threads instead; fitz is not
+thread-safe, so every operation holds a process-wide lock.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+import fitz
+import numpy as np
+from config.config import Config
+from src.extracted_items import ExtractedItems
+from src.utils_helper import (
+    render_page_image_content,
+    has_usable_text_layer,
+    extract_text_layer_items,
+    parse_page_selection,
+    find_header_pages,
+)
+
+_lock = threading.RLock()
+_documents: "OrderedDict[str, fitz.Document]" = OrderedDict()
+
+Source = Union[str, bytes]
+
+
+def _open(source: Source, ext: str, key: str) -> fitz.Document:
+    """The document opened with fitz (PDFs natively, images as a one-page document)."""
+    doc = _documents.get(key)
+    if doc is not None:
+        _documents.move_to_end(key)
+        return doc
+    filetype = "pdf" if ext == ".pdf" else ext.lstrip(".")
+    if isinstance(source, str):
+        doc = fitz.open(source, filetype=filetype)
+    else:
+        doc = fitz.open(stream=source, filetype=filetype)
+    if len(doc) == 0:
+        doc.close()
+        raise RuntimeError("Could not open document (no pages)")
+    _documents[key] = doc
+    while len(_documents) > max(1, Config.CPU_POOL_OPEN_DOCUMENTS):
+        _, evicted = _documents.popitem(last=False)
+        evicted.close()
+    return doc
+
+
+def _render_first_page(page: fitz.Page, clip: Optional[fitz.Rect] = None) -> Dict[str, Any]:
+    return render_page_image_content(
+        page,
+        dpi=Config.SIGNATURE_IMAGE_DPI,
+        fmt=Config.SIGNATURE_IMAGE_FORMAT,
+        quality=Config.SIGNATURE_IMAGE_QUALITY,
+        max_long_side=Config.SIGNATURE_IMAGE_MAX_LONG_SIDE,
+        max_short_side=Config.SIGNATURE_IMAGE_MAX_SHORT_SIDE,
+        clip=clip,
+    )
+
+
+def pdf_info(source: Source, ext: str, key: str) -> Dict[str, Any]:
+    """
+    First page size and every page's size in points, plus the PDF bytes of images
+    converted to a one-page PDF ("bytes" is None for PDFs: the caller has them already).
+    """
+    with _lock:
+        doc = _open(source, ext, key)
+        rect = doc[0].rect
+        if ext == ".pdf":
+            pdf_bytes = None
+        else:
+            pdf_doc = fitz.open()
+            page = pdf_doc.new_page(width=rect.width, height=rect.height)
+            if isinstance(source, str):
+                page.insert_image(rect, filename=source)
+            else:
+                page.insert_image(rect, stream=source)
+            pdf_bytes = pdf_doc.tobytes()
+            pdf_doc.close()
+        pages = [{"page": i, "width": page.rect.width, "height": page.rect.height} for i, page in enumerate(doc, start=1)]
+        return {"bytes": pdf_bytes, "width": rect.width, "height": rect.height, "pages": pages}
+
+
+def image_content(source: Source, ext: str, key: str) -> Dict[str, Any]:
+    with _lock:
+        return _render_first_page(_open(source, ext, key)[0])
+
+
+def region_image_contents(source: Source, ext: str, key: str, regions: Sequence[fitz.Rect]) -> List[Dict[str, Any]]:
+    with _lock:
+        page = _open(source, ext, key)[0]
+        return [_render_first_page(page, clip=region) for region in regions]
+
+
+def search_first_page(source: Source, ext: str, key: str, phrases: Sequence[str]) -> Tuple[fitz.Rect, List[fitz.Rect]]:
+    with _lock:
+        page = _open(source, ext, key)[0]
+        hits: List[fitz.Rect] = []
+        for phrase in phrases:
+            hits.extend(page.search_for(phrase))
+        return page.rect, hits
+
+
+def select_pages(source: Source, ext: str, key: str, spec: Optional[str]) -> List[int]:
+    with _lock:
+        doc = _open(source, ext, key)
+        count = len(doc)
+        if not spec:
+            return list(range(1, count + 1))
+        if spec == "header":
+            pages = []
+            if ext == ".pdf":
+                pages = find_header_pages(doc, Config.HEADER_PAGE_KEYWORDS, Config.HEADER_PAGE_MAX_PAGES)
+            return pages or list(range(1, min(Config.HEADER_PAGE_FALLBACK_PAGES, count) + 1))
+        return parse_page_selection(spec, count)
+
+
+def text_layer_items(source: Source, ext: str, key: str, pages: Optional[Sequence[int]]) -> Optional[ExtractedItems]:
+    with _lock:
+        doc = _open(source, ext, key)
+        if not has_usable_text_layer(doc, Config.TEXT_LAYER_MIN_CHARS_PER_PAGE, Config.TEXT_LAYER_MAX_BAD_CHAR_RATIO, pages):
+            return None
+        return extract_text_layer_items(doc, pages)
+
+
+def text_layer_signals(source: Source, ext: str, key: str, glyphs: Sequence[str]) -> Dict[str, bool]:
+    with _lock:
+        doc = _open(source, ext, key)
+        text = doc[0].get_text("text") or ""
+        return {
+            "tick_glyph": any(g in text for g in glyphs),
+            # SigFlags 3 = SignaturesExist | AppendOnly, set once a field is signed
+            "signed_field": ext == ".pdf" and doc.get_sigflags() >= 3,
+        }
+
+
+def grayscale_arrays(source: Source, ext: str, key: str, regions: Sequence[Optional[fitz.Rect]], dpi: int) -> List[np.ndarray]:
+    """First page (or crops of it) rendered as 2-D uint8 grayscale arrays."""
+    with _lock:
+        page = _open(source, ext, key)[0]
+        zoom = dpi / 72.0
+        arrays = []
+        for region in regions:
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False, clip=region)
+            arr = np.frombuffer(pix.samples, dtype=np.uint8)
+            arrays.append(arr.reshape(pix.height, pix.stride)[:, :pix.width].copy())
+        return arrays
+
+
+def render_thumbnail(pdf_path: str, page: int, width: int, height: int, quality: int) -> Optional[bytes]:
+    """JPEG of one page of a stored preview PDF, scaled to fit width x height; None if the page does not exist."""
+    with _lock, fitz.open(pdf_path) as doc:
+        if not 1 <= page <= len(doc):
+            return None
+        pdf_page = doc[page - 1]
+        rect = pdf_page.rect
+        scale = min(width / rect.width, height / rect.height)
+        pix = pdf_page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+        return pix.tobytes("jpeg", jpg_quality=quality)
@@ -0,0 +1,219 @@
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+import numpy as np
+
+ITEM_TYPES = ("line", "word")
+ITEM_FIELDS = ("page", "type", "text", "polygon")
+_TYPE_CODES = {name: code for code, name in enumerate(ITEM_TYPES)}
+
+
+class ExtractedItem:
+    """
+    Lightweight view of one item in an `ExtractedItems` container.
+
+    Reads like the old item dicts ({"page", "type", "text", "polygon"}): attribute access,
+    `item["text"]` and `item.get("polygon")` all work, the polygon being materialized
+    as [[x, y], ...] only when asked for.
+    """
+
+    __slots__ = ("_items", "index")
+
+    def __init__(self, items: "ExtractedItems", index: int):
+        self._items = items
+        self.index = index
+
+    @property
+    def page(self) -> int:
+        return int(self._items.pages[self.index])
+
+    @property
+    def type(self) -> str:
+        return ITEM_TYPES[self._items.types[self.index]]
+
+    @property
+    def text(self) -> str:
+        return self._items.texts[self.index]
+
+    @property
+    def polygon(self) -> List[List[float]]:
+        return self._items.polygon(self.index).tolist()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in ITEM_FIELDS else default
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in ITEM_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"page": self.page, "type": self.type, "text": self.text, "polygon": self.polygon}
+
+    def __repr__(self) -> str:
+        return f"ExtractedItem({self.index}, page={self.page}, type={self.type!r}, text={self.text!r})"
+
+
+class ExtractedItems:
+    """
+    Columnar store for the lines/words extracted from a document (DI or the PDF text layer).
+
+    Texts are kept in a list, page numbers and item types in small-int arrays, and all
+    polygon points in one contiguous float64 (N, 2) array; item i owns the points
+    `polygons[offsets[i]:offsets[i + 1]]`. Indexing/iteration yields `ExtractedItem`
+    views, so code written against the old list of dicts keeps working, while
+    whole-document work (bounding boxes, filtering) can use the arrays directly.
+    """
+
+    __slots__ = ("texts", "pages", "types", "offsets", "polygons")
+
+    def __init__(self, texts: List[str], pages: np.ndarray, types: np.ndarray,
+                 offsets: np.ndarray, polygons: np.ndarray):
+        self.texts = texts
+        self.pages = pages
+        self.types = types
+        self.offsets = offsets
+        self.polygons = polygons
+
+    @classmethod
+    def empty(cls) -> "ExtractedItems":
+        return ExtractedItemsBuilder().build()
+
+    @classmethod
+    def from_dicts(cls, items: Iterable[Dict[str, Any]]) -> "ExtractedItems":
+        builder = ExtractedItemsBuilder()
+        for it in items:
+            builder.add(it.get("page") or 0, it.get("type") or "line", it.get("text") or "", it.get("polygon") or [])
+        return builder.build()
+
+    @classmethod
+    def coerce(cls, items: Union["ExtractedItems", Iterable[Dict[str, Any]], None]) -> "ExtractedItems":
+        """Accept either a container or the legacy list of item dicts."""
+        if isinstance(items, ExtractedItems):
+            return items
+        return cls.from_dicts(items or [])
+
+    @classmethod
+    def concat(cls, parts: Sequence["ExtractedItems"]) -> "ExtractedItems":
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls.empty()
+        if len(parts) == 1:
+            return parts[0]
+        texts: List[str] = []
+        offsets = [np.zeros(1, dtype=np.int64)]
+        base = 0
+        for p in parts:
+            texts.extend(p.texts)
+            offsets.append(p.offsets[1:] + base)
+            base += int(p.offsets[-1])
+        return cls(
+            texts,
+            np.concatenate([p.pages for p in parts]),
+            np.concatenate([p.types for p in parts]),
+            np.concatenate(offsets),
+            np.concatenate([p.polygons for p in parts]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __getitem__(self, index: int) -> ExtractedItem:
+        n = len(self.texts)
+        index = int(index)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("item index out of range")
+        return ExtractedItem(self, index)
+
+    def __iter__(self) -> Iterator[ExtractedItem]:
+        for i in range(len(self.texts)):
+            yield ExtractedItem(self, i)
+
+    def polygon(self, index: int) -> np.ndarray:
+        """The (k, 2) float64 points of item `index` (a view, not a copy)."""
+        return self.polygons[self.offsets[index]:self.offsets[index + 1]]
+
+    def type_mask(self, item_type: str) -> np.ndarray:
+        return self.types == _TYPE_CODES[item_type]
+
+    def bounding_boxes(self) -> np.ndarray:
+        """(n, 4) float64 [x0, y0, x1, y1] per item, computed for all items at once; NaN for items without a polygon."""
+        n = len(self.texts)
+        boxes = np.full((n, 4), np.nan, dtype=np.float64)
+        counts = np.diff(self.offsets)
+        has_points = counts > 0
+        if has_points.any():
+            # each segment runs to the next non-empty item's start; empty items own no points in between
+            starts = self.offsets[:-1][has_points]
+            boxes[has_points, 0:2] = np.minimum.reduceat(self.polygons, starts, axis=0)
+            boxes[has_points, 2:4] = np.maximum.reduceat(self.polygons, starts, axis=0)
+        return boxes
+
+    def nbytes(self) -> int:
+        return self.pages.nbytes + self.types.nbytes + self.offsets.nbytes + self.polygons.nbytes + sum(map(len, self.texts))
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [item.to_dict() for item in self]
+
+    def to_json(self) -> Dict[str, Any]:
+        """Compact JSON-able form (used by the result cache)."""
+        return {
+            "texts": self.texts,
+            "pages": self.pages.tolist(),
+            "types": self.types.tolist(),
+            "offsets": self.offsets.tolist(),
+            "polygons": self.polygons.ravel().tolist(),
+        }
+
+    @classmethod
+    def from_json(cls, data: Union[Dict[str, Any], List[Dict[str, Any]]]) -> "ExtractedItems":
+        if isinstance(data, list):  # entries cached before the columnar layout
+            return cls.from_dicts(data)
+        return cls(
+            list(data["texts"]),
+            np.asarray(data["pages"], dtype=np.uint16),
+            np.asarray(data["types"], dtype=np.uint8),
+            np.asarray(data["offsets"], dtype=np.int64),
+            np.asarray(data["polygons"], dtype=np.float64).reshape(-1, 2),
+        )
+
+    def __repr__(self) -> str:
+        return f"ExtractedItems({len(self)} items, {len(self.polygons)} points)"
+
+
+class ExtractedItemsBuilder:
+    """Append-only builder; points go straight into a packed float buffer."""
+
+    def __init__(self):
+        self._texts: List[str] = []
+        self._pages = array("H")
+        self._types = array("B")
+        self._offsets = array("q", [0])
+        self._coords = array("d")
+
+    def add(self, page: int, item_type: str, text: str, polygon: Optional[Sequence[Sequence[float]]]) -> None:
+        self._texts.append(text)
+        self._pages.append(page)
+        self._types.append(_TYPE_CODES[item_type])
+        for pt in polygon or ():
+            self._coords.append(pt[0])
+            self._coords.append(pt[1])
+        self._offsets.append(len(self._coords) // 2)
+
+    def add_box(self, page: int, item_type: str, text: str, x0: float, y0: float, x1: float, y1: float) -> None:
+        """Add an item whose polygon is the axis-aligned box (clockwise from top-left)."""
+        self._texts.append(text)
+        self._pages.append(page)
+        self._types.append(_TYPE_CODES[item_type])
+        self._coords.extend((x0, y0, x1, y0, x1, y1, x0, y1))
+        self._offsets.append(len(self._coords) // 2)
+
+    def build(self) -> ExtractedItems:
+        return ExtractedItems(
+            self._texts,
+            np.frombuffer(self._pages, dtype=np.uint16).copy(),
+            np.frombuffer(self._types, dtype=np.uint8).copy(),
+            np.frombuffer(self._offsets, dtype=np.int64).copy(),
+            np.frombuffer(self._coords, dtype=np.float64).reshape(-1, 2).copy(),
+        )
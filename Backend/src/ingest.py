@@ -0,0 +1,145 @@
+import asyncio
+import os
+import tempfile
+import zipfile
+from typing import AsyncIterator, List, Optional, Tuple, Union
+from fastapi import UploadFile, HTTPException
+from config.config import Config
+from src.adapters.logger import logger
+from src.metrics import observe_stage
+from src.utils_helper import ALLOWED_EXT
+
+
+class UploadSource:
+    """
+    A spooled upload and the supported documents it contains.
+
+    The upload body is copied in chunks into a SpooledTemporaryFile (memory first, disk
+    once it grows past UPLOAD_SPOOL_MAX_MEMORY). For zips only the central directory is
+    read up front; members are decompressed one at a time by `iter_documents`, so the
+    pipeline can start on early members while later ones are still compressed.
+    """
+
+    def __init__(self, filename: str, spool, members: Optional[List[zipfile.ZipInfo]] = None):
+        self.filename = filename
+        self._spool = spool
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._members = members
+        if members is not None:
+            self._zip = zipfile.ZipFile(spool, "r")
+
+    @property
+    def names(self) -> List[str]:
+        """Document names in the order `iter_documents` yields them."""
+        if self._members is None:
+            return [self.filename]
+        return [os.path.basename(m.filename) for m in self._members]
+
+    def _read_member(self, member: zipfile.ZipInfo) -> bytes:
+        # the central directory size can lie, so enforce the limit on the decompressed stream
+        with self._zip.open(member) as src:
+            data = src.read(Config.ZIP_MAX_MEMBER_BYTES + 1)
+        if len(data) > Config.ZIP_MAX_MEMBER_BYTES:
+            raise ValueError(f"member exceeds {Config.ZIP_MAX_MEMBER_BYTES} bytes once decompressed")
+        return data
+
+    async def iter_documents(self) -> AsyncIterator[Tuple[str, Union[bytes, Exception]]]:
+        """
+        Yield (name, data) per supported document. Members that cannot be read are
+        yielded with the exception instead of bytes so the batch carries on.
+        """
+        if self._members is None:
+            self._spool.seek(0)
+            yield self.filename, await asyncio.to_thread(self._spool.read)
+            return
+
+        total = 0
+        for member in self._members:
+            name = os.path.basename(member.filename)
+            try:
+                with observe_stage("zip_extract"):
+                    data = await asyncio.to_thread(self._read_member, member)
+            except Exception as e:
+                logger.error("[ingest] could not read zip member %s: %s", member.filename, e)
+                yield name, e
+                continue
+            total += len(data)
+            if total > Config.ZIP_MAX_TOTAL_BYTES:
+                raise HTTPException(status_code=413, detail="Zip content exceeds the maximum decompressed size")
+            yield name, data
+
+    def close(self) -> None:
+        try:
+            if self._zip is not None:
+                self._zip.close()
+        finally:
+            self._spool.close()
+
+
+def _list_supported_members(zf: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    infos = zf.infolist()
+    if len(infos) > Config.ZIP_MAX_MEMBERS:
+        raise HTTPException(status_code=413, detail=f"Zip has more than {Config.ZIP_MAX_MEMBERS} entries")
+
+    members = []
+    declared_total = 0
+    for member in infos:
+        if member.is_dir():
+            continue
+        name = os.path.basename(member.filename)
+        if not name:
+            continue
+        # only keep files with allowed extensions
+        if os.path.splitext(name)[1].lower() not in ALLOWED_EXT:
+            continue
+        if member.file_size > Config.ZIP_MAX_MEMBER_BYTES:
+            raise HTTPException(status_code=413, detail=f"Zip member {name} is larger than {Config.ZIP_MAX_MEMBER_BYTES} bytes")
+        declared_total += member.file_size
+        members.append(member)
+
+    if declared_total > Config.ZIP_MAX_TOTAL_BYTES:
+        raise HTTPException(status_code=413, detail="Zip content exceeds the maximum decompressed size")
+    return members
+
+
+async def open_upload(upload: UploadFile) -> UploadSource:
+    """
+    Spool a FastAPI UploadFile in chunks and validate it.
+
+    Raises HTTPException 413 when size/count limits are exceeded and 400 when the
+    upload is not a readable zip or contains no supported documents.
+    """
+    filename = os.path.basename(upload.filename)
+    spool = tempfile.SpooledTemporaryFile(max_size=Config.UPLOAD_SPOOL_MAX_MEMORY)
+    try:
+        size = 0
+        with observe_stage("upload_read"):
+            while True:
+                chunk = await upload.read(Config.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > Config.UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {Config.UPLOAD_MAX_BYTES} bytes")
+                spool.write(chunk)
+        spool.seek(0)
+
+        ext = os.path.splitext(filename)[1].lower()
+        if ext != ".zip":
+            return UploadSource(filename, spool)
+
+        try:
+            with zipfile.ZipFile(spool, "r") as zf:
+                members = _list_supported_members(zf)
+        except zipfile.BadZipFile as e:
+            raise HTTPException(status_code=400, detail=f"Invalid zip file: {e}")
+        if not members:
+            raise HTTPException(
+                status_code=400,
+                detail=f"No supported files found in uploaded zip (allowed extensions: {', '.join(sorted(ALLOWED_EXT))})"
+            )
+        spool.seek(0)
+        return UploadSource(filename, spool, members)
+    except Exception:
+        spool.close()
+        raise
@@ -0,0 +1,141 @@
+import asyncio
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from fastapi import UploadFile
+from config.config import Config
+from src.adapters.logger import logger
+from src.ingest import UploadSource, open_upload
+from src.utils import iter_process_documents
+from src.models import ProcessingOptions
+from src.tracing import Trace, trace_recorder
+
+
+class Job:
+    """State of one asynchronous batch: progress counters, per-stage timings and finished records."""
+
+    def __init__(self, job_id: str, model: str, source: UploadSource, options: Optional[ProcessingOptions] = None):
+        self.id = job_id
+        self.model = model
+        self.options = options
+        self.source = source
+        self.files: List[str] = source.names
+        self.status = "queued"  # queued -> running -> completed | failed
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = 0
+        self.failed = 0
+        # records in completion order, each tagged with its input "index"
+        self.results: List[Dict[str, Any]] = []
+        self.stage_totals: Dict[str, float] = {}
+        self.stage_counts: Dict[str, int] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.trace: Optional[Trace] = None
+
+    @property
+    def total(self) -> int:
+        return len(self.files)
+
+    def record(self, index: int, record: Dict[str, Any]) -> None:
+        if "error" in record:
+            self.failed += 1
+        else:
+            self.done += 1
+        for stage, seconds in (record.get("timings") or {}).items():
+            self.stage_totals[stage] = self.stage_totals.get(stage, 0.0) + seconds
+            self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+        self.results.append({"index": index, **record})
+
+    def progress(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "model": self.model,
+            "error": self.error,
+            "files": {
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "pending": self.total - self.done - self.failed,
+            },
+            "stage_timings": {
+                stage: {
+                    "total_seconds": round(total, 3),
+                    "avg_seconds": round(total / self.stage_counts[stage], 3),
+                    "count": self.stage_counts[stage],
+                }
+                for stage, total in self.stage_totals.items()
+            },
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": round(end - self.started_at, 3) if self.started_at else 0.0,
+            "trace_id": self.trace.id if self.trace else None,
+        }
+
+
+class JobManager:
+    """
+    In-process registry of batch jobs.
+
+    The upload is spooled before `submit` returns (the request body is gone afterwards);
+    zip members are then decompressed and analyzed by a background task on the event
+    loop. Finished jobs are kept for `retention_seconds` and purged lazily.
+    """
+
+    def __init__(self, retention_seconds: float):
+        self.retention_seconds = retention_seconds
+        self._jobs: Dict[str, Job] = {}
+
+    async def submit(self, upload: UploadFile, model: str, options: Optional[ProcessingOptions] = None,
+                     trace: bool = False) -> Job:
+        self.purge_expired()
+        source = await open_upload(upload)
+        job = Job(uuid.uuid4().hex, model, source, options)
+        job.trace = trace_recorder.start("job", force=trace, job_id=job.id, model=model, files=job.total)
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job))
+        logger.info("[job %s] queued %d files", job.id, job.total)
+        return job
+
+    async def _run(self, job: Job) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            with trace_recorder.activate(job.trace):
+                async for index, record in iter_process_documents(job.source.iter_documents(), job.model, job.options):
+                    job.record(index, record)
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = "cancelled"
+            raise
+        except Exception as e:
+            logger.exception("[job %s] failed: %s", job.id, e)
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            job.source.close()
+            logger.info("[job %s] %s: %d done, %d failed", job.id, job.status, job.done, job.failed)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.purge_expired()
+        return self._jobs.get(job_id)
+
+    def active_count(self) -> int:
+        # also called from the /metrics scrape (threadpool); list() snapshots the values atomically
+        return sum(job.status in ("queued", "running") for job in list(self._jobs.values()))
+
+    def purge_expired(self) -> int:
+        cutoff = time.time() - self.retention_seconds
+        expired = [jid for jid, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+        for jid in expired:
+            del self._jobs[jid]
+        return len(expired)
+
+
+job_manager = JobManager(retention_seconds=Config.JOB_RETENTION_SECONDS)
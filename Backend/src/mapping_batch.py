@@ -0,0 +1,130 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+from config.config import Config
+from src.adapters.azure_openai import async_openai_client
+from src.adapters.logger import logger
+from src.prompt_encoding import BudgetedItems, row_layout
+from src.utils_helper import decode_json
+
+
+class _Entry:
+    __slots__ = ("basename", "items", "future")
+
+    def __init__(self, basename: str, items: BudgetedItems, future: asyncio.Future):
+        self.basename = basename
+        self.items = items
+        self.future = future
+
+
+class MappingBatcher:
+    """
+    Packs the mapping prompts of several small documents into one chat completion.
+
+    Documents submitted for the same model/system prompt are collected for up to
+    `linger_seconds`, until `max_documents` or `token_budget` item tokens are reached,
+    and sent as one request whose JSON answer is namespaced per document ("d0", "d1", ...).
+    Each caller gets its own slice back, or None when it has to be mapped individually:
+    the document is too large to share a request, it ended up alone, or its slice was
+    missing/malformed in the batched answer.
+    """
+
+    def __init__(self, token_budget: int, max_documents: int, linger_seconds: float):
+        self.token_budget = token_budget
+        self.max_documents = max_documents
+        self.linger_seconds = linger_seconds
+        self._pending: Dict[Tuple[str, str], List[_Entry]] = {}
+        self._pending_tokens: Dict[Tuple[str, str], int] = {}
+        self._timers: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+        self.counters: Dict[str, int] = {"batches": 0, "batched_documents": 0, "individual": 0, "retried": 0}
+
+    async def map(self, model: str, system_prompt: str, basename: str,
+                  items: BudgetedItems) -> Optional[Tuple[Dict[str, Any], Optional[float]]]:
+        """The GPT JSON for this document and the request latency, or None to fall back to a single request."""
+        if items.tokens > self.token_budget or self.max_documents < 2:
+            self.counters["individual"] += 1
+            return None
+        group = (model, system_prompt)
+        if self._pending_tokens.get(group, 0) + items.tokens > self.token_budget:
+            self._flush(group)
+
+        loop = asyncio.get_running_loop()
+        entry = _Entry(basename, items, loop.create_future())
+        entries = self._pending.setdefault(group, [])
+        entries.append(entry)
+        self._pending_tokens[group] = self._pending_tokens.get(group, 0) + items.tokens
+        if len(entries) >= self.max_documents:
+            self._flush(group)
+        elif len(entries) == 1:
+            self._timers[group] = loop.call_later(self.linger_seconds, self._flush, group)
+        return await entry.future
+
+    def _flush(self, group: Tuple[str, str]) -> None:
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        entries = [e for e in self._pending.pop(group, []) if not e.future.done()]
+        self._pending_tokens.pop(group, None)
+        if len(entries) == 1:
+            # nothing to share the request with; the plain single-document prompt is cheaper
+            self.counters["individual"] += 1
+            entries[0].future.set_result(None)
+        elif entries:
+            task = asyncio.create_task(self._send(group, entries))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _prompt(self, keys: List[str], entries: List[_Entry]) -> str:
+        header = (
+            "Several invoices follow, each introduced by a line \"### <doc key>\". Map every invoice "
+            "independently; ids refer to the rows of that invoice only. Return JSON ONLY: one object whose "
+            "keys are the doc keys, each mapping standardized keys to objects containing the original 'id'."
+        )
+        sections = [f"### {key}\n{entry.items.tsv()}" for key, entry in zip(keys, entries)]
+        return f"{header}\n{row_layout(entries[0].items.positions)}\n\n" + "\n\n".join(sections)
+
+    async def _send(self, group: Tuple[str, str], entries: List[_Entry]) -> None:
+        model, system_prompt = group
+        keys = [f"d{i}" for i in range(len(entries))]
+        self.counters["batches"] += 1
+        self.counters["batched_documents"] += len(entries)
+        logger.info("mapping batch: %d documents in one request (%s)", len(entries), ", ".join(e.basename for e in entries))
+        try:
+            resp = await async_openai_client.get_response(
+                system_prompt=system_prompt,
+                user_prompt=self._prompt(keys, entries),
+                model=model,
+                json_mode=True,
+            )
+            answer = decode_json(resp.content)
+            for key, entry in zip(keys, entries):
+                part = answer.get(key) if isinstance(answer, dict) else None
+                if entry.future.done():
+                    continue
+                if isinstance(part, dict) and part:
+                    entry.future.set_result((part, resp.latency_seconds))
+                else:
+                    logger.warning("[%s] missing or malformed slice %s in batched answer, retrying individually",
+                                   entry.basename, key)
+        except Exception as e:
+            logger.error("mapping batch of %d documents failed, retrying individually: %s", len(entries), e)
+        finally:
+            # whatever did not get a usable slice (or the batch was cancelled) is mapped on its own
+            for entry in entries:
+                if not entry.future.done():
+                    self.counters["retried"] += 1
+                    entry.future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        batches = self.counters["batches"]
+        return {
+            **self.counters,
+            "avg_batch_size": (self.counters["batched_documents"] / batches) if batches else 0.0,
+        }
+
+
+mapping_batcher = MappingBatcher(
+    token_budget=Config.MAPPING_BATCH_TOKEN_BUDGET,
+    max_documents=Config.MAPPING_BATCH_MAX_DOCUMENTS,
+    linger_seconds=Config.MAPPING_BATCH_LINGER_SECONDS,
+)
@@ -0,0 +1,266 @@
+import asyncio
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from config.config import Config
+from src.adapters.logger import logger
+from src.tracing import span
+
+LabelValues = Tuple[str, ...]
+
+# seconds; covers in-memory stages (ms) up to long DI analyses of big documents
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.label_names)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.label_names, key), value
+
+
+class Gauge(_Metric):
+    """A settable value per label set; a label set may also be bound to a callback read at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float], **labels: Any) -> None:
+        self._functions[self._key(labels)] = fn
+
+    @contextmanager
+    def track(self, **labels: Any):
+        """In-flight gauge: +1 while the block runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, fn in list(self._functions.items()):
+            try:
+                items.append((key, float(fn())))
+            except Exception as e:
+                logger.debug(f"[metrics] gauge callback {self.name}{key} failed: {e}")
+        for key, value in items:
+            yield self.name, _format_labels(self.label_names, key), value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count], sum
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: Any):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(self.label_names, key, f'le="{_format_value(float(bound))}"'), cumulative
+            yield f"{self.name}_sum", _format_labels(self.label_names, key), total
+            yield f"{self.name}_count", _format_labels(self.label_names, key), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "invoice_stage_seconds", "Wall time of one pipeline stage for one document (or upload).", ["stage"]))
+IN_FLIGHT = registry.register(Gauge(
+    "invoice_in_flight", "Work currently in progress, by kind.", ["kind"]))
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "invoice_http_request_seconds", "HTTP request latency until the response headers are sent.", ["method", "route", "status"]))
+DOCUMENTS = registry.register(Counter(
+    "invoice_documents_total", "Documents processed, by outcome.", ["outcome"]))
+OPENAI_REQUEST_SECONDS = registry.register(Histogram(
+    "invoice_openai_request_seconds", "Latency of successful Azure OpenAI chat completions.", ["target", "model"]))
+OPENAI_ATTEMPTS = registry.register(Counter(
+    "invoice_openai_attempts_total", "Azure OpenAI attempts by outcome (success, throttled, retryable, fatal).",
+    ["target", "outcome"]))
+OPENAI_TOKENS = registry.register(Counter(
+    "invoice_openai_tokens_total", "Tokens reported by Azure OpenAI, by model and kind (input, output).", ["model", "kind"]))
+RETRIES = registry.register(Counter(
+    "invoice_retries_total", "Upstream calls retried, by service and reason.", ["service", "reason"]))
+THROTTLED = registry.register(Counter(
+    "invoice_throttled_total", "HTTP 429 responses received, by limiter.", ["service"]))
+LOOP_LAG_SECONDS = registry.register(Histogram(
+    "invoice_event_loop_lag_seconds", "How late the event loop ran a timer (blocking work on the loop).",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)))
+LOOP_LAG_MAX = registry.register(Gauge(
+    "invoice_event_loop_lag_max_seconds", "Largest event loop lag seen in the last monitoring window."))
+
+
+@contextmanager
+def observe_stage(stage: str, timings: Optional[Dict[str, float]] = None):
+    """
+    Time a block as pipeline stage `stage`: recorded in the stage histogram, in the
+    request's trace (when one is active) and accumulated into timings[stage] if given.
+    """
+    start = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop responsiveness: a task sleeps for `interval` and records how
+    much later than requested it woke up. Sustained lag means something is running
+    blocking work on the loop.
+    """
+
+    def __init__(self, interval: float, warn_seconds: float, window: int = 20):
+        self.interval = interval
+        self.warn_seconds = warn_seconds
+        self.window = window
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.interval and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        worst, ticks = 0.0, 0
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            LOOP_LAG_SECONDS.observe(lag)
+            worst = max(worst, lag)
+            ticks += 1
+            if lag >= self.warn_seconds:
+                logger.warning(f"[metrics] event loop lagged {lag * 1000:.0f} ms")
+            if ticks >= self.window:
+                LOOP_LAG_MAX.set(worst)
+                worst, ticks = 0.0, 0
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+loop_lag_monitor = LoopLagMonitor(
+    interval=Config.LOOP_LAG_INTERVAL_SECONDS,
+    warn_seconds=Config.LOOP_LAG_WARN_SECONDS,
+)
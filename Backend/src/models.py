@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Optional, Literal
 
 class AzureResponseModel(BaseModel):
     content: str
@@ -14,4 +14,11 @@ class SignupRequest(BaseModel):
     
 class LoginRequest(BaseModel):
     email: str
-    password: str
\ No newline at end of file
+    password: str
+
+class ProcessingOptions(BaseModel):
+    """Per-request knobs for the document pipelines."""
+    # "auto": local text layer for born-digital PDFs, DI otherwise; "di": always DI; "local": never DI
+    ocr_mode: Literal["auto", "di", "local"] = "auto"
+    # None: all pages; "header": pages with the invoice header; otherwise DI page syntax, e.g. "1-3,5"
+    pages: Optional[str] = Field(None, pattern=r"^(header|\d+(-\d*)?(,\d+(-\d*)?)*)$")
\ No newline at end of file
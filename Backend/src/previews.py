@@ -0,0 +1,161 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from config.config import Config
+from src import document_worker
+from src.adapters.logger import logger
+from src.cache import sha256_bytes
+from src.cpu_pool import cpu_pool
+
+_PREVIEW_ID = re.compile(r"^[0-9a-f]{64}$")
+
+
+class PreviewStore:
+    """
+    Content-addressed store for the documents' preview PDFs and their rendered thumbnails.
+
+    Upload responses only carry a preview id (the SHA-256 of the PDF bytes), and the
+    browser fetches the PDF out of band from /preview/{id}; the id doubles as a strong
+    ETag. Files live under one directory so every worker can serve any preview;
+    entries older than the TTL are removed and the oldest files go first once the
+    directory grows past `max_bytes`.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: Optional[float], max_bytes: int):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.counters: Dict[str, int] = {"stored": 0, "reused": 0, "thumbnails": 0, "thumbnail_hits": 0, "pruned": 0}
+
+    @staticmethod
+    def valid_id(preview_id: str) -> bool:
+        return bool(_PREVIEW_ID.match(preview_id or ""))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _fresh(self, path: str) -> bool:
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return False
+        return not self.ttl_seconds or (time.time() - mtime) <= self.ttl_seconds
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+
+    def put(self, pdf_bytes: bytes) -> str:
+        """Store the PDF (once per content) and return its preview id. Blocking: call via asyncio.to_thread."""
+        preview_id = sha256_bytes(pdf_bytes)
+        path = self._path(f"{preview_id}.pdf")
+        if self._fresh(path):
+            os.utime(path)  # a re-upload restarts the TTL
+            self.counters["reused"] += 1
+            return preview_id
+        os.makedirs(self.directory, exist_ok=True)
+        self._write(path, pdf_bytes)
+        self.counters["stored"] += 1
+        self._count_write()
+        return preview_id
+
+    def _count_write(self) -> None:
+        """Prune once every PREVIEW_PRUNE_EVERY files written (PDFs and thumbnails alike). Blocking."""
+        with self._lock:
+            self._writes_since_prune += 1
+            prune = self._writes_since_prune >= Config.PREVIEW_PRUNE_EVERY
+            if prune:
+                self._writes_since_prune = 0
+        if prune:
+            self.prune()
+
+    @staticmethod
+    def thumbnail_size(width: int, height: int) -> Tuple[int, int]:
+        """
+        Snap a requested canvas up to the next PREVIEW_THUMB_STEP multiple (capped at
+        PREVIEW_THUMB_MAX_SIDE), so a page has a few dozen possible thumbnails rather than
+        one per pixel size; the page still fits the requested canvas once scaled down.
+        """
+        step, limit = Config.PREVIEW_THUMB_STEP, Config.PREVIEW_THUMB_MAX_SIDE
+        return tuple(min(limit, max(step, -(-int(side) // step) * step)) for side in (width, height))
+
+    def pdf_path(self, preview_id: str) -> Optional[str]:
+        """Path of a stored, unexpired preview PDF, or None."""
+        if not self.valid_id(preview_id):
+            return None
+        path = self._path(f"{preview_id}.pdf")
+        return path if self._fresh(path) else None
+
+    async def thumbnail(self, preview_id: str, page: int, width: int, height: int) -> Optional[str]:
+        """
+        Path of a JPEG of `page` scaled to fit a width x height canvas, rendered (in the
+        CPU pool) on first request and kept next to the PDF. The canvas is snapped with
+        `thumbnail_size`. None if the preview or the page does not exist.
+        """
+        pdf_path = self.pdf_path(preview_id)
+        if pdf_path is None:
+            return None
+        width, height = self.thumbnail_size(width, height)
+        path = self._path(f"{preview_id}.p{page}.{width}x{height}.jpg")
+        if self._fresh(path):
+            self.counters["thumbnail_hits"] += 1
+            return path
+        data = await cpu_pool.run(document_worker.render_thumbnail, pdf_path, page, width, height,
+                                  Config.PREVIEW_THUMB_QUALITY)
+        if data is None:
+            return None
+        await asyncio.to_thread(self._write, path, data)
+        self.counters["thumbnails"] += 1
+        await asyncio.to_thread(self._count_write)
+        return path
+
+    def prune(self) -> int:
+        """Delete expired files, then the oldest ones until the directory fits `max_bytes`. Returns files removed."""
+        try:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            return 0
+        entries.sort()
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            expired = bool(self.ttl_seconds) and now - mtime > self.ttl_seconds
+            if not expired and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+                total -= size
+            except OSError as e:
+                logger.warning(f"[previews] could not remove {path}: {e}")
+        if removed:
+            self.counters["pruned"] += removed
+            logger.info(f"[previews] pruned {removed} files")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            files = [e.stat().st_size for e in os.scandir(self.directory) if e.is_file()]
+        except FileNotFoundError:
+            files = []
+        return {**self.counters, "files": len(files), "bytes": sum(files)}
+
+
+preview_store = PreviewStore(
+    directory=Config.PREVIEW_DIR,
+    ttl_seconds=Config.PREVIEW_TTL_SECONDS,
+    max_bytes=Config.PREVIEW_MAX_BYTES,
+)
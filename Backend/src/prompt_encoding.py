@@ -0,0 +1,151 @@
+import math
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from config.config import Config
+from src.extracted_items import ExtractedItems
+from src.utils_helper import _distinct_candidates, score_text_candidates
+
+# BPE-like pieces: a word with its leading space, up to 3 digits, a punctuation run, a whitespace run
+_TOKEN_PIECES = re.compile(r" ?[^\W\d_]+| ?\d{1,3}| ?[^\w\s]+|\s+|_+")
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    Local estimate of the model's token count for `text`, without a tokenizer dependency.
+
+    Mirrors how cl100k/o200k-style BPE splits text: words (about 6 letters per token),
+    numbers in groups of up to 3 digits, punctuation runs (about 2 symbols per token)
+    and whitespace runs. Non-ASCII letters are counted one token per 2 characters.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _TOKEN_PIECES.findall(text):
+        core = piece.lstrip(" ") or piece
+        if core[0].isdigit() or core.isspace():
+            tokens += 1
+        elif core[0].isalpha():
+            if core.isascii():
+                tokens += math.ceil(len(core) / 6)
+            else:
+                tokens += math.ceil(len(core) / 2)
+        else:
+            tokens += math.ceil(len(core) / 2)
+    return tokens
+
+
+def position_hint(box: Sequence[float], page: int, page_size: Optional[Tuple[float, float]], multi_page: bool) -> str:
+    """
+    Coarse grid cell of an item box, e.g. "r2c3" (row 2 from the top, column 3 from the
+    left of Config.MAPPING_POSITION_GRID), prefixed with the page ("p2r2c3") in multi-page documents.
+    """
+    rows, cols = Config.MAPPING_POSITION_GRID
+    prefix = f"p{page}" if multi_page else ""
+    if page_size is None or np.isnan(box[0]):
+        return prefix or "-"
+    width, height = page_size
+    cx = (box[0] + box[2]) / 2.0
+    cy = (box[1] + box[3]) / 2.0
+    row = min(rows - 1, max(0, int(cy / height * rows))) if height else 0
+    col = min(cols - 1, max(0, int(cx / width * cols))) if width else 0
+    return f"{prefix}r{row}c{col}"
+
+
+def _ranked(items: ExtractedItems, item_type: Optional[str] = None,
+            skip: Optional[Any] = None) -> List[Tuple[int, str]]:
+    """Distinct candidates, best score first (ties -> lower item index): [(idx, text)]."""
+    idxs, texts = _distinct_candidates(items, item_type)
+    if skip is not None:
+        keep = [i for i, idx in enumerate(idxs) if not skip(idx, texts[i])]
+        idxs = [idxs[i] for i in keep]
+        texts = [texts[i] for i in keep]
+    if not idxs:
+        return []
+    scores = score_text_candidates(texts)
+    order = np.lexsort((np.asarray(idxs), -scores))
+    return [(idxs[i], texts[i]) for i in order.tolist()]
+
+
+class BudgetedItems:
+    """Items picked for one mapping prompt, with their encoded rows and estimated token cost."""
+
+    __slots__ = ("ids", "rows", "texts", "tokens", "positions")
+
+    def __init__(self, ids: List[int], rows: List[str], texts: List[str], tokens: int, positions: bool):
+        self.ids = ids
+        self.rows = rows
+        self.texts = texts
+        self.tokens = tokens
+        self.positions = positions
+
+    def tsv(self) -> str:
+        return "\n".join(self.rows)
+
+
+def select_items_within_budget(items: ExtractedItems, token_budget: int, truncate_chars: int,
+                               hierarchical: bool = False,
+                               page_sizes: Optional[Dict[int, Tuple[float, float]]] = None,
+                               positions: bool = True) -> BudgetedItems:
+    """
+    Pack the highest-scoring items into `token_budget` tokens of `id<TAB>[position<TAB>]text` rows.
+
+    Items are considered best-first and added while their row still fits (smaller
+    items further down the ranking can fill the remaining budget). With `hierarchical`,
+    lines are packed first, then the words that are not already part of a packed line
+    of the same page. Rows are returned in document order.
+    """
+    boxes = items.bounding_boxes() if positions else None
+    multi_page = positions and len(set(items.pages.tolist())) > 1
+    chosen: Dict[int, Tuple[str, str]] = {}
+    used = 0
+
+    def pack(candidates: List[Tuple[int, str]]) -> None:
+        nonlocal used
+        for idx, txt in candidates:
+            if token_budget - used < 4:
+                break
+            t = txt if len(txt) <= truncate_chars else (txt[:truncate_chars] + "...")
+            t = t.replace("\t", " ")
+            if positions:
+                page = int(items.pages[idx])
+                hint = position_hint(boxes[idx], page, (page_sizes or {}).get(page), multi_page)
+                row = f"{idx}\t{hint}\t{t}"
+            else:
+                row = f"{idx}\t{t}"
+            cost = estimate_tokens(row) + 1  # + newline
+            if used + cost > token_budget:
+                continue
+            chosen[idx] = (row, t)
+            used += cost
+
+    if hierarchical and items.type_mask("line").any():
+        pack(_ranked(items, "line"))
+        covered = set()
+        packed_texts = set()
+        for idx in chosen:
+            packed_texts.add(items.texts[idx].strip())
+            page = int(items.pages[idx])
+            covered.update((page, tok) for tok in items.texts[idx].split())
+        pack(_ranked(items, "word", skip=lambda idx, txt: txt in packed_texts or (int(items.pages[idx]), txt) in covered))
+    else:
+        pack(_ranked(items))
+
+    ids = sorted(chosen)
+    return BudgetedItems(ids, [chosen[i][0] for i in ids], [chosen[i][1] for i in ids], used, positions)
+
+
+def row_layout(positions: bool) -> str:
+    """One-sentence description of the TSV rows for the prompt."""
+    if positions:
+        rows, cols = Config.MAPPING_POSITION_GRID
+        return (
+            f"Items: one per line, id<TAB>pos<TAB>text. pos rRcC = cell of a {rows}x{cols} page grid "
+            "(r0 top, c0 left), pN = page N."
+        )
+    return "Items: one per line, id<TAB>text."
+
+
+def mapping_instruction(positions: bool) -> str:
+    """How the TSV rows are laid out, followed by the usual output instruction."""
+    return f"{row_layout(positions)} Return JSON ONLY. Map standardized keys to objects containing the original 'id'."
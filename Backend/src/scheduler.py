@@ -0,0 +1,260 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+from config.config import Config
+from src.adapters.logger import logger
+from src.metrics import THROTTLED
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens are added per second up to `capacity`.
+    `acquire(n)` waits until n tokens are available and takes them.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.base_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """Take `amount` tokens, sleeping as needed. Returns the time spent waiting."""
+        # a single request larger than the bucket would never fit; let it drain the bucket instead
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                delay = (amount - self._tokens) / max(self.rate, 1e-6)
+                waited += delay
+                await asyncio.sleep(delay)
+
+    def scale(self, factor: float) -> None:
+        self._refill()
+        self.rate = self.base_rate * factor
+
+
+class ServiceLimiter:
+    """
+    Outbound limiter for one upstream service (Document Intelligence, Azure OpenAI).
+
+    Combines a concurrency cap with one or more token buckets (e.g. "requests" and
+    "tokens"). When the service throttles us, all callers pause for the Retry-After
+    interval and the bucket rates are cut in half; every success then slowly
+    restores them (AIMD), so the limiter settles at the highest sustainable rate.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, buckets: Dict[str, TokenBucket],
+                 min_rate_factor: float = 0.1, recovery_step: float = 0.02,
+                 default_pause_seconds: float = 2.0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.buckets = buckets
+        self.min_rate_factor = min_rate_factor
+        self.recovery_step = recovery_step
+        self.default_pause_seconds = default_pause_seconds
+        self.rate_factor = 1.0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._paused_until = 0.0
+        self.in_flight = 0
+        self.counters: Dict[str, float] = {"requests": 0, "throttled": 0, "wait_seconds": 0.0}
+
+    async def _wait_if_paused(self) -> float:
+        waited = 0.0
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                return waited
+            waited += delay
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot(self, cost: Optional[Dict[str, float]] = None):
+        """
+        Reserve capacity for one call. `cost` maps bucket name -> amount,
+        missing buckets default to 1 (so a plain call costs one request).
+        """
+        start = time.monotonic()
+        async with self._semaphore:
+            await self._wait_if_paused()
+            for bucket_name, bucket in self.buckets.items():
+                await bucket.acquire((cost or {}).get(bucket_name, 1.0))
+            # a throttle may have been reported while we were waiting on the buckets
+            await self._wait_if_paused()
+            self.counters["wait_seconds"] += time.monotonic() - start
+            self.counters["requests"] += 1
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def on_success(self) -> None:
+        if self.rate_factor < 1.0:
+            self.rate_factor = min(1.0, self.rate_factor + self.recovery_step)
+            for bucket in self.buckets.values():
+                bucket.scale(self.rate_factor)
+
+    def on_throttled(self, retry_after: Optional[float] = None) -> None:
+        pause = retry_after if retry_after is not None else self.default_pause_seconds
+        self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        self.rate_factor = max(self.min_rate_factor, self.rate_factor * 0.5)
+        for bucket in self.buckets.values():
+            bucket.scale(self.rate_factor)
+        self.counters["throttled"] += 1
+        THROTTLED.inc(service=self.name)
+        logger.warning(f"[scheduler:{self.name}] throttled, pausing {pause:.2f}s, rate factor now {self.rate_factor:.2f}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "rate_factor": self.rate_factor,
+            "rates_per_second": {k: b.rate for k, b in self.buckets.items()},
+        }
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        response = getattr(exc, "response", None)
+        code = getattr(response, "status_code", None) or getattr(response, "status", None)
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttled(exc: BaseException) -> bool:
+    """True for HTTP 429 errors from either SDK."""
+    return _status_code(exc) == 429
+
+
+_RETRYABLE_STATUS = {408, 409, 500, 502, 503, 504}
+
+
+def classify_error(exc: BaseException) -> str:
+    """
+    "throttled" (HTTP 429), "retryable" (timeouts, connection errors, 408/409/5xx)
+    or "fatal" (other HTTP errors such as 400/401/404 and local bugs; retrying cannot help).
+    """
+    code = _status_code(exc)
+    if code == 429:
+        return "throttled"
+    if code is not None:
+        return "retryable" if code in _RETRYABLE_STATUS else "fatal"
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return "retryable"
+    # SDK transport errors (openai.APIConnectionError/APITimeoutError, azure ServiceRequestError, ...)
+    name = type(exc).__name__
+    if any(word in name for word in ("Timeout", "Connection", "ServiceRequest", "ServiceResponse")):
+        return "retryable"
+    return "fatal"
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Read Retry-After (or the Azure millisecond variants) from an SDK exception, if present."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    for name in ("retry-after-ms", "x-ms-retry-after-ms"):
+        value = headers.get(name)
+        if value:
+            try:
+                return float(value) / 1000.0
+            except ValueError:
+                pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def estimate_chat_tokens(system_prompt: str, user_prompt: Any, max_output_tokens: int = 500) -> int:
+    """
+    Token estimate for a chat request (local BPE-like estimate, fixed cost per image),
+    used only to charge the tokens-per-minute bucket before the real usage is known.
+    """
+    from src.prompt_encoding import estimate_tokens
+
+    tokens = estimate_tokens(system_prompt)
+    images = 0
+    parts = user_prompt if isinstance(user_prompt, list) else [user_prompt]
+    for part in parts:
+        if isinstance(part, dict) and part.get("type") == "image_url":
+            images += 1
+        elif isinstance(part, dict):
+            tokens += estimate_tokens(str(part.get("text", "")))
+        else:
+            tokens += estimate_tokens(str(part))
+    return tokens + images * Config.OPENAI_IMAGE_TOKEN_ESTIMATE + max_output_tokens
+
+
+class OutboundScheduler:
+    """Process-wide limiters shared by every pipeline."""
+
+    def __init__(self):
+        self.di = ServiceLimiter(
+            "document_intelligence",
+            max_concurrency=Config.DI_MAX_CONCURRENCY,
+            buckets={
+                "requests": TokenBucket(rate=Config.DI_TRANSACTIONS_PER_SECOND, capacity=Config.DI_TRANSACTIONS_PER_SECOND),
+            },
+        )
+        self.openai = self._openai_limiter(
+            "openai", Config.OPENAI_MAX_CONCURRENCY, Config.OPENAI_REQUESTS_PER_MINUTE, Config.OPENAI_TOKENS_PER_MINUTE,
+        )
+        self.openai_deployments: Dict[str, ServiceLimiter] = {}
+
+    @staticmethod
+    def _openai_limiter(name: str, max_concurrency: int, requests_per_minute: float,
+                        tokens_per_minute: float) -> ServiceLimiter:
+        # Azure OpenAI enforces per-minute quotas over short windows, so only allow a 10s burst
+        return ServiceLimiter(
+            name,
+            max_concurrency=max_concurrency,
+            buckets={
+                "requests": TokenBucket(rate=requests_per_minute / 60.0, capacity=requests_per_minute / 6.0),
+                "tokens": TokenBucket(rate=tokens_per_minute / 60.0, capacity=tokens_per_minute / 6.0),
+            },
+        )
+
+    def openai_deployment(self, name: str, max_concurrency: int, requests_per_minute: float,
+                          tokens_per_minute: float) -> ServiceLimiter:
+        """Limiter for one additional Azure OpenAI deployment (quotas are per deployment)."""
+        if name not in self.openai_deployments:
+            self.openai_deployments[name] = self._openai_limiter(
+                f"openai:{name}", max_concurrency, requests_per_minute, tokens_per_minute,
+            )
+        return self.openai_deployments[name]
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"document_intelligence": self.di.stats(), "openai": self.openai.stats()}
+        for name, limiter in self.openai_deployments.items():
+            stats[f"openai:{name}"] = limiter.stats()
+        return stats
+
+
+scheduler = OutboundScheduler()
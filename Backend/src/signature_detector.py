@@ -0,0 +1,182 @@
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from PIL import Image, ImageDraw
+from config.config import Config
+from src.adapters.logger import logger
+
+# ✓ ✔ ✅ - the symbols the signature prompt asks the vision model to look for
+TICK_GLYPHS = ("✓", "✔", "✅")
+
+
+def has_tick_glyph(text: Optional[str]) -> bool:
+    return bool(text) and any(g in text for g in TICK_GLYPHS)
+
+
+def _synthetic_tick_templates(sizes: Sequence[int] = (14, 20, 28, 40)) -> List[np.ndarray]:
+    """Dark check-mark strokes on white, at a few sizes (used when no template images are configured)."""
+    templates = []
+    for size in sizes:
+        img = Image.new("L", (size, size), 255)
+        draw = ImageDraw.Draw(img)
+        width = max(2, size // 7)
+        draw.line([(size * 0.1, size * 0.55), (size * 0.4, size * 0.85), (size * 0.9, size * 0.15)], fill=0, width=width)
+        templates.append(np.asarray(img, dtype=np.float32))
+    return templates
+
+
+def _load_templates() -> List[np.ndarray]:
+    paths = Config.SIGNATURE_TICK_TEMPLATE_PATHS
+    if not paths:
+        return _synthetic_tick_templates()
+    templates = []
+    for path in paths:
+        try:
+            templates.append(np.asarray(Image.open(path).convert("L"), dtype=np.float32))
+        except Exception as e:
+            logger.warning(f"[tick] could not load template {path}: {e}")
+    return templates
+
+
+def best_template_score(image: np.ndarray, templates: Sequence[np.ndarray]) -> float:
+    """Highest normalized cross-correlation of any template anywhere in `image` (grayscale, 0-255)."""
+    image = image.astype(np.float32)
+    best = 0.0
+    for t in templates:
+        th, tw = t.shape
+        if image.shape[0] < th or image.shape[1] < tw:
+            continue
+        t0 = t - t.mean()
+        t_norm = np.sqrt((t0 * t0).sum())
+        if t_norm == 0:
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(image, (th, tw))
+        w_mean = windows.mean(axis=(2, 3))
+        # sum((w - mean_w) * t0) == sum(w * t0) because t0 is zero-mean
+        num = np.einsum("ijkl,kl->ij", windows, t0, optimize=True)
+        w_sq = np.einsum("ijkl,ijkl->ij", windows, windows, optimize=True)
+        w_var = w_sq - (th * tw) * w_mean * w_mean
+        denom = np.sqrt(np.clip(w_var, 1e-6, None)) * t_norm
+        # flat windows (blank paper) cannot match a stroke
+        score = np.where(w_var > (th * tw) * 25.0, num / denom, 0.0)
+        best = max(best, float(score.max()))
+    return best
+
+
+class TickDetector:
+    """
+    Local pre-check for the digital-signature tick, run before the vision LLM.
+
+    Confident positives come from a tick glyph in the PDF text layer, a signed PDF
+    signature field, a tick glyph in the DI text, or (optionally) a strong template
+    match on the rendered signature regions. Confident negatives only come from
+    template matching with a configured low threshold. Everything else returns None
+    and is escalated to the LLM; the escalation rate is tracked in `stats()`. Full-page
+    re-checks of a negative crop verdict are counted apart, so every document is
+    counted once in the outcome counters.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates: Optional[List[np.ndarray]] = None
+        self.counters: Dict[str, int] = {
+            "checked": 0, "local_true": 0, "local_false": 0, "escalated": 0,
+            "rechecks": 0, "rechecks_changed": 0, "llm_rechecks": 0, "llm_rechecks_changed": 0,
+        }
+        self.sources: Dict[str, int] = {}
+
+    def _record(self, verdict: Optional[bool], source: str, recheck: bool = False) -> None:
+        with self._lock:
+            if recheck:
+                # same document, already counted as a negative (always a template match) on its crops: replace that outcome
+                self.counters["rechecks"] += 1
+                self.counters["rechecks_changed"] += verdict is not False
+                self.counters["local_false"] -= 1
+                self.sources["template"] -= 1
+            else:
+                self.counters["checked"] += 1
+            if verdict is None:
+                self.counters["escalated"] += 1
+            else:
+                self.counters["local_true" if verdict else "local_false"] += 1
+                self.sources[source] = self.sources.get(source, 0) + 1
+
+    def templates(self) -> List[np.ndarray]:
+        if self._templates is None:
+            self._templates = _load_templates()
+        return self._templates
+
+    def _best_score(self, images: Sequence[np.ndarray]) -> float:
+        return max((best_template_score(img, self.templates()) for img in images), default=0.0)
+
+    async def _template_verdict(self, doc, regions) -> Tuple[Optional[bool], float]:
+        images = await doc.grayscale_arrays(regions or [None], Config.SIGNATURE_TEMPLATE_MATCH_DPI)
+        score = await asyncio.to_thread(self._best_score, images)
+        if score >= Config.SIGNATURE_TEMPLATE_MATCH_POSITIVE:
+            return True, score
+        negative = Config.SIGNATURE_TEMPLATE_MATCH_NEGATIVE
+        if negative is not None and score <= negative:
+            return False, score
+        return None, score
+
+    def record_llm_recheck(self, changed: bool) -> None:
+        """Count an extra vision call re-checking a negative crop verdict on the full page."""
+        with self._lock:
+            self.counters["llm_rechecks"] += 1
+            self.counters["llm_rechecks_changed"] += changed
+
+    async def detect(self, doc, regions: Sequence[Any] = (), recheck: bool = False) -> Optional[bool]:
+        """
+        Return a confident verdict, or None when the LLM should decide. `recheck` marks
+        the full-page retry after a negative verdict on crops of the same document.
+        """
+        verdict, source = await self._detect(doc, regions)
+        self._record(verdict, source, recheck)
+        if verdict is not None:
+            logger.info("[%s] signature decided locally (%s): %s", doc.basename, source, verdict)
+        return verdict
+
+    async def _detect(self, doc, regions) -> Tuple[Optional[bool], str]:
+        if not Config.SIGNATURE_LOCAL_DETECTOR_ENABLED:
+            return None, "disabled"
+
+        try:
+            signals = await doc.text_layer_signals(TICK_GLYPHS)
+        except Exception as e:
+            logger.warning("[%s] text layer check failed: %s", doc.basename, e)
+            signals = {}
+        if signals.get("tick_glyph"):
+            return True, "text_layer"
+        if signals.get("signed_field"):
+            return True, "signature_field"
+
+        # DI items are only used if the mapping stage already has them; never wait here
+        layout = doc.layout_items()
+        if layout.done() and not layout.cancelled():
+            items = layout.result()
+            if items and any(has_tick_glyph(items.texts[i]) for i in np.flatnonzero(items.pages == 1).tolist()):
+                return True, "di_text"
+
+        if Config.SIGNATURE_TEMPLATE_MATCHING_ENABLED:
+            try:
+                verdict, score = await self._template_verdict(doc, regions)
+                logger.debug("[%s] tick template score %.3f", doc.basename, score)
+                if verdict is not None:
+                    return verdict, "template"
+            except Exception as e:
+                logger.warning("[%s] template matching failed: %s", doc.basename, e)
+
+        return None, "escalated"
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            checked = self.counters["checked"]
+            return {
+                **self.counters,
+                "escalation_rate": (self.counters["escalated"] / checked) if checked else 0.0,
+                "local_sources": dict(self.sources),
+            }
+
+
+tick_detector = TickDetector()
@@ -0,0 +1,122 @@
+import asyncio
+from typing import List, Optional, Sequence
+import fitz
+import numpy as np
+from config.config import Config
+from src.adapters.logger import logger
+from src.extracted_items import ExtractedItems
+
+# Lines that usually sit next to the digital-signature tick or the stamp
+SIGNATURE_KEYWORDS = (
+    "digitally signed",
+    "signed by",
+    "signature",
+    "authorised signatory",
+    "authorized signatory",
+)
+
+
+def _matches_keyword(text: str) -> bool:
+    t = (text or "").lower()
+    return any(k in t for k in SIGNATURE_KEYWORDS)
+
+
+def layout_regions(items: ExtractedItems, page_number: int = 1) -> List[fitz.Rect]:
+    """Bounding boxes (PDF points) of DI lines on `page_number` that mention a signature keyword."""
+    candidates = np.flatnonzero(items.type_mask("line") & (items.pages == page_number))
+    hits = [i for i in candidates.tolist() if _matches_keyword(items.texts[i])]
+    if not hits:
+        return []
+    # DI polygons are in inches for PDFs
+    boxes = items.bounding_boxes()[hits] * 72
+    return [fitz.Rect(*box) for box in boxes.tolist() if not np.isnan(box[0])]
+
+
+def configured_region(page_rect: fitz.Rect) -> Optional[fitz.Rect]:
+    """The fixed fallback region from Config (fractions of the page), if one is set."""
+    region = Config.SIGNATURE_ROI_DEFAULT_REGION
+    if not region:
+        return None
+    x0, y0, x1, y1 = region
+    return fitz.Rect(
+        page_rect.x0 + x0 * page_rect.width,
+        page_rect.y0 + y0 * page_rect.height,
+        page_rect.x0 + x1 * page_rect.width,
+        page_rect.y0 + y1 * page_rect.height,
+    )
+
+
+def expand_and_merge(rects: Sequence[fitz.Rect], page_rect: fitz.Rect) -> List[fitz.Rect]:
+    """
+    Pad keyword boxes so the crop covers the surrounding signature block, merge
+    overlapping crops and keep the largest SIGNATURE_ROI_MAX_REGIONS of them.
+    Returns [] when the crops would cover most of the page anyway.
+    """
+    pad_x = Config.SIGNATURE_ROI_PADDING_INCHES[0] * 72
+    pad_y = Config.SIGNATURE_ROI_PADDING_INCHES[1] * 72
+    merged: List[fitz.Rect] = []
+    for r in rects:
+        crop = fitz.Rect(r.x0 - pad_x, r.y0 - pad_y, r.x1 + pad_x, r.y1 + pad_y) & page_rect
+        if crop.is_empty:
+            continue
+        # absorb any existing crop this one overlaps, repeatedly, until stable
+        changed = True
+        while changed:
+            changed = False
+            for other in merged:
+                if crop.intersects(other):
+                    merged.remove(other)
+                    crop = crop | other
+                    changed = True
+                    break
+        merged.append(crop)
+
+    merged.sort(key=lambda r: r.width * r.height, reverse=True)
+    merged = merged[:Config.SIGNATURE_ROI_MAX_REGIONS]
+    area = sum(r.width * r.height for r in merged)
+    if area > Config.SIGNATURE_ROI_MAX_AREA_FRACTION * page_rect.width * page_rect.height:
+        return []
+    return merged
+
+
+def _with_configured(regions: List[fitz.Rect], configured: Optional[fitz.Rect]) -> List[fitz.Rect]:
+    """Keyword crops plus the configured region, unless a crop already contains it."""
+    if configured is None or any(r.contains(configured) for r in regions):
+        return regions
+    return [*regions, configured]
+
+
+async def find_signature_regions(doc) -> List[fitz.Rect]:
+    """
+    Pick crop regions on the first page for the signature check. Sources, in order:
+      1. the PDF text layer (no waiting, works for born-digital files)
+      2. the DI layout lines, once pipeline_mapping has them (bounded wait)
+      3. the configured page region
+    The configured region is always added to keyword crops, so a stray keyword match
+    (terms and conditions, ...) cannot crop the real signature block away.
+    An empty list means "send the full page".
+    """
+    if not Config.SIGNATURE_ROI_ENABLED:
+        return []
+
+    try:
+        page_rect, text_rects = await doc.search_first_page(SIGNATURE_KEYWORDS)
+    except Exception as e:
+        logger.warning("[%s] ROI text search failed: %s", doc.basename, e)
+        return []
+
+    configured = configured_region(page_rect)
+    regions = expand_and_merge(text_rects, page_rect)
+    if regions:
+        return _with_configured(regions, configured)
+
+    try:
+        items = await asyncio.wait_for(asyncio.shield(doc.layout_items()), Config.SIGNATURE_ROI_LAYOUT_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        items = None
+    if items:
+        regions = expand_and_merge(layout_regions(items), page_rect)
+        if regions:
+            return _with_configured(regions, configured)
+
+    return [configured] if configured is not None else []
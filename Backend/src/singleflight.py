@@ -0,0 +1,75 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple, TypeVar
+from config.config import Config
+from src.adapters.logger import logger
+
+T = TypeVar("T")
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Process-wide deduplication of identical in-flight work (same namespace + key).
+
+    The first caller starts the work in its own task; callers arriving while it runs
+    await that task instead of repeating the DI/OpenAI calls. Every waiter awaits
+    through `asyncio.shield`, so a waiter that is cancelled (e.g. its client
+    disconnected) only stops waiting; the work goes on for the others and is
+    cancelled only when no waiter is left. Errors are shared as well; the entry is
+    dropped once the work is done, so the next caller starts afresh (usually hitting
+    the result cache).
+    """
+
+    def __init__(self):
+        self._flights: Dict[Tuple[str, str], _Flight] = {}
+        self.counters: Dict[str, int] = {"started": 0, "joined": 0, "abandoned": 0}
+
+    async def do(self, namespace: str, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        if not Config.SINGLE_FLIGHT_ENABLED:
+            return await fn()
+        fkey = (namespace, key)
+        flight = self._flights.get(fkey)
+        if flight is None:
+            flight = _Flight(asyncio.create_task(fn()))
+            self._flights[fkey] = flight
+            flight.task.add_done_callback(lambda task: self._done(fkey, task))
+            self.counters["started"] += 1
+        else:
+            self.counters["joined"] += 1
+            logger.info("[singleflight] joining in-flight %s work %s", namespace, key[:16])
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # the last interested caller went away: stop paying for the work
+                self.counters["abandoned"] += 1
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _done(self, fkey: Tuple[str, str], task: asyncio.Task) -> None:
+        flight = self._flights.get(fkey)
+        if flight is not None and flight.task is task:
+            del self._flights[fkey]
+        if not task.cancelled():
+            task.exception()  # retrieved here so an error nobody awaited any more is not reported as lost
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "in_flight": len(self._flights),
+            "waiters": sum(f.waiters for f in self._flights.values()),
+        }
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,112 @@
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from config.config import Config
+
+_NON_ALNUM = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Case-, width- and punctuation-insensitive form used for lookups: "Total :  99.00" -> "total9900"."""
+    if not text:
+        return ""
+    return _NON_ALNUM.sub("", unicodedata.normalize("NFKC", text).casefold())
+
+
+def _trigrams(normalized: str) -> Set[str]:
+    padded = f"^{normalized}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TextIndex:
+    """
+    Per-document lookup from a text value (as GPT returned it) to the extracted item it came from.
+
+    Built once per document from the item texts. Lookups try, in order, the exact stripped
+    text, the normalized text (`normalize_text`) and finally an approximate match over a
+    trigram index, scored with the Dice coefficient of the trigram sets. Only items sharing
+    at least one trigram with the query are scored. Ties go to the earlier item, so
+    lines win over words of the same text.
+    """
+
+    def __init__(self, texts: Sequence[str]):
+        self._exact: Dict[str, int] = {}
+        self._normalized: Dict[str, int] = {}
+        self._key_item: List[int] = []  # normalized key id -> item index
+        self._key_grams: List[int] = []  # normalized key id -> trigram count
+        self._postings: Dict[str, List[int]] = defaultdict(list)  # trigram -> normalized key ids
+        for idx, text in enumerate(texts):
+            stripped = (text or "").strip()
+            if not stripped:
+                continue
+            self._exact.setdefault(stripped, idx)
+            key = normalize_text(stripped)
+            if not key or key in self._normalized:
+                continue
+            self._normalized[key] = idx
+            key_id = len(self._key_item)
+            self._key_item.append(idx)
+            grams = _trigrams(key)
+            self._key_grams.append(len(grams))
+            for g in grams:
+                self._postings[g].append(key_id)
+
+    def lookup(self, text: Optional[str]) -> Tuple[Optional[int], str]:
+        """(item index or None, how) where how is "exact", "normalized", "fuzzy" or "miss"."""
+        stripped = (text or "").strip()
+        if not stripped:
+            return None, "miss"
+        idx = self._exact.get(stripped)
+        if idx is not None:
+            return idx, "exact"
+        key = normalize_text(stripped)
+        if not key:
+            return None, "miss"
+        idx = self._normalized.get(key)
+        if idx is not None:
+            return idx, "normalized"
+        if not Config.FUZZY_MATCH_ENABLED or len(key) < Config.FUZZY_MATCH_MIN_CHARS:
+            return None, "miss"
+
+        grams = _trigrams(key)
+        shared: Dict[int, int] = defaultdict(int)
+        for g in grams:
+            for key_id in self._postings.get(g, ()):
+                shared[key_id] += 1
+        best_id, best_score = None, 0.0
+        for key_id, common in shared.items():
+            score = 2.0 * common / (len(grams) + self._key_grams[key_id])
+            if score > best_score or (score == best_score and best_id is not None and key_id < best_id):
+                best_id, best_score = key_id, score
+        if best_id is not None and best_score >= Config.FUZZY_MATCH_MIN_SCORE:
+            return self._key_item[best_id], "fuzzy"
+        return None, "miss"
+
+
+class TextLookupStats:
+    """Process-wide counters of how string values were matched back to items."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"exact": 0, "normalized": 0, "fuzzy": 0, "miss": 0}
+
+    def record(self, how: str) -> None:
+        with self._lock:
+            self.counters[how] = self.counters.get(how, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(self.counters.values())
+            rescued = self.counters["normalized"] + self.counters["fuzzy"]
+            return {
+                **self.counters,
+                "lookups": total,
+                "rescued": rescued,
+                # share of lookups that only matched thanks to normalization / fuzzy matching
+                "rescue_rate": (rescued / total) if total else 0.0,
+            }
+
+
+text_lookup_stats = TextLookupStats()
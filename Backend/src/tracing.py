@@ -0,0 +1,142 @@
+import contextvars
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, List, Optional
+from config.config import Config
+
+
+class Trace:
+    """Spans of one traced request or job; spans started in tasks spawned by it land here too."""
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+        self.keep = False  # explicitly requested traces are kept however fast they were
+        self._next_span = 0
+        self._lock = threading.Lock()
+
+    def _span_id(self) -> int:
+        with self._lock:
+            self._next_span += 1
+            return self._next_span
+
+    def summary(self) -> Dict[str, Any]:
+        stages: Dict[str, float] = {}
+        for s in self.spans:
+            stages[s["name"]] = stages.get(s["name"], 0.0) + s["duration"]
+        return {
+            "id": self.id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "spans": len(self.spans),
+            "seconds_by_span": {k: round(v, 4) for k, v in sorted(stages.items(), key=lambda kv: -kv[1])},
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.summary(), "span_list": sorted(self.spans, key=lambda s: s["start"])}
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("trace_span", default=None)
+
+
+class TraceRecorder:
+    """
+    Optional per-request tracing. A trace is started for every upload/job when
+    Config.TRACE_ENABLED is set, or for a single request that asks for it; `span()`
+    calls anywhere below it (pipeline stages, DI/OpenAI calls) record their start
+    offset, duration, parent and attributes. Finished traces slower than
+    Config.TRACE_SLOW_SECONDS (and every explicitly requested one) are kept in a
+    small ring buffer served by /traces, so a slow batch can be taken apart stage
+    by stage without reading debug logs.
+    """
+
+    def __init__(self, buffer_size: int):
+        self._traces: Deque[Trace] = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+
+    def start(self, name: str, force: bool = False, **attrs: Any) -> Optional[Trace]:
+        """A new trace, or None when tracing is off for this request (not enabled and not asked for)."""
+        if not (force or Config.TRACE_ENABLED):
+            return None
+        trace = Trace(name, attrs)
+        trace.keep = force
+        return trace
+
+    @contextmanager
+    def activate(self, trace: Optional[Trace]):
+        """Make `trace` the current trace for the block (and tasks it spawns), then finish it."""
+        if trace is None:
+            yield None
+            return
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(None)
+        try:
+            yield trace
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            self.finish(trace)
+
+    def finish(self, trace: Trace) -> None:
+        trace.duration = time.perf_counter() - trace._start
+        if trace.keep or trace.duration >= Config.TRACE_SLOW_SECONDS:
+            with self._lock:
+                self._traces.append(trace)
+
+    def recent(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [t.summary() for t in reversed(self._traces)]
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for t in self._traces:
+                if t.id == trace_id:
+                    return t.to_dict()
+        return None
+
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    """Record the block as a span of the current trace; a no-op when nothing is traced."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    span_id = trace._span_id()
+    parent = _current_span.get()
+    token = _current_span.set(span_id)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        record = {
+            "id": span_id,
+            "parent": parent,
+            "name": name,
+            "start": round(start - trace._start, 4),
+            "duration": round(time.perf_counter() - start, 4),
+        }
+        if attrs:
+            record["attrs"] = attrs
+        if error:
+            record["error"] = error
+        trace.spans.append(record)
+
+
+trace_recorder = TraceRecorder(buffer_size=Config.TRACE_BUFFER_SIZE)
@@ -0,0 +1,174 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from config.config import Config
+from src.adapters.logger import logger
+from src.utils_helper import USERS_DB_PATH, _load_users
+
+
+def _normalize_email(email: str) -> str:
+    return (email or "").strip().lower()
+
+
+class UserStore:
+    """
+    SQLite-backed user accounts (replaces rewriting users_db.json on every signup).
+
+    Emails are a unique, case-insensitive index, so a login is a single indexed lookup
+    and a signup a single atomic INSERT: two concurrent signups for the same email
+    cannot both succeed and different users never overwrite each other. The database
+    runs in WAL mode with one connection per thread, so logins read concurrently with
+    a signup being written. Found users are kept in a small in-process LRU with a short
+    TTL (other workers may change the table); unknown emails are never cached, so a
+    fresh signup can log in immediately everywhere.
+
+    On first open, accounts from the legacy JSON file are imported once.
+    """
+
+    def __init__(self, db_path: str, cache_size: int, cache_ttl_seconds: float,
+                 legacy_json_path: Optional[str] = None):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.legacy_json_path = legacy_json_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._initialized = False
+        self.counters: Dict[str, int] = {"lookups": 0, "cache_hits": 0, "signups": 0, "duplicate_signups": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    self._init_schema(conn)
+                    self._initialized = True
+        return conn
+
+    def _init_schema(self, conn: sqlite3.Connection) -> None:
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                " id INTEGER PRIMARY KEY,"
+                " email TEXT NOT NULL COLLATE NOCASE,"
+                " full_name TEXT NOT NULL,"
+                " password TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users (email)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._migrate_json(conn)
+
+    def _migrate_json(self, conn: sqlite3.Connection) -> None:
+        """Import the legacy users_db.json once; later edits to that file are ignored."""
+        if not self.legacy_json_path:
+            return
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return
+        users = _load_users(Path(self.legacy_json_path))
+        now = time.time()
+        rows = [
+            (_normalize_email(u.get("email") or email), u.get("full_name", ""), u.get("password", ""), now)
+            for email, u in users.items()
+            if isinstance(u, dict) and u.get("password")
+        ]
+        with conn:
+            # an account already in the table (e.g. signed up again meanwhile) wins over the file
+            conn.executemany(
+                "INSERT INTO users (email, full_name, password, created_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (email) DO NOTHING",
+                rows,
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (str(now),))
+        if rows:
+            logger.info(f"[users] migrated {len(rows)} accounts from {self.legacy_json_path}")
+
+    def _cache_get(self, email: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._cache.get(email)
+            if entry is None:
+                return None
+            user, cached_at = entry
+            if time.monotonic() - cached_at > self.cache_ttl_seconds:
+                del self._cache[email]
+                return None
+            self._cache.move_to_end(email)
+            return user
+
+    def _cache_put(self, email: str, user: Dict[str, Any]) -> None:
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[email] = (user, time.monotonic())
+            self._cache.move_to_end(email)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def get(self, email: str) -> Optional[Dict[str, Any]]:
+        """The account {"email", "full_name", "password"} or None."""
+        key = _normalize_email(email)
+        self.counters["lookups"] += 1
+        user = self._cache_get(key)
+        if user is not None:
+            self.counters["cache_hits"] += 1
+            return user
+        row = self._connect().execute(
+            "SELECT email, full_name, password FROM users WHERE email = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        user = {"email": row[0], "full_name": row[1], "password": row[2]}
+        self._cache_put(key, user)
+        return user
+
+    def create(self, email: str, full_name: str, password_hash: str) -> bool:
+        """Add an account atomically; False if the email is already registered."""
+        key = _normalize_email(email)
+        conn = self._connect()
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO users (email, full_name, password, created_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (email) DO NOTHING",
+                (key, full_name, password_hash, time.time()),
+            )
+        if cur.rowcount == 0:
+            self.counters["duplicate_signups"] += 1
+            return False
+        self.counters["signups"] += 1
+        return True
+
+    def upsert(self, email: str, full_name: str, password_hash: str) -> None:
+        """Create the account or replace its name and password in one statement."""
+        key = _normalize_email(email)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO users (email, full_name, password, created_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (email) DO UPDATE SET full_name = excluded.full_name, password = excluded.password",
+                (key, full_name, password_hash, time.time()),
+            )
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        count = self._connect().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        return {**self.counters, "users": count, "cached": len(self._cache)}
+
+
+user_store = UserStore(
+    db_path=Config.USER_DB_PATH,
+    cache_size=Config.USER_CACHE_SIZE,
+    cache_ttl_seconds=Config.USER_CACHE_TTL_SECONDS,
+    legacy_json_path=str(USERS_DB_PATH),
+)
@@ -1,27 +1,43 @@
 
 import json
 import ast
+import logging
 import time
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple, Union
 import asyncio
+from contextlib import contextmanager
 from src.adapters.azure_document_intelligence import async_document_intelligence_client as di
 from src.adapters.azure_openai import async_openai_client
 from src.adapters.logger import logger
+from src.cache import result_cache, sha256_bytes, prompt_fingerprint, make_key
+from src.ingest import open_upload
+from src.document import DocumentArtifact
+from src.extracted_items import ExtractedItems
+from src.text_index import TextIndex, text_lookup_stats
+from src.prompt_encoding import BudgetedItems, estimate_tokens, mapping_instruction, select_items_within_budget
+from src.mapping_batch import mapping_batcher
+from src.di_collector import analyze_collector
+from src.singleflight import single_flight
+from src.vendor_templates import template_store
+from src.previews import preview_store
+from src.metrics import DOCUMENTS, IN_FLIGHT, observe_stage
+from src.tracing import span
+from src.signature_roi import find_signature_regions
+from src.signature_detector import tick_detector
+from src.models import ProcessingOptions
+from src.scheduler import scheduler, is_throttled, retry_after_seconds
+from config.config import Config
 from src.utils_helper import (
-    file_to_pdf_bytes,
     extract_text_and_polygons,
     prepare_compact_for_gpt,
     _normalize_polygon,
     ALLOWED_EXT,
     decode_json,
-    extract_image_content,
-    pdf_to_image_first_page_fitz
+    format_page_ranges,
+    chunk_pages,
 )
 
 import os
-import zipfile
-import shutil
-import tempfile
 import base64
 from fastapi import UploadFile, HTTPException
 from src.prompts.system import get_prompt_template
@@ -30,8 +46,12 @@ import io
 
 TRUNCATE_CHARS = 60
 COMPACT_MAX_ITEMS = 60
+COMPACT_HIERARCHICAL = False  # opt-in: lines first; words only when not already part of a selected line
+DI_MODEL_ID = "prebuilt-layout"
+MAPPING_INSTRUCTION = "Return JSON ONLY. Map standardized keys to objects containing the original 'id'."
+SIGNATURE_ROI_NOTE = "The following images are crops of the invoice around its signature / stamp area."
 
-def _map_by_id_and_polygons(gpt_json: Dict[str, Any], extracted_items: List[Dict[str, Any]]) -> Dict[str, Any]:
+def _map_by_id_and_polygons(gpt_json: Dict[str, Any], extracted_items: ExtractedItems) -> Dict[str, Any]:
     """
     Map GPT JSON output to extracted items with polygon coordinates.
 
@@ -39,18 +59,20 @@ def _map_by_id_and_polygons(gpt_json: Dict[str, Any], extracted_items: List[Dict
       - values containing "id" or "ids" (preferred)
       - strings that are Python dict-like (e.g., "{'text': '...', 'polygon': 6}")
       - dicts containing "polygon" (either index or coordinates)
-      - plain strings that match extracted text
+      - plain strings (or dicts with only "text") that match extracted text
+
+    Whenever only text is usable, it is looked up in a per-document `TextIndex`
+    (exact, then normalized, then trigram fuzzy match), built on first use.
 
     This function attempts to handle those cases robustly and returns a dict:
-      { key: {"text": ..., "polygon": ...}, ... }
+      { key: {"text": ..., "polygon": ..., "page": ...}, ... }
 
     Parameters
     ----------
     gpt_json : Dict[str, Any]
         Parsed JSON object returned by the GPT adapter.
-    extracted_items : List[Dict[str, Any]]
-        List of DI-extracted items where each item has keys
-        like {"page", "type", "text", "polygon"}.
+    extracted_items : ExtractedItems
+        DI-extracted items; each item reads like {"page", "type", "text", "polygon"}.
 
     Returns
     -------
@@ -58,22 +80,49 @@ def _map_by_id_and_polygons(gpt_json: Dict[str, Any], extracted_items: List[Dict
         Mapping of GPT keys to text+polygon objects.
     """
     mapped: Dict[str, Any] = {}
+    index: Optional[TextIndex] = None
+
+    def by_text(text: Any, key: str) -> Optional[Any]:
+        """Item whose text best matches `text`, or None."""
+        nonlocal index
+        if not isinstance(text, str) or not text.strip():
+            return None
+        if index is None:
+            index = TextIndex(extracted_items.texts)
+        idx, how = index.lookup(text)
+        text_lookup_stats.record(how)
+        if how in ("normalized", "fuzzy"):
+            logger.debug("%s match for key=%s: %r -> %r", how, key, text, extracted_items.texts[idx])
+        return extracted_items[idx] if idx is not None else None
+
+    def field(text: str, src: Optional[Any]) -> Dict[str, Any]:
+        if src is None:
+            return {"text": text, "polygon": None}
+        return {"text": text or src.get("text"), "polygon": src.get("polygon"), "page": src.get("page")}
+
     for k, v in gpt_json.items():
         try:
             # structured with id/ids
             if isinstance(v, dict) and ("id" in v or "ids" in v):
                 ids = v.get("ids") or ([v.get("id")] if v.get("id") is not None else [])
-                texts, polygons = [], []
+                texts, polygons, pages = [], [], []
                 for idx in ids:
                     try:
                         src = extracted_items[int(idx)]
                         texts.append(src.get("text"))
                         polygons.append(src.get("polygon"))
+                        pages.append(src.get("page"))
                     except Exception:
                         continue
+                text = v.get("text") if isinstance(v.get("text"), str) else (texts[0] if texts else "")
+                if not polygons:
+                    # invalid ids: fall back to the text GPT copied
+                    mapped[k] = field(text, by_text(text, k))
+                    continue
                 mapped[k] = {
-                    "text": v.get("text") if isinstance(v.get("text"), str) else (texts[0] if texts else ""),
+                    "text": text,
                     "polygon": polygons[0] if len(polygons) == 1 else polygons,
+                    "page": pages[0] if pages else None,
                 }
                 continue
 
@@ -88,14 +137,14 @@ def _map_by_id_and_polygons(gpt_json: Dict[str, Any], extracted_items: List[Dict
                         if isinstance(poly_idx, int):
                             try:
                                 src = extracted_items[int(poly_idx)]
-                                mapped[k] = {"text": txt or src.get("text"), "polygon": src.get("polygon")}
                             except Exception:
-                                mapped[k] = {"text": txt or "", "polygon": None}
+                                src = by_text(txt, k)
+                            mapped[k] = field(txt or "", src)
+                        elif isinstance(poly_idx, (list, tuple)):
+                            mapped[k] = {"text": txt or "", "polygon": _normalize_polygon(poly_idx)}
                         else:
-                            if isinstance(poly_idx, (list, tuple)):
-                                mapped[k] = {"text": txt or "", "polygon": _normalize_polygon(poly_idx)}
-                            else:
-                                mapped[k] = {"text": txt or str(parsed)}
+                            src = by_text(txt, k)
+                            mapped[k] = field(txt, src) if src is not None else {"text": txt or str(parsed)}
                         continue
                     except Exception:
                         pass
@@ -106,24 +155,23 @@ def _map_by_id_and_polygons(gpt_json: Dict[str, Any], extracted_items: List[Dict
                 if isinstance(poly, int):
                     try:
                         src = extracted_items[int(poly)]
-                        mapped[k] = {"text": v.get("text") or src.get("text"), "polygon": src.get("polygon")}
                     except Exception:
-                        mapped[k] = {"text": v.get("text") or "", "polygon": None}
+                        src = by_text(v.get("text"), k)
+                    mapped[k] = field(v.get("text") or "", src)
                 else:
                     mapped[k] = {"text": v.get("text") or "", "polygon": _normalize_polygon(poly)}
                 continue
 
-            # plain string fallback -> find exact match
+            # dict with text only
+            if isinstance(v, dict) and isinstance(v.get("text"), str):
+                src = by_text(v["text"], k)
+                mapped[k] = field(v["text"], src) if src is not None else {"text": v["text"]}
+                continue
+
+            # plain string fallback -> indexed lookup
             if isinstance(v, str):
-                found = None
-                for it in extracted_items:
-                    if (it.get("text") or "").strip() == v.strip():
-                        found = it
-                        break
-                if found:
-                    mapped[k] = {"text": v, "polygon": found.get("polygon")}
-                else:
-                    mapped[k] = {"text": v}
+                src = by_text(v, k)
+                mapped[k] = {"text": v, "polygon": src.get("polygon"), "page": src.get("page")} if src is not None else {"text": v}
                 continue
 
             mapped[k] = {"text": str(v)}
@@ -132,183 +180,455 @@ def _map_by_id_and_polygons(gpt_json: Dict[str, Any], extracted_items: List[Dict
             mapped[k] = {"text": str(v)}
     return mapped
 
-async def pipeline_mapping(path: str, model: str) -> Dict[str, Any]:
-    
-    basename = path.split("/")[-1]
-    system_prompt_mapping = get_prompt_template("data_extraction.jinja2").render()
-    out: Dict[str, Any] = {"file": path, "mapping": None, "image_info": None}
+@contextmanager
+def _timed(timings: Optional[Dict[str, float]], stage: str):
+    """Accumulate the wall time of a block into timings[stage] (when given) and report it to /metrics and the trace."""
+    with observe_stage(stage, timings):
+        yield
+
+def _mapping_prompt_settings() -> str:
+    return (
+        f"{Config.MAPPING_PROMPT_FORMAT}/{Config.MAPPING_ITEM_TOKEN_BUDGET}/"
+        f"{Config.MAPPING_POSITION_HINTS}/{Config.MAPPING_POSITION_GRID}"
+    )
+
+def _select_mapping_items(basename: str, extracted_items: ExtractedItems,
+                          page_sizes: Dict[int, Tuple[float, float]]) -> Optional[BudgetedItems]:
+    """
+    For the default "tsv" prompt format: the best items packed into Config.MAPPING_ITEM_TOKEN_BUDGET
+    as id<TAB>position<TAB>text rows, logging the estimated savings. None for the "json" format.
+    """
+    if Config.MAPPING_PROMPT_FORMAT == "json":
+        return None
+    budgeted = select_items_within_budget(
+        extracted_items,
+        Config.MAPPING_ITEM_TOKEN_BUDGET,
+        TRUNCATE_CHARS,
+        hierarchical=COMPACT_HIERARCHICAL,
+        page_sizes=page_sizes,
+        positions=Config.MAPPING_POSITION_HINTS,
+    )
+    if logger.isEnabledFor(logging.INFO):
+        # against the payload the "json" format would send for this document (top-N items as JSON)
+        tokens = estimate_tokens(_mapping_prompt(extracted_items, budgeted))
+        json_tokens = estimate_tokens(_mapping_prompt(extracted_items, None))
+        logger.info(
+            "[%s] mapping prompt: %d items, ~%d tokens (json format: ~%d tokens, %+d)",
+            basename, len(budgeted.ids), tokens, json_tokens, tokens - json_tokens,
+        )
+    return budgeted
+
+def _mapping_prompt(extracted_items: ExtractedItems, budgeted: Optional[BudgetedItems]) -> str:
+    """Single-document user prompt: TSV rows, or the previous fixed top-N JSON payload."""
+    if budgeted is None:
+        compact = prepare_compact_for_gpt(extracted_items, TRUNCATE_CHARS, COMPACT_MAX_ITEMS, COMPACT_HIERARCHICAL)
+        return json.dumps({"items": compact, "instruction": MAPPING_INSTRUCTION}, ensure_ascii=False)
+    return f"{mapping_instruction(budgeted.positions)}\n\n{budgeted.tsv()}"
+
+async def _analyze_pages(basename: str, pdf_bytes: bytes, pages: Optional[str], page_count: int) -> ExtractedItems:
+    """
+    One DI analyze call (limited to `pages` when given) returning the extracted items.
+    The DI slot only covers the submit (rate limits apply to new analyses); the result
+    is then collected by the shared polling loop, which adapts to `page_count`.
+    """
+    async with scheduler.di.slot():
+        try:
+            logger.info("[%s] pipeline_mapping begin analyze (pages=%s)", basename, pages or "all")
+            with observe_stage("di_submit"):
+                poller = await di.begin_analyze_async(pdf_bytes=pdf_bytes, model_id=DI_MODEL_ID, pages=pages)
+        except Exception as e:
+            if is_throttled(e):
+                scheduler.di.on_throttled(retry_after_seconds(e))
+            logger.error("[%s] begin_analyze_async failed: %s", basename, e, exc_info=True)
+            raise RuntimeError(f"begin_analyze_async failed: {e}") from e
 
     try:
-        pdf_bytes = await file_to_pdf_bytes(path)
-        out["image_info"] = pdf_bytes
+        with observe_stage("di_wait"), IN_FLIGHT.track(kind="di_analyses"):
+            result = await analyze_collector.collect(basename, poller, page_count)
     except Exception as e:
-        out["mapping"] = {"error": f"read/convert failed: {e}"}
-        logger.error("[%s] pipeline_mapping read failed: %s", basename, e, exc_info=True)
-        return out
+        if is_throttled(e):
+            scheduler.di.on_throttled(retry_after_seconds(e))
+        logger.error("[%s] poller result failed: %s", basename, e, exc_info=True)
+        raise RuntimeError(f"analyze failed: {e}") from e
+    scheduler.di.on_success()
+    return extract_text_and_polygons(result)
 
+async def pipeline_mapping(doc: DocumentArtifact, model: str,
+                           timings: Optional[Dict[str, float]] = None,
+                           options: Optional[ProcessingOptions] = None) -> Dict[str, Any]:
     try:
-        logger.info("[%s] pipeline_mapping begin analyze", basename)
-        poller = await di.begin_analyze_async(pdf_bytes=pdf_bytes["bytes"], model_id="prebuilt-layout")
+        return await _run_mapping(doc, model, timings, options or ProcessingOptions())
+    finally:
+        # unblock the signature ROI stage if the layout never became available
+        doc.set_layout_items(None)
+
+async def _preview_info(basename: str, pdf_info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Page geometry for the response plus the id of the preview PDF, which is stored
+    for /preview/{id} instead of travelling base64-encoded in the upload response.
+    """
+    info: Dict[str, Any] = {"preview_id": None, "width": pdf_info["width"], "height": pdf_info["height"],
+                            "pages": pdf_info["pages"]}
+    try:
+        info["preview_id"] = await asyncio.to_thread(preview_store.put, pdf_info["bytes"])
     except Exception as e:
-        out["mapping"] = {"error": f"begin_analyze_async failed: {e}"}
-        logger.error("[%s] begin_analyze_async failed: %s", basename, e, exc_info=True)
-        return out
+        logger.warning("[%s] storing the preview failed: %s", basename, e)
+    if Config.PREVIEW_INLINE_PDF or info["preview_id"] is None:
+        info["bytes"] = pdf_info["bytes"]
+    return info
+
+async def _run_mapping(doc: DocumentArtifact, model: str, timings: Optional[Dict[str, float]],
+                       options: ProcessingOptions) -> Dict[str, Any]:
+    basename = doc.basename
+    system_prompt_mapping = get_prompt_template("data_extraction.jinja2").render(
+        prompt_format=Config.MAPPING_PROMPT_FORMAT,
+        positions=Config.MAPPING_POSITION_HINTS,
+        grid=Config.MAPPING_POSITION_GRID,
+    )
+    out: Dict[str, Any] = {"file": doc.name, "mapping": None, "image_info": None}
 
     try:
-        result = await poller.result()
+        with _timed(timings, "convert"):
+            pdf_bytes = await doc.pdf_info()
     except Exception as e:
-        out["mapping"] = {"error": f"analyze failed: {e}"}
-        logger.error("[%s] poller result failed: %s", basename, e, exc_info=True)
+        out["mapping"] = {"error": f"read/convert failed: {e}"}
+        logger.error("[%s] pipeline_mapping read failed: %s", basename, e, exc_info=True)
         return out
+    out["image_info"] = await _preview_info(basename, pdf_bytes)
 
     try:
-        extracted_items = extract_text_and_polygons(result)
-        compact = prepare_compact_for_gpt(extracted_items, TRUNCATE_CHARS, COMPACT_MAX_ITEMS)
-        user_payload = {"items": compact, "instruction": "Return JSON ONLY. Map standardized keys to objects containing the original 'id'."}
-        user_prompt_str = json.dumps(user_payload, ensure_ascii=False)
+        page_numbers = await doc.select_pages(options.pages)
+    except ValueError as e:
+        out["mapping"] = {"error": str(e)}
+        return out
+    all_pages = len(page_numbers) == len(pdf_bytes["pages"])
+    page_spec = format_page_ranges(page_numbers)
+
+    # Born-digital PDFs can skip DI: their text layer yields the same item shape locally
+    local_items = None
+    if options.ocr_mode != "di":
+        with _timed(timings, "text_layer"):
+            try:
+                local_items = await doc.text_layer_items(page_numbers)
+            except Exception as e:
+                logger.warning("[%s] text layer extraction failed: %s", basename, e)
+        if local_items is None and options.ocr_mode == "local":
+            out["mapping"] = {"error": "no usable text layer and Document Intelligence is disabled (ocr_mode=local)"}
+            return out
+    ocr_source = "text_layer" if local_items is not None else "di"
+
+    # OCR output only depends on the file; the GPT mapping also depends on model + prompt + item source
+    di_key = make_key(doc.content_hash, DI_MODEL_ID, page_spec)
+    mapping_key = make_key(
+        doc.content_hash,
+        model,
+        ocr_source,
+        page_spec,
+        prompt_fingerprint(system_prompt_mapping, MAPPING_INSTRUCTION, str(TRUNCATE_CHARS), str(COMPACT_MAX_ITEMS),
+                           str(COMPACT_HIERARCHICAL), _mapping_prompt_settings()),
+    )
+
+    if Config.CACHE_ENABLED:
+        cached_mapping = await result_cache.get("mapping", mapping_key)
+        if cached_mapping is not None:
+            logger.info("[%s] pipeline_mapping cache hit", basename)
+            out["mapping"] = cached_mapping
+            return out
+
+    extracted_items = local_items
+    if extracted_items is not None:
+        logger.info("[%s] using the PDF text layer, skipping Document Intelligence", basename)
+    elif Config.CACHE_ENABLED:
+        cached_items = await result_cache.get("di", di_key)
+        if cached_items is not None:
+            extracted_items = ExtractedItems.from_json(cached_items)
+            logger.info("[%s] pipeline_mapping reusing cached analyze result", basename)
+
+    if extracted_items is None:
+        # identical uploads in flight at the same time share one analysis
+        with _timed(timings, "di_analyze"):
+            try:
+                extracted_items = await single_flight.do(
+                    "di", di_key,
+                    lambda: _analyze_document(basename, pdf_bytes["bytes"], page_numbers, all_pages, di_key),
+                )
+            except RuntimeError as e:
+                out["mapping"] = {"error": str(e)}
+                return out
+    doc.set_layout_items(extracted_items)
 
-        resp = await async_openai_client.get_response(
-            system_prompt=system_prompt_mapping,
-            user_prompt=user_prompt_str,
-            model=model,
-            json_mode=True,
+    try:
+        page_sizes = {p["page"]: (p["width"] / 72.0, p["height"] / 72.0) for p in pdf_bytes["pages"]}
+        out["mapping"] = await single_flight.do(
+            "mapping", mapping_key,
+            lambda: _map_items(basename, model, system_prompt_mapping, extracted_items, page_sizes, page_numbers,
+                               mapping_key, timings),
         )
-
-        gpt_json=decode_json(resp.content)
-
-        mapped = _map_by_id_and_polygons(gpt_json, extracted_items)
-        out["mapping"] = {"mapped": mapped, "gpt_time": resp.latency_seconds}
         return out
     except Exception as e:
         out["mapping"] = {"error": f"mapping failed: {e}"}
         logger.exception("[%s] mapping failed: %s", basename, e)
         return out
 
-async def pipeline_signature(path: str, model: str ) -> Dict[str, Any]:
-    basename = path.split("/")[-1]
+async def _analyze_document(basename: str, pdf_bytes: bytes, page_numbers: List[int], all_pages: bool,
+                            di_key: str) -> ExtractedItems:
+    """DI items for the selected pages (cached under `di_key`); raises RuntimeError if any chunk fails."""
+    # long selections are split into page chunks analyzed concurrently, then merged in page order
+    chunks = chunk_pages(page_numbers, Config.DI_PAGE_CHUNK_SIZE)
+    results = await asyncio.gather(
+        *(
+            _analyze_pages(basename, pdf_bytes,
+                           None if all_pages and len(chunks) == 1 else format_page_ranges(chunk), len(chunk))
+            for chunk in chunks
+        ),
+        return_exceptions=True,
+    )
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        raise RuntimeError(str(errors[0]))
+    extracted_items = ExtractedItems.concat(results)
+
+    if Config.CACHE_ENABLED:
+        await result_cache.set("di", di_key, extracted_items.to_json())
+    return extracted_items
+
+async def _map_items(basename: str, model: str, system_prompt_mapping: str, extracted_items: ExtractedItems,
+                     page_sizes: Dict[int, Tuple[float, float]], page_numbers: List[int], mapping_key: str,
+                     timings: Optional[Dict[str, float]]) -> Dict[str, Any]:
+    """The "mapping" result for the extracted items (vendor template or GPT), cached under `mapping_key`."""
+    if Config.VENDOR_TEMPLATES_ENABLED:
+        # repeat suppliers: fields are read off the learned layout, no GPT call
+        with _timed(timings, "template_match"):
+            local = await asyncio.to_thread(template_store.match, extracted_items, page_sizes)
+        if local is not None:
+            logger.info("[%s] mapped with vendor template %s (confidence %.2f), skipping GPT",
+                        basename, local["template"]["id"], local["confidence"])
+            mapping = {"mapped": local["mapped"], "gpt_time": None, "pages": page_numbers,
+                       "template": {**local["template"], "confidence": local["confidence"]}}
+            if Config.CACHE_ENABLED:
+                await result_cache.set("mapping", mapping_key, mapping)
+            return mapping
+
+    with _timed(timings, "compact_build"):
+        budgeted = _select_mapping_items(basename, extracted_items, page_sizes)
+
+    gpt_json, gpt_time = None, None
+    if budgeted is not None and Config.MAPPING_BATCH_ENABLED:
+        # shares one completion with other small documents; None means "map it on its own"
+        with _timed(timings, "gpt_mapping"):
+            batched = await mapping_batcher.map(model, system_prompt_mapping, basename, budgeted)
+        if batched is not None:
+            gpt_json, gpt_time = batched
+
+    if gpt_json is None:
+        with _timed(timings, "compact_build"):
+            user_prompt_str = _mapping_prompt(extracted_items, budgeted)
+        with _timed(timings, "gpt_mapping"):
+            resp = await async_openai_client.get_response(
+                system_prompt=system_prompt_mapping,
+                user_prompt=user_prompt_str,
+                model=model,
+                json_mode=True,
+            )
+        gpt_json = decode_json(resp.content)
+        gpt_time = resp.latency_seconds
+
+    mapped = _map_by_id_and_polygons(gpt_json, extracted_items)
+    mapping = {"mapped": mapped, "gpt_time": gpt_time, "pages": page_numbers}
+    if Config.VENDOR_TEMPLATES_ENABLED:
+        try:
+            await asyncio.to_thread(template_store.learn, extracted_items, mapped, page_sizes)
+        except Exception as e:
+            logger.warning("[%s] could not record the vendor template: %s", basename, e)
+    if Config.CACHE_ENABLED:
+        await result_cache.set("mapping", mapping_key, mapping)
+    return mapping
+
+async def pipeline_signature(doc: DocumentArtifact, model: str,
+                             timings: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    basename = doc.basename
     system_prompt_signature = get_prompt_template("signature_validation.jinja2").render()
     try:
-        user_prompt = await asyncio.to_thread(extract_image_content, path)
-        print(model)
-        resp = await async_openai_client.get_response(
-            system_prompt=system_prompt_signature,
-            user_prompt=[user_prompt],
-            model=model,
-            json_mode=False,
+        render_settings = (
+            f"{Config.SIGNATURE_IMAGE_DPI}/{Config.SIGNATURE_IMAGE_FORMAT}/{Config.SIGNATURE_IMAGE_QUALITY}/"
+            f"{Config.SIGNATURE_IMAGE_MAX_LONG_SIDE}x{Config.SIGNATURE_IMAGE_MAX_SHORT_SIDE}/"
+            f"roi={Config.SIGNATURE_ROI_ENABLED}:{Config.SIGNATURE_ROI_PADDING_INCHES}:{Config.SIGNATURE_ROI_DEFAULT_REGION}:"
+            f"{Config.SIGNATURE_ROI_FULL_PAGE_RECHECK}"
+        )
+        signature_key = make_key(doc.content_hash, model, prompt_fingerprint(system_prompt_signature, render_settings))
+        if Config.CACHE_ENABLED:
+            cached_verdict = await result_cache.get("signature", signature_key)
+            if cached_verdict is not None:
+                logger.info("[%s] pipeline_signature cache hit", basename)
+                return cached_verdict
+
+        # identical uploads in flight at the same time share one verdict
+        return await single_flight.do(
+            "signature", signature_key,
+            lambda: _signature_verdict(doc, model, system_prompt_signature, signature_key, timings),
         )
-        response = decode_json(resp.content)
-
-        if str(response.get('signature', "false")).lower() == "true":
-            return True
-        else:
-            return False
     except Exception as e:
         logger.exception("[%s] pipeline_signature failed: %s", basename, e)
         raise
 
-async def process_both_for_file(path: str, model: str) -> Dict[str, Any]:
-    file_name = os.path.basename(path)
-    
-    mapping_task = asyncio.create_task(pipeline_mapping(path, model=model))
-    sig_task = asyncio.create_task(pipeline_signature(path, model=model))
+async def _signature_verdict(doc: DocumentArtifact, model: str, system_prompt_signature: str, signature_key: str,
+                             timings: Optional[Dict[str, float]]) -> bool:
+    """
+    Local tick detector, else the vision LLM on the signature crops/page; cached under `signature_key`.
+    A negative verdict on crops is re-checked on the full page: the crops come from keyword
+    matches and may have missed the tick.
+    """
+    basename = doc.basename
+    with _timed(timings, "signature_roi"):
+        regions = await find_signature_regions(doc)
+    with _timed(timings, "signature_local"):
+        local_verdict = await tick_detector.detect(doc, regions)
+        if local_verdict is False and regions and Config.SIGNATURE_ROI_FULL_PAGE_RECHECK:
+            regions = []
+            local_verdict = await tick_detector.detect(doc, regions, recheck=True)
+    if local_verdict is not None:
+        if Config.CACHE_ENABLED:
+            await result_cache.set("signature", signature_key, local_verdict)
+        return local_verdict
+
+    verdict = await _ask_signature_llm(doc, model, system_prompt_signature, regions, timings)
+    if not verdict and regions and Config.SIGNATURE_ROI_FULL_PAGE_RECHECK:
+        logger.info("[%s] no signature found in the crops, checking the full page", basename)
+        verdict = await _ask_signature_llm(doc, model, system_prompt_signature, [], timings)
+        tick_detector.record_llm_recheck(changed=bool(verdict))
+    if Config.CACHE_ENABLED:
+        await result_cache.set("signature", signature_key, verdict)
+    return verdict
+
+async def _ask_signature_llm(doc: DocumentArtifact, model: str, system_prompt_signature: str,
+                             regions: List[Any], timings: Optional[Dict[str, float]]) -> bool:
+    """Vision LLM verdict on the signature crops, or on the full first page when `regions` is empty."""
+    with _timed(timings, "signature_render"):
+        if regions:
+            logger.info("[%s] sending %d signature crop(s) instead of the full page", doc.basename, len(regions))
+            crops = await doc.region_image_contents(regions)
+            user_prompt = [{"type": "text", "text": SIGNATURE_ROI_NOTE}, *crops]
+        else:
+            user_prompt = [await doc.image_content()]
+    with _timed(timings, "signature_gpt"):
+        resp = await async_openai_client.get_response(
+            system_prompt=system_prompt_signature,
+            user_prompt=user_prompt,
+            model=model,
+            json_mode=False,
+        )
+    response = decode_json(resp.content)
+    return str(response.get('signature', "false")).lower() == "true"
 
-    mapping_res, sig_res = await asyncio.gather(mapping_task, sig_task)
-    combined: Dict[str, Any] = {
+async def _process_document(doc: DocumentArtifact, model: str, options: Optional[ProcessingOptions] = None):
+    """Run both pipelines for one unique document; exceptions are returned, not raised."""
+    timings: Dict[str, float] = {}
+    try:
+        with IN_FLIGHT.track(kind="documents"), span("document", file=doc.basename):
+            mapping_res, sig_res = await asyncio.gather(
+                pipeline_mapping(doc, model, timings=timings, options=options),
+                pipeline_signature(doc, model, timings=timings),
+                return_exceptions=True,
+            )
+    finally:
+        doc.release()
+    return mapping_res, sig_res, timings
+
+def _combine_results(file_name: str, mapping_res: Any, sig_res: Any, timings: Dict[str, float]) -> Dict[str, Any]:
+    """Build the per-file result record (or an error record) from both pipeline outcomes."""
+    if isinstance(mapping_res, Exception):
+        logger.error("Mapping failed for %s: %s", file_name, mapping_res)
+        DOCUMENTS.inc(outcome="error")
+        return {"file_name": file_name, "error": f"Mapping process failed: {mapping_res}", "timings": timings}
+
+    if isinstance(sig_res, Exception):
+        logger.error("Signature check failed for %s: %s", file_name, sig_res)
+        DOCUMENTS.inc(outcome="error")
+        return {"file_name": file_name, "error": f"Signature process failed: {sig_res}", "timings": timings}
+
+    DOCUMENTS.inc(outcome="mapping_error" if "error" in (mapping_res.get("mapping") or {}) else "ok")
+    return {
         "file_name": file_name,
         "mapping": mapping_res.get("mapping"),
         "signature_verification": sig_res,
-        "image_info": mapping_res.get("image_info")
+        "image_info": mapping_res.get("image_info"),
+        "timings": timings,
     }
-    return combined
-
-async def _save_upload_to_dir(upload: UploadFile, target_dir: str) -> str:
-    """Save FastAPI UploadFile to disk and return the path."""
-    dest_path = os.path.join(target_dir, os.path.basename(upload.filename))
-    content = await upload.read()
-    with open(dest_path, "wb") as out_f:
-        out_f.write(content)
-    return dest_path
-
-def _extract_zip_to_dir(zip_path: str, target_dir: str) -> List[str]:
-    """Extract all files from zip_path into target_dir and return allowed file paths."""
-    extracted = []
-    with zipfile.ZipFile(zip_path, "r") as zf:
-        for member in zf.infolist():
-            if member.is_dir():
-                continue
-            name = os.path.basename(member.filename)
-            if not name:
-                continue
-            target_path = os.path.join(target_dir, name)
-            with zf.open(member) as src, open(target_path, "wb") as dst:
-                shutil.copyfileobj(src, dst)
-            # only keep files with allowed extensions
-            _, ext = os.path.splitext(target_path)
-            if ext.lower() in ALLOWED_EXT:
-                extracted.append(target_path)
-            else:
-                # Optionally remove unsupported files
-                try:
-                    os.remove(target_path)
-                except Exception:
-                    pass
-    return extracted
 
-async def process_zip_main(upload: UploadFile, model: str) -> dict:
-    workspace = tempfile.mkdtemp(prefix="di_api_")
+async def iter_process_documents(documents: AsyncIterator[Tuple[str, Union[bytes, Exception]]], model: str,
+                                 options: Optional[ProcessingOptions] = None,
+                                 max_inflight: int = Config.INGEST_MAX_INFLIGHT_DOCUMENTS):
+    """
+    Process (name, data) documents as the ingest stage produces them and yield
+    (index, result_record) pairs in completion order.
+
+    At most `max_inflight` unique documents are being processed at once; the next
+    document is only pulled (decompressed) when a slot frees up, which keeps memory
+    bounded for large archives. A document identical to one still in flight is not
+    processed again but gets that document's result. Pending work is cancelled if the
+    consumer stops iterating early.
+    """
+    doc_iter = documents.__aiter__()
+    tasks: Dict[asyncio.Task, str] = {}
+    waiters: Dict[str, List[Tuple[int, str]]] = {}  # content hash -> [(index, file name)]
+    next_doc: Optional[asyncio.Future] = None
+    exhausted = False
+    index = 0
     try:
-        # save uploaded zip to workspace
-        zip_path = await _save_upload_to_dir(upload, workspace)
-
-        _, ext = os.path.splitext(zip_path)
-        ext = ext.lower()
-
-        # extract allowed files
-        if ext == ".zip":
-            saved_files = _extract_zip_to_dir(zip_path, workspace)
-        else:
-            saved_files = [zip_path]
+        while True:
+            if not exhausted and next_doc is None and len(tasks) < max_inflight:
+                next_doc = asyncio.ensure_future(doc_iter.__anext__())
+            wait_for = set(tasks)
+            if next_doc is not None:
+                wait_for.add(next_doc)
+            if not wait_for:
+                break
+
+            done, _ = await asyncio.wait(wait_for, return_when=asyncio.FIRST_COMPLETED)
+
+            if next_doc is not None and next_doc in done:
+                doc_future, next_doc = next_doc, None
+                try:
+                    name, data = doc_future.result()
+                except StopAsyncIteration:
+                    exhausted = True
+                else:
+                    file_name = os.path.basename(name)
+                    if isinstance(data, Exception):
+                        yield index, {"file_name": file_name, "error": f"Could not read file: {data}", "timings": {}}
+                    else:
+                        content_hash = sha256_bytes(data)
+                        if content_hash in waiters:
+                            logger.info("[%s] identical to a document in flight, reusing its result", file_name)
+                            waiters[content_hash].append((index, file_name))
+                        else:
+                            waiters[content_hash] = [(index, file_name)]
+                            doc = DocumentArtifact(name, data, content_hash=content_hash)
+                            task = asyncio.create_task(_process_document(doc, model, options))
+                            tasks[task] = content_hash
+                    index += 1
+
+            for task in done:
+                if task not in tasks:
+                    continue
+                # drop our reference so the document's bytes can be freed once the consumer is done with them
+                content_hash = tasks.pop(task)
+                mapping_res, sig_res, timings = task.result()
+                for idx, file_name in waiters.pop(content_hash):
+                    yield idx, _combine_results(file_name, mapping_res, sig_res, timings)
+    finally:
+        if next_doc is not None:
+            next_doc.cancel()
+        for task in tasks:
+            task.cancel()
 
-        if not saved_files:
-            raise HTTPException(
-                status_code=400,
-                detail=f"No supported files found in uploaded zip (allowed extensions: {', '.join(sorted(ALLOWED_EXT))})"
-            )
-        
-         # Create a flat list of all tasks
-        tasks = []
-        for path in saved_files:
-            tasks.append(pipeline_mapping(path, model))
-            tasks.append(pipeline_signature(path, model))
-
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-
-        # Reassemble results safely
-        combined_results = []
-        for i, path in enumerate(saved_files):
-            file_name = os.path.basename(path)
-            
-            # Get results for the current file
-            mapping_res = results[2 * i]
-            sig_res = results[2 * i + 1]
-
-            if isinstance(mapping_res, Exception):
-                logger.error("Mapping failed for %s: %s", file_name, mapping_res)
-                combined_results.append({"file_name": file_name, "error": f"Mapping process failed: {mapping_res}"})
-                continue # Skip to the next file
-            
-            if isinstance(sig_res, Exception):
-                logger.error("Signature check failed for %s: %s", file_name, sig_res)
-                combined_results.append({"file_name": file_name, "error": f"Signature process failed: {sig_res}"})
-                continue # Skip to the next file
-
-            # If both succeeded, append the combined result
-            combined_results.append({
-                "file_name": file_name,
-                "mapping": mapping_res.get("mapping"),
-                "signature_verification": sig_res,
-                "image_info": mapping_res.get("image_info")
-            })
+async def process_zip_main(upload: UploadFile, model: str, options: Optional[ProcessingOptions] = None) -> dict:
+    source = await open_upload(upload)
+    try:
+        # Reassemble results in input order
+        combined_results: List[Dict[str, Any]] = [None] * len(source.names)
+        async for idx, record in iter_process_documents(source.iter_documents(), model, options):
+            combined_results[idx] = record
 
         return {
             "model": model,
@@ -316,7 +636,4 @@ async def process_zip_main(upload: UploadFile, model: str) -> dict:
         }
 
     finally:
-        try:
-            shutil.rmtree(workspace)
-        except Exception as cleanup_exc:
-            logger.warning("Failed to remove workspace %s: %s", workspace, cleanup_exc)
\ No newline at end of file
+        source.close()
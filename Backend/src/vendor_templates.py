@@ -0,0 +1,450 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+import numpy as np
+from config.config import Config
+from src.adapters.logger import logger
+from src.extracted_items import ExtractedItems
+from src.text_index import normalize_text
+
+PageSizes = Dict[int, Tuple[float, float]]
+
+_GSTIN = re.compile(r"\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]")
+# top-of-page titles shared by every vendor; never used as the vendor name
+_GENERIC_TITLES = {
+    "invoice", "taxinvoice", "proformainvoice", "commercialinvoice", "billofsupply", "creditnote", "debitnote",
+    "originalforrecipient", "duplicatefortransporter", "triplicateforsupplier", "original", "duplicate",
+}
+# lines mentioning these belong to the buyer's block; its GSTIN is the same on every supplier's invoice
+_BUYER_MARKERS = ("buyer", "billto", "billedto", "shipto", "shippedto", "consignee", "recipient", "customer",
+                  "soldto", "deliverto", "receiver")
+_LAYOUT_COLUMNS = 8  # page columns used in the layout signature (rows shift with address lengths)
+
+
+def _is_label(text: str) -> bool:
+    """Text that does not change between invoices of a vendor: short, some letters, no digits."""
+    t = (text or "").strip()
+    return 2 <= len(t) <= 40 and not any(c.isdigit() for c in t) and sum(c.isalpha() for c in t) >= 2
+
+
+def normalized_boxes(items: ExtractedItems, page_sizes: PageSizes) -> np.ndarray:
+    """(n, 4) item boxes as fractions of their page size; NaN where the box or page size is unknown."""
+    boxes = items.bounding_boxes().astype(np.float64)
+    scale = np.full((len(items), 2), np.nan)
+    for page, (width, height) in page_sizes.items():
+        if width and height:
+            scale[items.pages == page] = (width, height)
+    boxes[:, 0::2] /= scale[:, :1]
+    boxes[:, 1::2] /= scale[:, 1:]
+    return boxes
+
+
+def _field_scores(boxes: np.ndarray, expected: Sequence[float], tolerance: float) -> np.ndarray:
+    """
+    How well each box sits where a template field is expected, in [0, 1].
+
+    The rows must overlap vertically and the left or right edge must stay within
+    `tolerance` (values are left- or right-aligned; their width changes with the text).
+    """
+    ex0, ey0, ex1, ey1 = expected
+    overlap_y = np.minimum(boxes[:, 3], ey1) - np.maximum(boxes[:, 1], ey0)
+    height = np.maximum(boxes[:, 3] - boxes[:, 1], ey1 - ey0)
+    y_score = np.clip(overlap_y / np.where(height > 0, height, 1.0), 0.0, 1.0)
+    edge = np.minimum(np.abs(boxes[:, 0] - ex0), np.abs(boxes[:, 2] - ex1))
+    x_score = np.clip(1.0 - edge / tolerance, 0.0, 1.0)
+    overlap_x = np.minimum(boxes[:, 2], ex1) - np.maximum(boxes[:, 0], ex0)
+    scores = y_score * x_score * (overlap_x > 0)
+    return np.nan_to_num(scores, nan=0.0)
+
+
+def _single_polygon(polygon: Any) -> Optional[np.ndarray]:
+    """(k, 2) points of a mapped field's polygon; None for missing or multi-item polygons."""
+    try:
+        pts = np.asarray(polygon, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    if pts.ndim != 2 or pts.shape[1] != 2 or not len(pts):
+        return None
+    return pts
+
+
+class _DocumentLayout:
+    """Per-document view used for fingerprinting, learning and matching."""
+
+    def __init__(self, items: ExtractedItems, page_sizes: PageSizes):
+        self.items = items
+        self.boxes = normalized_boxes(items, page_sizes)
+        self.lines = items.type_mask("line")
+        self.first_page = int(items.pages.min()) if len(items) else 0
+        self._labels: Dict[int, Dict[str, List[int]]] = {}
+
+    def labels(self, page: int) -> Dict[str, List[int]]:
+        """Normalized label text -> line indexes on `page`."""
+        if page not in self._labels:
+            found: Dict[str, List[int]] = {}
+            for i in np.flatnonzero(self.lines & (self.items.pages == page)).tolist():
+                text = self.items.texts[i]
+                if _is_label(text) and not np.isnan(self.boxes[i, 0]):
+                    found.setdefault(normalize_text(text), []).append(i)
+            self._labels[page] = found
+        return self._labels[page]
+
+    def _first_page_lines(self) -> List[int]:
+        return np.flatnonzero(self.lines & (self.items.pages == self.first_page)).tolist()
+
+    def vendor_name(self) -> Optional[Tuple[int, str]]:
+        """(line index, normalized text) of the first name-like line: the seller header on most invoices."""
+        for i in self._first_page_lines():
+            text = self.items.texts[i]
+            key = normalize_text(text)
+            if _is_label(text) and len(key) >= 4 and key not in _GENERIC_TITLES:
+                return i, key
+        return None
+
+    def gstins(self) -> List[Tuple[int, str]]:
+        """(line index, GSTIN) of every GSTIN printed on the first page."""
+        found = []
+        for i in self._first_page_lines():
+            for m in _GSTIN.finditer(self.items.texts[i].upper().replace(" ", "")):
+                found.append((i, m.group(0)))
+        return found
+
+    def vendor_key(self, shared_gstins: Set[str] = frozenset()) -> Optional[str]:
+        """
+        The supplier's GSTIN, else the vendor name line.
+
+        Invoices usually carry the buyer's GSTIN too, and it is identical on every
+        supplier's invoice. GSTINs on buyer-block lines ("Bill To", "Consignee", ...) and
+        those already seen under several vendor names (`shared_gstins`) are skipped; of
+        the rest, the one printed nearest the vendor name wins.
+        """
+        name = self.vendor_name()
+        candidates = [
+            (i, gstin) for i, gstin in self.gstins()
+            if gstin not in shared_gstins and not any(m in normalize_text(self.items.texts[i]) for m in _BUYER_MARKERS)
+        ]
+        if candidates:
+            if name is not None and not np.isnan(self.boxes[name[0], 0]):
+                ref = self.boxes[name[0], :2]
+                _, gstin = min(candidates, key=lambda c: float(np.nan_to_num(np.hypot(*(self.boxes[c[0], :2] - ref)), nan=np.inf)))
+            else:
+                _, gstin = candidates[0]
+            return f"gstin:{gstin}"
+        return f"name:{name[1]}" if name is not None else None
+
+    def layout_signature(self) -> Set[str]:
+        """Labels of the first page with the page column they start in, e.g. "1:invoiceno"."""
+        signature = set()
+        for key, idxs in self.labels(self.first_page).items():
+            for i in idxs:
+                col = min(_LAYOUT_COLUMNS - 1, max(0, int(self.boxes[i, 0] * _LAYOUT_COLUMNS)))
+                signature.add(f"{col}:{key}")
+        return signature
+
+    def nearest_label(self, page: int, box: Sequence[float], exclude: int) -> Optional[Dict[str, Any]]:
+        """Closest label line above or left of `box`, as a template anchor."""
+        best, best_dist = None, Config.VENDOR_TEMPLATE_ANCHOR_MAX_DISTANCE
+        for text, idxs in self.labels(page).items():
+            for i in idxs:
+                if i == exclude:
+                    continue
+                ax0, ay0, ax1, ay1 = self.boxes[i]
+                if ay0 > box[3] or ax0 > box[2]:  # below or right of the value
+                    continue
+                dist = float(np.hypot(box[0] - ax0, box[1] - ay0))
+                if dist < best_dist:
+                    best, best_dist = {"text": text, "box": [float(v) for v in self.boxes[i]]}, dist
+        return best
+
+    def place(self, spec: Dict[str, Any]) -> Tuple[Optional[int], float]:
+        """Item the template field `spec` points at in this document, with its geometric score."""
+        page = spec["page"]
+        expected = np.asarray(spec["box"], dtype=np.float64)
+        penalty = 1.0
+        anchor = spec.get("anchor")
+        if anchor:
+            candidates = self.labels(page).get(anchor["text"], [])
+            if candidates:
+                # follow the label if the block moved (longer address above it, ...)
+                ref = np.asarray(anchor["box"][:2])
+                nearest = min(candidates, key=lambda i: float(np.hypot(*(self.boxes[i, :2] - ref))))
+                shift = self.boxes[nearest, :2] - ref
+                expected = expected + np.tile(shift, 2)
+            else:
+                penalty = 0.5
+        mask = (self.items.pages == page) & (self.lines if spec.get("type") == "line" else ~self.lines)
+        candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return None, 0.0
+        scores = _field_scores(self.boxes[candidates], expected, Config.VENDOR_TEMPLATE_POSITION_TOLERANCE)
+        best = int(np.argmax(scores))
+        return int(candidates[best]), float(scores[best]) * penalty
+
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if (a or b) else 0.0
+
+
+class VendorTemplateStore:
+    """
+    Learned field positions per supplier layout, so repeat vendors are mapped without GPT.
+
+    After a GPT mapping, every field that points at a single item is stored with its
+    page-normalized box, item type and the nearest label line above/left of it (the
+    anchor). Templates are keyed by a vendor fingerprint: the supplier's GSTIN (or the
+    first name-like line) plus a layout hash of the first page's labels and their
+    columns. A GSTIN seen next to several vendor names is a buyer's and is ignored.
+
+    A later document of the same vendor whose labels mostly coincide (Jaccard
+    similarity of the layout signatures) is mapped locally when every field lands on
+    an item at the expected, anchor-corrected position, and only when the learned
+    fields cover every key of the vendor's last GPT mapping (text-only and multi-item
+    fields cannot be read off the layout). Templates are only used once
+    they were confirmed by Config.VENDOR_TEMPLATE_MIN_OBSERVATIONS consistent GPT
+    mappings; anything less confident falls back to GPT, which then refreshes the template.
+    """
+
+    def __init__(self, db_path: Optional[str], per_vendor: int):
+        self.db_path = db_path
+        self.per_vendor = per_vendor
+        self._lock = threading.Lock()
+        self._templates: Dict[str, List[Dict[str, Any]]] = {}  # vendor -> templates
+        self._gstin_names: Dict[str, Set[str]] = {}  # GSTIN -> vendor names it was printed next to
+        self.counters: Dict[str, int] = {
+            "lookups": 0, "no_fingerprint": 0, "no_template": 0, "unconfirmed": 0, "incomplete": 0,
+            "low_confidence": 0, "hits": 0, "learned": 0, "confirmed": 0, "relearned": 0,
+        }
+        self._conn: Optional[sqlite3.Connection] = None
+        if db_path:
+            try:
+                os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+                self._conn = sqlite3.connect(db_path, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS templates ("
+                    " id TEXT PRIMARY KEY,"
+                    " vendor TEXT NOT NULL,"
+                    " value TEXT NOT NULL,"
+                    " updated_at REAL NOT NULL)"
+                )
+                self._conn.commit()
+                for (raw,) in self._conn.execute("SELECT value FROM templates ORDER BY updated_at"):
+                    template = json.loads(raw)
+                    self._templates.setdefault(template["vendor"], []).append(template)
+                    self._observe_gstins(template.get("gstins", []), template.get("name"))
+            except Exception as e:
+                logger.warning(f"[templates] persistence disabled, could not open {db_path}: {e}")
+                self._conn = None
+
+    def _save(self, template: Dict[str, Any]) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO templates (id, vendor, value, updated_at) VALUES (?, ?, ?, ?)",
+                (template["id"], template["vendor"], json.dumps(template), template["updated_at"]),
+            )
+            self._conn.commit()
+        except Exception as e:
+            logger.warning(f"[templates] write failed for {template['id']}: {e}")
+
+    def _delete(self, template_ids: Sequence[str]) -> None:
+        if self._conn is None or not template_ids:
+            return
+        try:
+            self._conn.executemany("DELETE FROM templates WHERE id = ?", [(t,) for t in template_ids])
+            self._conn.commit()
+        except Exception as e:
+            logger.warning(f"[templates] delete failed: {e}")
+
+    def _observe_gstins(self, gstins: Sequence[str], name: Optional[str]) -> List[str]:
+        """Remember which vendor names each GSTIN appeared with; returns GSTINs that just became shared."""
+        if not name:
+            return []
+        newly_shared = []
+        for gstin in gstins:
+            names = self._gstin_names.setdefault(gstin, set())
+            if name not in names:
+                names.add(name)
+                if len(names) == Config.VENDOR_TEMPLATE_SHARED_GSTIN_NAMES:
+                    newly_shared.append(gstin)
+        return newly_shared
+
+    def _shared_gstins(self) -> Set[str]:
+        limit = Config.VENDOR_TEMPLATE_SHARED_GSTIN_NAMES
+        return {g for g, names in self._gstin_names.items() if len(names) >= limit}
+
+    def _closest(self, vendor: str, signature: Set[str]) -> Tuple[Optional[Dict[str, Any]], float]:
+        best, best_sim = None, 0.0
+        for template in self._templates.get(vendor, []):
+            sim = _jaccard(signature, set(template["layout"]))
+            if sim > best_sim:
+                best, best_sim = template, sim
+        if best_sim < Config.VENDOR_TEMPLATE_LAYOUT_SIMILARITY:
+            return None, best_sim
+        return best, best_sim
+
+    def match(self, items: ExtractedItems, page_sizes: PageSizes) -> Optional[Dict[str, Any]]:
+        """
+        {"mapped", "template", "confidence"} when a confirmed template fits this document
+        with high geometric confidence, else None (map with GPT).
+        """
+        layout = _DocumentLayout(items, page_sizes)
+        with self._lock:
+            shared = self._shared_gstins()
+        vendor = layout.vendor_key(shared) if len(items) else None
+        with self._lock:
+            self.counters["lookups"] += 1
+            if vendor is None:
+                self.counters["no_fingerprint"] += 1
+                return None
+            template, similarity = self._closest(vendor, layout.layout_signature())
+            if template is None:
+                self.counters["no_template"] += 1
+                return None
+            if template["observations"] < Config.VENDOR_TEMPLATE_MIN_OBSERVATIONS:
+                self.counters["unconfirmed"] += 1
+                return None
+            fields = dict(template["fields"])
+            # templates persisted before "keys" was recorded are treated as incomplete until relearned
+            missing = set(template.get("keys") or ["?"]) - set(fields)
+            if missing:
+                self.counters["incomplete"] += 1
+                logger.info("template %s does not cover %s, using GPT", template["id"], sorted(missing))
+                return None
+
+        mapped: Dict[str, Any] = {}
+        scores = []
+        for key, spec in fields.items():
+            idx, score = layout.place(spec)
+            scores.append(score)
+            if idx is None or score < Config.VENDOR_TEMPLATE_MIN_FIELD_SCORE:
+                logger.info("template %s: field %s not found (score %.2f), using GPT", template["id"], key, score)
+                with self._lock:
+                    self.counters["low_confidence"] += 1
+                return None
+            item = items[idx]
+            mapped[key] = {"text": item.text, "polygon": item.polygon, "page": item.page}
+        confidence = float(np.mean(scores)) if scores else 0.0
+        with self._lock:
+            if confidence < Config.VENDOR_TEMPLATE_MIN_CONFIDENCE:
+                self.counters["low_confidence"] += 1
+                return None
+            self.counters["hits"] += 1
+            template["hits"] = template.get("hits", 0) + 1
+        return {
+            "mapped": mapped,
+            "template": {"id": template["id"], "vendor": vendor, "layout_similarity": round(similarity, 3)},
+            "confidence": round(confidence, 3),
+        }
+
+    def learn(self, items: ExtractedItems, mapped: Dict[str, Any], page_sizes: PageSizes) -> Optional[str]:
+        """Record (or confirm) the template for a GPT-mapped document. Returns the template id."""
+        layout = _DocumentLayout(items, page_sizes)
+        name = layout.vendor_name()
+        name_key = name[1] if name is not None else None
+        gstins = sorted({g for _, g in layout.gstins()})
+        with self._lock:
+            newly_shared = self._observe_gstins(gstins, name_key)
+            # templates filed under a GSTIN that turned out to be a buyer's mix several suppliers
+            for gstin in newly_shared:
+                dropped = [t["id"] for t in self._templates.pop(f"gstin:{gstin}", [])]
+                self._delete(dropped)
+                if dropped:
+                    logger.info("[templates] GSTIN %s appears under several vendors; dropped %d templates",
+                                gstin, len(dropped))
+            shared = self._shared_gstins()
+        vendor = layout.vendor_key(shared) if len(items) else None
+        if vendor is None:
+            return None
+        tolerance = Config.VENDOR_TEMPLATE_POSITION_TOLERANCE
+
+        fields: Dict[str, Dict[str, Any]] = {}
+        for key, value in (mapped or {}).items():
+            if not isinstance(value, dict) or not isinstance(value.get("page"), int):
+                continue
+            pts = _single_polygon(value.get("polygon"))
+            size = page_sizes.get(value["page"])
+            if pts is None or not size or not size[0] or not size[1]:
+                continue
+            box = [pts[:, 0].min() / size[0], pts[:, 1].min() / size[1], pts[:, 0].max() / size[0], pts[:, 1].max() / size[1]]
+            on_page = np.flatnonzero(items.pages == value["page"])
+            if not len(on_page):
+                continue
+            # the item the field came from: the box it was copied from scores ~1
+            scores = _field_scores(layout.boxes[on_page], box, tolerance)
+            best = int(np.argmax(scores))
+            if scores[best] < 0.9:
+                continue
+            idx = int(on_page[best])
+            fields[key] = {
+                "page": value["page"],
+                "type": "line" if layout.lines[idx] else "word",
+                "box": [float(v) for v in box],
+                "anchor": layout.nearest_label(value["page"], box, exclude=idx),
+            }
+        if len(fields) < Config.VENDOR_TEMPLATE_MIN_FIELDS:
+            return None
+
+        signature = layout.layout_signature()
+        now = time.time()
+        with self._lock:
+            template, _ = self._closest(vendor, signature)
+            if template is not None:
+                old = template["fields"]
+                same = [
+                    k for k in fields
+                    if k in old and old[k]["page"] == fields[k]["page"]
+                    and _field_scores(np.asarray([fields[k]["box"]]), old[k]["box"], tolerance)[0] >= 0.5
+                ]
+                consistent = len(same) >= 0.8 * max(len(fields), len(old))
+                template["observations"] = template["observations"] + 1 if consistent else 1
+                self.counters["confirmed" if consistent else "relearned"] += 1
+            else:
+                template = {
+                    "id": f"{vendor}:{hashlib.sha1(' '.join(sorted(signature)).encode('utf-8')).hexdigest()[:12]}",
+                    "vendor": vendor,
+                    "observations": 1,
+                    "hits": 0,
+                }
+                templates = self._templates.setdefault(vendor, [])
+                templates.append(template)
+                evicted = [t["id"] for t in templates[:-self.per_vendor]] if len(templates) > self.per_vendor else []
+                del templates[:len(evicted)]
+                self._delete(evicted)
+                self.counters["learned"] += 1
+            template.update({"layout": sorted(signature), "fields": fields, "keys": sorted(mapped or {}),
+                             "name": name_key, "gstins": gstins, "updated_at": now})
+            self._save(template)
+            return template["id"]
+
+    def invalidate(self, vendor: Optional[str] = None) -> int:
+        """Forget the templates of one vendor (e.g. "gstin:27ABCDE1234F1Z5"), or all of them."""
+        with self._lock:
+            vendors = [vendor] if vendor is not None else list(self._templates)
+            if vendor is None:
+                self._gstin_names.clear()
+            ids = [t["id"] for v in vendors for t in self._templates.pop(v, [])]
+            self._delete(ids)
+            return len(ids)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.counters["lookups"]
+            return {
+                **self.counters,
+                "templates": sum(len(t) for t in self._templates.values()),
+                "vendors": len(self._templates),
+                "hit_rate": (self.counters["hits"] / lookups) if lookups else 0.0,
+            }
+
+
+template_store = VendorTemplateStore(
+    db_path=Config.VENDOR_TEMPLATE_DB_PATH,
+    per_vendor=Config.VENDOR_TEMPLATES_PER_VENDOR,
+)
@@ -44,6 +44,13 @@ function showState(state) {
 }
 
 /* ---------- Polygon Processing Functions ---------- */
+function base64ToBytes(b64) {
+    const binaryString = atob(b64);
+    const bytes = new Uint8Array(binaryString.length);
+    for (let i = 0; i < binaryString.length; i++) bytes[i] = binaryString.charCodeAt(i);
+    return bytes;
+}
+
 function normalizePolygon(polygon, imageWidth, imageHeight) {
     if (!polygon || !Array.isArray(polygon)) return [];
     
@@ -140,6 +147,7 @@ class App {
         // PDF rendering state
         this.pdfDoc = null;
         this.pdfPage = null;
+        this.pageNumber = 1; // the preview shows the first page only
         this.currentPdfBytes = null;
         // Image dimensions for polygon scaling
         this.imageWidth = 1000;
@@ -395,8 +403,14 @@ class App {
 
     async loadDocumentPreview(item) {
         try {
-            if (item.preview && item.preview.pdf_bytes) {
-                await this.loadPdfPreview(item.preview.pdf_bytes);
+            if (item.preview && item.preview.url) {
+                await this.loadPdfPreview({ url: `${API_BASE_URL}${item.preview.url}` });
+                if (!this.imageLoaded && item.preview.thumb_url) {
+                    this.loadThumbnailPreview(item.preview.thumb_url);
+                }
+            }
+            else if (item.preview && item.preview.pdf_bytes) {
+                await this.loadPdfPreview(base64ToBytes(item.preview.pdf_bytes));
             }
             else if (this.apiFiles.length === 1 && this.originalFileURL) {
                 this.previewImg.src = this.originalFileURL;
@@ -410,14 +424,10 @@ class App {
         }
     }
 
-    async loadPdfPreview(pdfBytesBase64) {
+    // source: { url } (fetched by pdf.js with range requests) or raw bytes
+    async loadPdfPreview(source) {
         try {
-            const binaryString = atob(pdfBytesBase64);
-            const bytes = new Uint8Array(binaryString.length);
-            for (let i = 0; i < binaryString.length; i++) {
-                bytes[i] = binaryString.charCodeAt(i);
-            }
-            const loadingTask = pdfjsLib.getDocument({ data: bytes });
+            const loadingTask = pdfjsLib.getDocument(source instanceof Uint8Array ? { data: source } : source);
             this.pdfDoc = await loadingTask.promise;
             this.pdfPage = await this.pdfDoc.getPage(1);
 
@@ -431,6 +441,15 @@ class App {
         }
     }
 
+    // Fallback when pdf.js cannot open the PDF: a server-rendered JPEG sized for the canvas
+    loadThumbnailPreview(thumbUrl) {
+        const container = $("#documentContainer");
+        const dpr = window.devicePixelRatio || 1;
+        const width = Math.round((container?.clientWidth || 800) * dpr);
+        const height = Math.round((container?.clientHeight || 1100) * dpr);
+        this.previewImg.src = `${API_BASE_URL}${thumbUrl}?width=${width}&height=${height}&page=${this.pageNumber}`;
+    }
+
     buildTableFromMappedData(mappedData) {
         this.highlightKeys = [];
         const entries = Object.entries(mappedData).filter(([key, value]) => 
@@ -579,6 +598,8 @@ class App {
         for (const key of this.highlightKeys) {
             const fieldData = this.currentFileData.mapped_data[key];
             if (!fieldData || !fieldData.polygon) continue;
+            // fields found on other pages of multi-page documents have no box on this page
+            if (fieldData.page && fieldData.page !== this.pageNumber) continue;
             
             const absolutePolygon = normalizePolygon(fieldData.polygon, this.imageWidth, this.imageHeight);
             if (absolutePolygon.length < 3) continue;